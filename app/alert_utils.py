@@ -0,0 +1,260 @@
+import os
+import json
+import threading
+import time
+import uuid
+import logging
+from collections import deque
+
+app_logger = logging.getLogger('proxima-ui')
+
+# Where threshold settings and alert history are kept between restarts
+ALERT_SETTINGS_FILE = os.getenv('ALERT_SETTINGS_FILE', 'alert_settings.json')
+ALERT_HISTORY_FILE = os.getenv('ALERT_HISTORY_FILE', 'alert_history.jsonl')
+
+# Number of alert events (fired and resolved) kept in memory and reloaded from the history file
+ALERT_HISTORY_SIZE = int(os.getenv('ALERT_HISTORY_SIZE', 500))
+
+# A metric must breach its threshold on this many consecutive polls before an alert fires
+ALERT_TRIGGER_POLLS = int(os.getenv('ALERT_TRIGGER_POLLS', 2))
+
+# An active alert clears only once the metric drops this many points below the threshold
+ALERT_CLEAR_MARGIN = float(os.getenv('ALERT_CLEAR_MARGIN', 5))
+
+DEFAULT_ALERT_SETTINGS = {
+    'enable_resource_alerts': True,
+    'cpu_threshold': 80,
+    'cpu_alert_level': 'warning',
+    'memory_threshold': 85,
+    'memory_alert_level': 'warning',
+    'storage_threshold': 90,
+    'storage_alert_level': 'danger',
+    'show_alerts_dashboard': True,
+    'show_popup_notifications': True,
+    'play_alert_sound': False
+}
+
+
+def resource_metrics(snapshot):
+    """Yield (resource key, label, metric, percent) for everything alerts are evaluated on"""
+    for node in snapshot['nodes']:
+        if node.get('status') != 'online':
+            continue
+        key = f"node/{node['node']}"
+        label = f"Node {node['node']}"
+        yield key, label, 'cpu', (node.get('cpu') or 0) * 100
+        if node.get('maxmem'):
+            yield key, label, 'memory', node.get('mem', 0) / node['maxmem'] * 100
+
+    for guest in snapshot['guests']:
+        if guest.get('status') != 'running' or guest.get('template') in (1, '1', True):
+            continue
+        key = f"{guest['type']}/{guest['vmid']}"
+        label = f"{'VM' if guest['type'] == 'qemu' else 'Container'} {guest.get('name') or guest['vmid']}"
+        yield key, label, 'cpu', (guest.get('cpu') or 0) * 100
+        if guest.get('maxmem'):
+            yield key, label, 'memory', guest.get('mem', 0) / guest['maxmem'] * 100
+        # Only containers report filesystem usage without a guest agent
+        if guest.get('disk') and guest.get('maxdisk'):
+            yield key, label, 'storage', guest['disk'] / guest['maxdisk'] * 100
+
+    for storage in snapshot['storage']:
+        if storage.get('maxdisk'):
+            key = f"storage/{storage.get('node')}/{storage.get('storage')}"
+            label = f"Storage {storage.get('storage')} on {storage.get('node')}"
+            yield key, label, 'storage', storage.get('disk', 0) / storage['maxdisk'] * 100
+
+
+class AlertEngine:
+    """Evaluates resource thresholds against every inventory poll.
+
+    Alerts fire after ALERT_TRIGGER_POLLS consecutive breaches and clear once the
+    value drops ALERT_CLEAR_MARGIN points below the threshold, so values hovering
+    around a threshold don't flap. There is at most one active alert per
+    (host, resource, metric). Listeners registered with add_listener() are called
+    with (host_id, fired, resolved, active) whenever alerts change.
+    """
+
+    def __init__(self, settings_file=ALERT_SETTINGS_FILE, history_file=ALERT_HISTORY_FILE,
+                 history_size=ALERT_HISTORY_SIZE):
+        self.settings_file = settings_file
+        self.history_file = history_file
+        self.settings = dict(DEFAULT_ALERT_SETTINGS)
+        self.active = {}
+        self.breaches = {}
+        self.history = deque(maxlen=history_size)
+        # Lines in the history file; it is compacted to the in-memory history when this doubles it
+        self.history_lines = 0
+        self.listeners = []
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            if self.settings_file and os.path.exists(self.settings_file):
+                with open(self.settings_file, 'r') as f:
+                    self.settings.update(json.load(f))
+        except Exception as e:
+            app_logger.error(f"Error loading alert settings: {str(e)}")
+
+        try:
+            if self.history_file and os.path.exists(self.history_file):
+                with open(self.history_file, 'r') as f:
+                    for line in f:
+                        if line.strip():
+                            self.history.append(json.loads(line))
+                # Events older than the last history_size are dropped from the file as well
+                self._compact()
+        except Exception as e:
+            app_logger.error(f"Error loading alert history: {str(e)}")
+
+    def _compact(self):
+        # Callers hold self.lock (or run before the engine is shared)
+        try:
+            with open(self.history_file, 'w') as f:
+                f.writelines(json.dumps(alert) + '\n' for alert in self.history)
+            self.history_lines = len(self.history)
+        except Exception as e:
+            app_logger.error(f"Error compacting alert history: {str(e)}")
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def get_settings(self):
+        with self.lock:
+            return dict(self.settings)
+
+    def update_settings(self, settings):
+        """Apply new threshold settings and persist them"""
+        with self.lock:
+            self.settings.update(settings)
+            # Breach counters refer to the old thresholds
+            self.breaches.clear()
+            current = dict(self.settings)
+
+        try:
+            if self.settings_file:
+                with open(self.settings_file, 'w') as f:
+                    json.dump(current, f, indent=2)
+        except Exception as e:
+            app_logger.error(f"Error saving alert settings: {str(e)}")
+        return current
+
+    def _threshold(self, metric):
+        try:
+            return float(self.settings.get(f'{metric}_threshold'))
+        except (TypeError, ValueError):
+            return float(DEFAULT_ALERT_SETTINGS[f'{metric}_threshold'])
+
+    def _record(self, alert):
+        # Callers hold self.lock
+        self.history.append(dict(alert))
+        if not self.history_file:
+            return
+        if self.history_lines >= 2 * self.history.maxlen:
+            self._compact()
+            return
+        try:
+            with open(self.history_file, 'a') as f:
+                f.write(json.dumps(alert) + '\n')
+            self.history_lines += 1
+        except Exception as e:
+            app_logger.error(f"Error writing alert history: {str(e)}")
+
+    def evaluate(self, host_id, snapshot):
+        """Inventory listener: update alerts of one host from a fresh snapshot"""
+        now = time.time()
+        fired, resolved = [], []
+
+        with self.lock:
+            enabled = self.settings.get('enable_resource_alerts', True)
+            seen = set()
+
+            for key, label, metric, value in (resource_metrics(snapshot) if enabled else []):
+                alert_key = (host_id, key, metric)
+                seen.add(alert_key)
+                threshold = self._threshold(metric)
+                alert = self.active.get(alert_key)
+                value = round(value, 1)
+
+                if alert is not None:
+                    alert['value'] = value
+                    alert['last_seen'] = now
+                    alert['peak'] = max(alert['peak'], value)
+                    # A raised threshold clears alerts now below it without waiting for the margin
+                    if value < threshold - ALERT_CLEAR_MARGIN or (value < threshold and threshold > alert['threshold']):
+                        resolved.append(self._resolve(alert_key, now))
+                    continue
+
+                if value < threshold:
+                    self.breaches.pop(alert_key, None)
+                    continue
+
+                self.breaches[alert_key] = self.breaches.get(alert_key, 0) + 1
+                if self.breaches[alert_key] < ALERT_TRIGGER_POLLS:
+                    continue
+
+                del self.breaches[alert_key]
+                alert = {
+                    'id': uuid.uuid4().hex,
+                    'host_id': host_id,
+                    'resource': key,
+                    'name': label,
+                    'metric': metric,
+                    'level': self.settings.get(f'{metric}_alert_level', 'warning'),
+                    'threshold': threshold,
+                    'value': value,
+                    'peak': value,
+                    'status': 'active',
+                    'started': now,
+                    'last_seen': now,
+                    'resolved': None
+                }
+                self.active[alert_key] = alert
+                self._record(alert)
+                fired.append(dict(alert))
+
+            # Resources that stopped, went offline or vanished can't stay in alert
+            for alert_key in [k for k in self.active if k[0] == host_id and k not in seen]:
+                resolved.append(self._resolve(alert_key, now))
+            for alert_key in [k for k in self.breaches if k[0] == host_id and k not in seen]:
+                del self.breaches[alert_key]
+
+            active = [dict(alert) for k, alert in self.active.items() if k[0] == host_id]
+
+        if fired or resolved:
+            app_logger.info(f"Alerts on {host_id}: {len(fired)} fired, {len(resolved)} resolved")
+            for listener in self.listeners:
+                try:
+                    listener(host_id, fired, resolved, active)
+                except Exception as e:
+                    app_logger.warning(f"Alert listener failed for {host_id}: {str(e)}")
+
+    def _resolve(self, alert_key, now):
+        # Callers hold self.lock
+        alert = self.active.pop(alert_key)
+        alert['status'] = 'resolved'
+        alert['resolved'] = now
+        self._record(alert)
+        return dict(alert)
+
+    def active_alerts(self, host_id=None):
+        with self.lock:
+            alerts = [
+                dict(alert) for (alert_host, _, _), alert in self.active.items()
+                if host_id is None or alert_host == host_id
+            ]
+        return sorted(alerts, key=lambda alert: alert['started'], reverse=True)
+
+    def alert_history(self, host_id=None, limit=100):
+        """Most recent alert events (fired and resolved), newest first"""
+        with self.lock:
+            events = [event for event in self.history if host_id is None or event['host_id'] == host_id]
+        return list(reversed(events))[:limit]
+
+    def forget(self, host_id):
+        with self.lock:
+            for alert_key in [k for k in self.active if k[0] == host_id]:
+                del self.active[alert_key]
+            for alert_key in [k for k in self.breaches if k[0] == host_id]:
+                del self.breaches[alert_key]
@@ -1,7 +1,8 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, session, make_response, g
+from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, session, make_response, g, Response
 from flask_bootstrap import Bootstrap
 import os
 import json
+import hashlib
 import re
 from dotenv import load_dotenv
 from proxmoxer import ProxmoxAPI
@@ -14,6 +15,8 @@ import logging  # For application logging
 import sys
 import uuid  # For generating unique IDs
 import requests  # For making HTTP requests
+from urllib.parse import quote
+from collections import Counter
 
 # Set up logging
 log_formatter = logging.Formatter('[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s')
@@ -38,6 +41,36 @@ from app_utils import (
     node_maintenance_route, all_maintenance_route,
     register_all_routes, check_scheduled_maintenance
 )
+from task_utils import (
+    BulkJob, register_job, get_job, list_jobs, wait_for_task, task_succeeded, parallel_map, fetch_calls, RateLimiter
+)
+from inventory_utils import (
+    InventoryPoller, snapshot_guests, snapshot_guest, snapshot_templates, snapshot_node_stats, select_guests
+)
+from snapshot_utils import (
+    SnapshotInventory, snapshot_index, guest_api, guest_disk_storages, valid_snapshot_name, resolve_snapshot_storages
+)
+from firewall_utils import (
+    FirewallInventory, deployable_rule, apply_rules, revert_rules, FIREWALL_MACROS,
+    FIREWALL_DEPLOY_WORKERS, FIREWALL_DEPLOY_MAX_PER_NODE, FIREWALL_DEPLOY_RATE,
+    parse_cidr_list, read_local_list, ipset_diff, ipset_entry_api, IPSET_SYNC_WORKERS, IPSET_SYNC_BATCH
+)
+from identity_utils import (
+    IdentityService, parse_identity_state, identity_diff, apply_identity_operation,
+    IDENTITY_FETCH_WORKERS, IDENTITY_SYNC_WORKERS
+)
+from storage_utils import StorageCollector, StorageHistory, storage_limit_key, STORAGE_FORECAST_WARN_DAYS
+from snapshot_schedule_utils import SnapshotScheduler, SCHEDULE_TYPES, SNAPSHOT_SCHEDULE_CHECK_INTERVAL
+from vmid_utils import VMIDAllocator
+from live_utils import LiveFeed
+from alert_utils import AlertEngine
+from notify_utils import AlertDispatcher, sinks_from_env
+from metrics_utils import MetricsRegistry, InventoryExporter, METRICS_CONTENT_TYPE
+from profile_utils import RouteProfiler, CallCoalescer, instrument_connection, PROFILER_ALLOW_CAPTURE
+from upload_utils import (
+    UploadProgress, UploadSession, UPLOAD_CONTENT_TYPES, stream_to_proxmox,
+    register_upload, get_upload, remove_upload, start_background_upload
+)
 
 # Load environment variables
 load_dotenv()
@@ -51,17 +84,31 @@ bootstrap = Bootstrap(app)
 connection_lock = threading.Lock()
 proxmox_connections = {}
 
+# Application metrics exposed on /metrics
+metrics = MetricsRegistry()
+metrics.histogram('proxima_http_request_duration_seconds', 'Time spent handling requests, by route')
+metrics.counter('proxima_cache_requests_total', 'Cache lookups by cache and result')
+
+# Route timings and the Proxmox calls each request triggers, shown on the profiler page
+profiler = RouteProfiler(metrics)
+
+# Identical GETs within a request (or already in flight) share one Proxmox call
+coalescer = CallCoalescer(metrics)
+
 # Simple cache implementation with TTL
 cache_lock = threading.Lock()
 cache = {}
 
 def get_from_cache(key, ttl=30):
     """Get a value from cache if it exists and is not expired"""
+    cache_name = key.split(':', 1)[0]
     with cache_lock:
         if key in cache:
             cached_time, cached_value = cache[key]
             if time.time() - cached_time < ttl:
+                metrics.inc('proxima_cache_requests_total', cache=cache_name, result='hit')
                 return cached_value
+    metrics.inc('proxima_cache_requests_total', cache=cache_name, result='miss')
     return None
 
 def set_in_cache(key, value, ttl=30):
@@ -79,6 +126,78 @@ def invalidate_cache(prefix=None):
         else:
             cache.clear()
 
+# Storage content catalog shared by the VM/container creation and template pages
+CONTENT_CATALOG_TTL = int(os.getenv('CONTENT_CATALOG_TTL', 300))
+CATALOG_CONTENT_TYPES = ('iso', 'vztmpl')
+
+def get_content_catalog(host_id, node, refresh=False):
+    """Get a node's storages and their ISO/template contents, fetched concurrently and cached"""
+    cache_key = f"catalog:{host_id}:{node}"
+    if not refresh:
+        catalog = get_from_cache(cache_key, ttl=CONTENT_CATALOG_TTL)
+        if catalog is not None:
+            return catalog
+    
+    connection = proxmox_connections[host_id]['connection']
+    storages = connection.nodes(node).storage.get()
+    
+    # Only storages that can hold ISOs or templates need their contents listed
+    content_storages = [
+        storage['storage'] for storage in storages
+        if set(storage.get('content', '').split(',')) & set(CATALOG_CONTENT_TYPES)
+    ]
+    
+    content = {}
+    errors = {}
+    for storage_id, items, error in parallel_map(
+            lambda storage_id: connection.nodes(node).storage(storage_id).content.get(), content_storages):
+        if error:
+            print(f"Error getting content from storage {storage_id}: {str(error)}")
+            errors[storage_id] = str(error)
+        else:
+            content[storage_id] = items
+    
+    catalog = {'storages': storages, 'content': content, 'errors': errors, 'fetched': time.time()}
+    
+    # Don't pin a partial listing in the cache
+    if not errors:
+        set_in_cache(cache_key, catalog)
+    return catalog
+
+def catalog_storages(catalog, content_type):
+    """Storages in a catalog that accept the given content type"""
+    return [dict(storage) for storage in catalog['storages']
+            if content_type in storage.get('content', '').split(',')]
+
+def catalog_items(catalog, content_type):
+    """Copies of all catalog entries of the given content type, tagged with their storage"""
+    items = []
+    for storage_id, content in catalog['content'].items():
+        for item in content:
+            if item.get('content') == content_type:
+                items.append(dict(item, storage=storage_id))
+    return items
+
+def invalidate_content_catalog(host_id):
+    """Drop cached catalogs for every node of a host (shared storages span nodes)"""
+    invalidate_cache(f"catalog:{host_id}:")
+
+def invalidate_content_catalog_when_done(host_id, node, upid):
+    """Drop a host's cached catalogs now and again once a task that changes storage content has stopped"""
+    invalidate_content_catalog(host_id)
+    if not isinstance(upid, str) or not upid.startswith('UPID:'):
+        return
+    
+    # A page loaded while the task runs re-caches the old listing, so the final drop waits for the task
+    def wait():
+        try:
+            wait_for_task(proxmox_connections[host_id]['connection'], node, upid, timeout=6 * 3600)
+        except Exception as e:
+            app_logger.warning(f"Could not follow task {upid} on {host_id}: {str(e)}")
+        invalidate_content_catalog(host_id)
+    
+    threading.Thread(target=wait, daemon=True).start()
+
 # Path to save connections
 CONNECTIONS_FILE = os.getenv('CONNECTIONS_FILE', 'proxmox_connections.pkl')
 
@@ -108,7 +227,7 @@ def load_connections():
                             conn_params['password'] = data['password']
                         
                         # Reconnect to each saved host
-                        proxmox = ProxmoxAPI(**conn_params)
+                        proxmox = instrument_connection(ProxmoxAPI(**conn_params), host_id, profiler, coalescer)
                         
                         # Update connection data with live connection
                         data['connection'] = proxmox
@@ -142,6 +261,49 @@ def save_connections():
 # Initial load
 load_connections()
 
+# Cluster-wide inventory (one cluster/resources call per host), refreshed in the background
+inventory = InventoryPoller(proxmox_connections)
+
+# VMIDs are picked from the inventory and reserved so concurrent creations don't collide
+vmid_allocator = VMIDAllocator(inventory)
+inventory.add_listener(vmid_allocator.sync)
+
+# Snapshots of every guest, crawled concurrently on demand
+snapshot_inventory = SnapshotInventory(proxmox_connections, inventory)
+
+# Persistent snapshot policies, run with jittered starts and pruned by retention
+snapshot_scheduler = SnapshotScheduler(proxmox_connections, inventory, snapshot_inventory)
+
+# Storage usage per pool, node and cluster from the same inventory snapshots
+storage_collector = StorageCollector(proxmox_connections, inventory)
+
+# Storage usage sampled from every poll for growth trends and days-until-full forecasts
+storage_history = StorageHistory()
+inventory.add_listener(storage_history.record)
+
+# Firewall rules of every scope of a host, collected concurrently for auditing
+firewall_inventory = FirewallInventory(proxmox_connections, inventory)
+
+# Users, groups, roles and ACLs of every host, cached and indexed for effective-permission queries
+identity_service = IdentityService(proxmox_connections)
+
+# Resource diffs pushed to browsers, fed by the same inventory poll
+live_feed = LiveFeed()
+inventory.add_listener(live_feed.publish)
+
+# Resource thresholds are evaluated server-side on every poll; only alert changes are pushed
+alert_engine = AlertEngine()
+inventory.add_listener(alert_engine.evaluate)
+alert_engine.add_listener(live_feed.publish_alerts)
+
+# Alert changes are batched into digests for the configured webhook/SMTP/syslog sinks
+alert_dispatcher = AlertDispatcher(sinks_from_env())
+alert_engine.add_listener(alert_dispatcher.enqueue)
+
+# Fleet gauges for /metrics are rendered once per poll, never per scrape
+inventory_exporter = InventoryExporter()
+inventory.add_listener(inventory_exporter.update)
+
 # Custom template filters
 @app.template_filter('timestamp_to_date')
 def timestamp_to_date(timestamp):
@@ -152,19 +314,8 @@ def timestamp_to_date(timestamp):
     except (ValueError, TypeError):
         return 'Invalid date'
 
-@app.route('/')
-def index():
-    # Add current datetime for the dashboard
-    now = datetime.datetime.now()
-    
-    # Log the homepage access
-    app_logger.info(f"Home page accessed, found {len(proxmox_connections)} configured hosts")
-    
-    # If there are no hosts, just return the empty dashboard
-    if not proxmox_connections:
-        return render_template('index.html', hosts=proxmox_connections, now=now)
-    
-    # Gather statistics for the dashboard
+def dashboard_stats():
+    """Aggregate dashboard statistics for all hosts from their inventory snapshots"""
     stats = {
         'vms_total': 0,
         'vms_running': 0,
@@ -176,132 +327,122 @@ def index():
         'nodes': []
     }
     
-    # Track total resource metrics for averaging
-    total_cpu_percent = 0
-    total_memory_percent = 0
-    total_storage_percent = 0
-    resource_count = 0
-    
-    # Gather statistics from all hosts
-    for host_id, host_data in proxmox_connections.items():
-        try:
-            connection = host_data['connection']
-            
-            # Get all nodes for this host
-            nodes = connection.nodes.get()
-            
-            # Track host-specific stats
-            host_stats = {
-                'vms_total': 0,
-                'vms_running': 0,
-                'containers_total': 0,
-                'containers_running': 0,
-                'nodes_total': len(nodes),
-                'nodes_online': 0
-            }
-            
-            # Process each node
-            for node_info in nodes:
-                node_name = node_info['node']
-                
-                # Skip offline nodes
-                if node_info['status'] != 'online':
-                    continue
-                
-                host_stats['nodes_online'] += 1
-                
-                try:
-                    # Get node status
-                    node_status = connection.nodes(node_name).status.get()
-                    
-                    # Calculate memory percentage
-                    memory_total = node_status['memory']['total'] / (1024*1024*1024)  # Convert to GB
-                    memory_used = node_status['memory']['used'] / (1024*1024*1024)    # Convert to GB
-                    memory_percent = (node_status['memory']['used'] / node_status['memory']['total']) * 100
-                    
-                    # Get CPU percentage
-                    cpu_percent = node_status['cpu'] * 100
-                    
-                    # Get storage information
-                    storage_info = connection.nodes(node_name).storage.get()
-                    storage_percent = 0
-                    storage_count = 0
-                    
-                    for storage in storage_info:
-                        if 'total' in storage and storage['total'] > 0:
-                            storage_percent += (storage['used'] / storage['total']) * 100
-                            storage_count += 1
-                    
-                    # Average storage percentage for this node
-                    if storage_count > 0:
-                        storage_percent = storage_percent / storage_count
-                    
-                    # Add to total resource metrics
-                    total_cpu_percent += cpu_percent
-                    total_memory_percent += memory_percent
-                    total_storage_percent += storage_percent
-                    resource_count += 1
-                    
-                    # Get VMs on this node
-                    vms = connection.nodes(node_name).qemu.get()
-                    vm_count = len(vms)
-                    vm_running = sum(1 for vm in vms if vm['status'] == 'running')
-                    
-                    # Get containers on this node
-                    containers = connection.nodes(node_name).lxc.get()
-                    container_count = len(containers)
-                    container_running = sum(1 for ct in containers if ct['status'] == 'running')
-                    
-                    # Update host stats
-                    host_stats['vms_total'] += vm_count
-                    host_stats['vms_running'] += vm_running
-                    host_stats['containers_total'] += container_count
-                    host_stats['containers_running'] += container_running
-                    
-                    # Update global stats
-                    stats['vms_total'] += vm_count
-                    stats['vms_running'] += vm_running
-                    stats['containers_total'] += container_count
-                    stats['containers_running'] += container_running
-                    
-                    # Add node details to the stats
-                    stats['nodes'].append({
-                        'host_id': host_id,
-                        'name': node_name,
-                        'status': node_info['status'],
-                        'cpu': cpu_percent,
-                        'memory_used': memory_used,
-                        'memory_total': memory_total,
-                        'memory_percent': memory_percent,
-                        'storage_percent': storage_percent,
-                        'vms_total': vm_count,
-                        'vms_running': vm_running,
-                        'containers_total': container_count,
-                        'containers_running': container_running,
-                        'uptime': node_status.get('uptime', 0)
-                    })
-                    
-                except Exception as e:
-                    print(f"Error getting data for node {node_name} on host {host_id}: {str(e)}")
-                    continue
-            
-            # Add host stats to host_data for display in host cards
-            host_data['status'] = host_stats
-            
-        except Exception as e:
-            print(f"Error processing host {host_id}: {str(e)}")
+    # Snapshots are usually cached by the poller; missing ones are fetched in parallel
+    for host_id, snapshot, error in parallel_map(inventory.get_snapshot, list(proxmox_connections)):
+        if error:
+            print(f"Error processing host {host_id}: {str(error)}")
             continue
+        
+        node_stats = snapshot_node_stats(snapshot)
+        
+        # Track host-specific stats
+        host_stats = {
+            'vms_total': sum(node['vms_total'] for node in node_stats),
+            'vms_running': sum(node['vms_running'] for node in node_stats),
+            'containers_total': sum(node['containers_total'] for node in node_stats),
+            'containers_running': sum(node['containers_running'] for node in node_stats),
+            'nodes_total': len(snapshot['nodes']),
+            'nodes_online': len(node_stats)
+        }
+        
+        # Add host stats to host_data for display in host cards
+        if host_id in proxmox_connections:
+            proxmox_connections[host_id]['status'] = host_stats
+        
+        for key in ('vms_total', 'vms_running', 'containers_total', 'containers_running'):
+            stats[key] += host_stats[key]
+        stats['nodes'].extend(node_stats)
     
     # Calculate the average health percentages
-    if resource_count > 0:
-        stats['cpu_health_percent'] = 100 - (total_cpu_percent / resource_count)
-        stats['memory_health_percent'] = 100 - (total_memory_percent / resource_count)
-        stats['storage_health_percent'] = 100 - (total_storage_percent / resource_count)
+    if stats['nodes']:
+        count = len(stats['nodes'])
+        stats['cpu_health_percent'] = round(100 - sum(node['cpu'] for node in stats['nodes']) / count, 1)
+        stats['memory_health_percent'] = round(100 - sum(node['memory_percent'] for node in stats['nodes']) / count, 1)
+        stats['storage_health_percent'] = round(100 - sum(node['storage_percent'] for node in stats['nodes']) / count, 1)
     
     # Sort nodes by status (online first) and then by name
     stats['nodes'].sort(key=lambda x: (0 if x['status'] == 'online' else 1, x['name']))
     
-    return render_template('index.html', hosts=proxmox_connections, now=now, stats=stats)
+    return stats
+
+def fragment_etag(template, data):
+    """ETag for a fragment, derived from the data it is rendered from rather than the HTML"""
+    payload = json.dumps([template, data], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+def etag_nodes(nodes):
+    """Node stats for an ETag, with uptime at the table's 0.1 day precision so it does not change every poll"""
+    return [dict(node, uptime=round(node['uptime'] / 8640)) for node in nodes]
+
+def render_fragment(template, etag_data, **context):
+    """Render a partial template, or answer 304 if the client already has this version"""
+    etag = fragment_etag(template, etag_data)
+    
+    if request.if_none_match.contains(etag):
+        # Nothing changed: skip rendering entirely
+        response = make_response('', 304)
+    else:
+        response = make_response(render_template(template, **context))
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/')
+def index():
+    # Add current datetime for the dashboard
+    now = datetime.datetime.now()
+    
+    # Log the homepage access
+    app_logger.info(f"Home page accessed, found {len(proxmox_connections)} configured hosts")
+    
+    # If there are no hosts, just return the empty dashboard
+    if not proxmox_connections:
+        return render_template('index.html', hosts=proxmox_connections, now=now)
+    
+    # Gather statistics for the dashboard
+    stats = dashboard_stats()
+    
+    return render_template('index.html', hosts=proxmox_connections, now=now, stats=stats,
+                           cards_etag=fragment_etag('fragments/dashboard_cards.html',
+                                                    [len(proxmox_connections), dict(stats, nodes=etag_nodes(stats['nodes']))]),
+                           nodes_etag=fragment_etag('fragments/node_rows.html', etag_nodes(stats['nodes'])))
+
+@app.route('/fragments/dashboard/cards')
+def dashboard_cards_fragment():
+    """Dashboard summary cards, answering 304 when the statistics did not change"""
+    stats = dashboard_stats()
+    return render_fragment('fragments/dashboard_cards.html',
+                           [len(proxmox_connections), dict(stats, nodes=etag_nodes(stats['nodes']))],
+                           hosts=proxmox_connections, now=datetime.datetime.now(), stats=stats)
+
+@app.route('/fragments/dashboard/nodes')
+def node_rows_fragment():
+    """Rows of the dashboard node table, answering 304 when no node changed"""
+    stats = dashboard_stats()
+    return render_fragment('fragments/node_rows.html', etag_nodes(stats['nodes']),
+                           hosts=proxmox_connections, stats=stats)
+
+@app.route('/fragments/host/<host_id>/<node>/guests/<guest_type>')
+def guest_rows_fragment(host_id, node, guest_type):
+    """Rows of a node's VM or container table, answering 304 when no listed guest changed"""
+    if host_id not in proxmox_connections or guest_type not in ('qemu', 'lxc'):
+        return jsonify({'success': False, 'error': 'Host not found'}), 404
+    
+    try:
+        guests = snapshot_guests(inventory.get_snapshot(host_id), guest_type, node)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 502
+    
+    # Only the fields the rows display take part in the ETag, so usage jitter still yields 304
+    fields = ('vmid', 'name', 'status', 'maxmem', 'maxcpu', 'tags')
+    guests = sorted(({key: guest.get(key) for key in fields} for guest in guests), key=lambda guest: guest['vmid'])
+    
+    if guest_type == 'qemu':
+        return render_fragment('fragments/vm_rows.html', [host_id, node, guests],
+                               host_id=host_id, node=node, vms=guests)
+    return render_fragment('fragments/container_rows.html', [host_id, node, guests],
+                           host_id=host_id, node=node, containers=guests)
 
 @app.route('/add_host', methods=['GET', 'POST'])
 def add_host():
@@ -356,12 +497,12 @@ def add_host():
                 }
             
             # Test connection
-            proxmox = ProxmoxAPI(**connection_params)
+            host_id = f"{host}:{port}"
+            proxmox = instrument_connection(ProxmoxAPI(**connection_params), host_id, profiler, coalescer)
             version = proxmox.version.get()
             
             # Store connection info
             with connection_lock:
-                host_id = f"{host}:{port}"
                 proxmox_connections[host_id] = {
                     'host': host,
                     'port': port,
@@ -385,6 +526,17 @@ def remove_host(host_id):
     with connection_lock:
         if host_id in proxmox_connections:
             del proxmox_connections[host_id]
+            inventory.forget(host_id)
+            vmid_allocator.forget(host_id)
+            snapshot_inventory.forget(host_id)
+            snapshot_scheduler.forget(host_id)
+            storage_collector.forget(host_id)
+            storage_history.forget(host_id)
+            firewall_inventory.forget(host_id)
+            identity_service.forget(host_id)
+            live_feed.forget(host_id)
+            alert_engine.forget(host_id)
+            inventory_exporter.forget(host_id)
             save_connections()
             flash(f"Host {host_id} removed", 'success')
         else:
@@ -680,8 +832,8 @@ def vm_snapshots(host_id, node, vmid):
     try:
         connection = proxmox_connections[host_id]['connection']
         
-        # Get VM info for name
-        vm_info = connection.nodes(node).qemu(vmid).status.current.get()
+        # The name comes from the inventory rather than an extra status call
+        vm_info = snapshot_guest(inventory.get_snapshot(host_id), vmid) or {}
         
         # Get snapshots
         snapshots = connection.nodes(node).qemu(vmid).snapshot.get()
@@ -713,8 +865,8 @@ def container_snapshots(host_id, node, vmid):
     try:
         connection = proxmox_connections[host_id]['connection']
         
-        # Get container info for name
-        container_info = connection.nodes(node).lxc(vmid).status.current.get()
+        # The name comes from the inventory rather than an extra status call
+        container_info = snapshot_guest(inventory.get_snapshot(host_id), vmid) or {}
         
         # Get snapshots
         snapshots = connection.nodes(node).lxc(vmid).snapshot.get()
@@ -760,6 +912,7 @@ def create_container_snapshot(host_id, node, vmid):
             description=description
         )
         
+        snapshot_inventory.invalidate(host_id)
         flash(f"Snapshot '{name}' created successfully", 'success')
     except Exception as e:
         flash(f"Failed to create snapshot: {str(e)}", 'danger')
@@ -791,16 +944,511 @@ def delete_container_snapshot(host_id, node, vmid, snapname):
         return redirect(url_for('index'))
     
     try:
-        connection = proxmox_connections[host_id]['connection']
-        
-        # Delete snapshot
-        connection.nodes(node).lxc(vmid).snapshot(snapname).delete()
-        
-        flash(f"Snapshot '{snapname}' deleted successfully", 'success')
+        connection = proxmox_connections[host_id]['connection']
+        
+        # Delete snapshot
+        connection.nodes(node).lxc(vmid).snapshot(snapname).delete()
+        
+        snapshot_inventory.invalidate(host_id)
+        flash(f"Snapshot '{snapname}' deleted successfully", 'success')
+    except Exception as e:
+        flash(f"Failed to delete snapshot: {str(e)}", 'danger')
+    
+    return redirect(url_for('container_snapshots', host_id=host_id, node=node, vmid=vmid))
+
+@app.route('/vm/<host_id>/<node>/<vmid>/snapshots/create', methods=['POST'])
+def create_vm_snapshot(host_id, node, vmid):
+    if host_id not in proxmox_connections:
+        flash("Host not found", 'danger')
+        return redirect(url_for('index'))
+    
+    name = request.form.get('name')
+    description = request.form.get('description', '')
+    
+    if not name:
+        flash("Snapshot name is required", 'danger')
+        return redirect(url_for('vm_snapshots', host_id=host_id, node=node, vmid=vmid))
+    
+    try:
+        connection = proxmox_connections[host_id]['connection']
+        
+        # Create snapshot, optionally including the RAM state
+        params = {'snapname': name, 'description': description}
+        if request.form.get('include_ram'):
+            params['vmstate'] = 1
+        connection.nodes(node).qemu(vmid).snapshot.post(**params)
+        
+        snapshot_inventory.invalidate(host_id)
+        flash(f"Snapshot '{name}' created successfully", 'success')
+    except Exception as e:
+        flash(f"Failed to create snapshot: {str(e)}", 'danger')
+    
+    return redirect(url_for('vm_snapshots', host_id=host_id, node=node, vmid=vmid))
+
+@app.route('/vm/<host_id>/<node>/<vmid>/snapshots/<snapname>/restore', methods=['POST'])
+def restore_vm_snapshot(host_id, node, vmid, snapname):
+    if host_id not in proxmox_connections:
+        flash("Host not found", 'danger')
+        return redirect(url_for('index'))
+    
+    try:
+        connection = proxmox_connections[host_id]['connection']
+        
+        # Restore snapshot
+        connection.nodes(node).qemu(vmid).snapshot(snapname).rollback.post()
+        
+        flash(f"Snapshot '{snapname}' restored successfully", 'success')
+    except Exception as e:
+        flash(f"Failed to restore snapshot: {str(e)}", 'danger')
+    
+    return redirect(url_for('vm_snapshots', host_id=host_id, node=node, vmid=vmid))
+
+@app.route('/vm/<host_id>/<node>/<vmid>/snapshots/<snapname>/delete', methods=['POST'])
+def delete_vm_snapshot(host_id, node, vmid, snapname):
+    if host_id not in proxmox_connections:
+        flash("Host not found", 'danger')
+        return redirect(url_for('index'))
+    
+    try:
+        connection = proxmox_connections[host_id]['connection']
+        
+        # Delete snapshot
+        connection.nodes(node).qemu(vmid).snapshot(snapname).delete()
+        
+        snapshot_inventory.invalidate(host_id)
+        flash(f"Snapshot '{snapname}' deleted successfully", 'success')
+    except Exception as e:
+        flash(f"Failed to delete snapshot: {str(e)}", 'danger')
+    
+    return redirect(url_for('vm_snapshots', host_id=host_id, node=node, vmid=vmid))
+
+def snapshot_policy_fields(form):
+    """Schedule, retention and naming fields of a snapshot policy form"""
+    return {
+        'name_prefix': form.get('name_prefix', '').strip(),
+        'description': form.get('description', ''),
+        'schedule_type': form.get('schedule_type', 'daily'),
+        'schedule_value': int(form.get('schedule_value') or 1),
+        'retention': int(form.get('retention') or 0),
+        'max_age_days': float(form.get('max_age_days') or 0),
+        'include_ram': bool(form.get('include_ram'))
+    }
+
+def scheduled_policy(host_id, schedule_id, guest_type=None, vmid=None):
+    """A policy of the host (and guest, when given) or None"""
+    policy = snapshot_scheduler.get(schedule_id)
+    if policy is None or policy['host_id'] != host_id:
+        return None
+    if vmid is not None and (policy['selector'].get('guest_type') != guest_type
+                             or int(vmid) not in policy['selector'].get('vmids', [])):
+        return None
+    return policy
+
+@app.route('/vm/<host_id>/<node>/<vmid>/snapshots/schedules')
+def vm_snapshot_schedules(host_id, node, vmid):
+    if host_id not in proxmox_connections:
+        flash("Host not found", 'danger')
+        return redirect(url_for('index'))
+    
+    vm_info = snapshot_guest(inventory.get_snapshot(host_id), vmid) or {}
+    return render_template('vm_snapshot_schedules.html',
+                          host_id=host_id,
+                          node=node,
+                          vmid=vmid,
+                          vm_name=vm_info.get('name', f'VM {vmid}'),
+                          schedules=snapshot_scheduler.list(host_id, 'qemu', vmid))
+
+@app.route('/vm/<host_id>/<node>/<vmid>/snapshots/schedules/create', methods=['POST'])
+def create_vm_snapshot_schedule(host_id, node, vmid):
+    if host_id not in proxmox_connections:
+        flash("Host not found", 'danger')
+        return redirect(url_for('index'))
+    
+    try:
+        snapshot_scheduler.create(host_id, vmids=[vmid], guest_type='qemu', **snapshot_policy_fields(request.form))
+        flash("Snapshot schedule created successfully", 'success')
+    except ValueError as e:
+        flash(f"Failed to create snapshot schedule: {str(e)}", 'danger')
+    
+    return redirect(url_for('vm_snapshot_schedules', host_id=host_id, node=node, vmid=vmid))
+
+@app.route('/vm/<host_id>/<node>/<vmid>/snapshots/schedules/<schedule_id>/toggle', methods=['POST'])
+def toggle_vm_snapshot_schedule(host_id, node, vmid, schedule_id):
+    policy = scheduled_policy(host_id, schedule_id, 'qemu', vmid)
+    if policy is None:
+        flash("Snapshot schedule not found", 'danger')
+    else:
+        snapshot_scheduler.set_enabled(schedule_id, not policy['enabled'])
+        flash(f"Snapshot schedule {'disabled' if policy['enabled'] else 'enabled'}", 'success')
+    
+    return redirect(url_for('vm_snapshot_schedules', host_id=host_id, node=node, vmid=vmid))
+
+@app.route('/vm/<host_id>/<node>/<vmid>/snapshots/schedules/<schedule_id>/delete', methods=['POST'])
+def delete_vm_snapshot_schedule(host_id, node, vmid, schedule_id):
+    if scheduled_policy(host_id, schedule_id, 'qemu', vmid) is None:
+        flash("Snapshot schedule not found", 'danger')
+    else:
+        snapshot_scheduler.delete(schedule_id)
+        flash("Snapshot schedule deleted", 'success')
+    
+    return redirect(url_for('vm_snapshot_schedules', host_id=host_id, node=node, vmid=vmid))
+
+@app.route('/container/<host_id>/<node>/<vmid>/snapshots/schedules')
+def container_snapshot_schedules(host_id, node, vmid):
+    if host_id not in proxmox_connections:
+        flash("Host not found", 'danger')
+        return redirect(url_for('index'))
+    
+    container_info = snapshot_guest(inventory.get_snapshot(host_id), vmid) or {}
+    return render_template('container_snapshot_schedules.html',
+                          host_id=host_id,
+                          node=node,
+                          vmid=vmid,
+                          container_name=container_info.get('name', f'Container {vmid}'),
+                          schedules=snapshot_scheduler.list(host_id, 'lxc', vmid))
+
+@app.route('/container/<host_id>/<node>/<vmid>/snapshots/schedules/create', methods=['POST'])
+def create_container_snapshot_schedule(host_id, node, vmid):
+    if host_id not in proxmox_connections:
+        flash("Host not found", 'danger')
+        return redirect(url_for('index'))
+    
+    try:
+        fields = dict(snapshot_policy_fields(request.form), include_ram=False)
+        snapshot_scheduler.create(host_id, vmids=[vmid], guest_type='lxc', **fields)
+        flash("Snapshot schedule created successfully", 'success')
+    except ValueError as e:
+        flash(f"Failed to create snapshot schedule: {str(e)}", 'danger')
+    
+    return redirect(url_for('container_snapshot_schedules', host_id=host_id, node=node, vmid=vmid))
+
+@app.route('/container/<host_id>/<node>/<vmid>/snapshots/schedules/<schedule_id>/toggle', methods=['POST'])
+def toggle_container_snapshot_schedule(host_id, node, vmid, schedule_id):
+    policy = scheduled_policy(host_id, schedule_id, 'lxc', vmid)
+    if policy is None:
+        flash("Snapshot schedule not found", 'danger')
+    else:
+        snapshot_scheduler.set_enabled(schedule_id, not policy['enabled'])
+        flash(f"Snapshot schedule {'disabled' if policy['enabled'] else 'enabled'}", 'success')
+    
+    return redirect(url_for('container_snapshot_schedules', host_id=host_id, node=node, vmid=vmid))
+
+@app.route('/container/<host_id>/<node>/<vmid>/snapshots/schedules/<schedule_id>/delete', methods=['POST'])
+def delete_container_snapshot_schedule(host_id, node, vmid, schedule_id):
+    if scheduled_policy(host_id, schedule_id, 'lxc', vmid) is None:
+        flash("Snapshot schedule not found", 'danger')
+    else:
+        snapshot_scheduler.delete(schedule_id)
+        flash("Snapshot schedule deleted", 'success')
+    
+    return redirect(url_for('container_snapshot_schedules', host_id=host_id, node=node, vmid=vmid))
+
+def snapshot_filters(args):
+    """Snapshot inventory filters from request args; older_than_days becomes seconds"""
+    older_than_days = args.get('older_than_days', type=float)
+    return {
+        'name': args.get('name') or None,
+        'older_than': older_than_days * 86400 if older_than_days else None,
+        'guest_type': args.get('type') or None,
+        'node': args.get('node') or None
+    }
+
+def snapshot_job_limits(form):
+    """Per-storage and per-node limits of a bulk snapshot job (one operation per guest at a time); raises ValueError"""
+    max_per_storage = int(form.get('max_per_storage', 2))
+    max_per_node = int(form.get('max_per_node', 4))
+    if max_per_storage < 1 or max_per_node < 1:
+        raise ValueError("limits below 1")
+    return {'storage': max_per_storage, 'node': max_per_node, 'guest': 1}
+
+@app.route('/host/<host_id>/snapshots')
+def snapshot_inventory_page(host_id):
+    """Snapshots of every guest on a host with bulk create and delete"""
+    if host_id not in proxmox_connections:
+        flash("Host not found", 'danger')
+        return redirect(url_for('index'))
+    
+    try:
+        if request.args.get('refresh'):
+            snapshot_inventory.refresh_host(host_id)
+        
+        filters = snapshot_filters(request.args)
+        snapshots = snapshot_inventory.query(host_id, **filters)
+        data = snapshot_inventory.get(host_id)
+        inventory_snapshot = inventory.get_snapshot(host_id)
+        
+        return render_template('snapshot_inventory.html',
+                              host_id=host_id,
+                              snapshots=snapshots,
+                              index=snapshot_index(snapshots),
+                              crawl=data,
+                              nodes=sorted(node['node'] for node in inventory_snapshot['nodes']),
+                              pools=sorted({guest['pool'] for guest in inventory_snapshot['guests'] if guest.get('pool')}),
+                              filters={key: value for key, value in request.args.items() if key not in ('refresh', 'job')},
+                              job_id=request.args.get('job'))
+    except Exception as e:
+        flash(f"Failed to load snapshot inventory: {str(e)}", 'danger')
+        return redirect(url_for('host_details', host_id=host_id))
+
+@app.route('/api/host/<host_id>/snapshots')
+def api_snapshot_inventory(host_id):
+    """Snapshots across all guests, filtered by name glob, age, type and node"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    try:
+        if request.args.get('refresh'):
+            snapshot_inventory.refresh_host(host_id)
+        
+        snapshots = snapshot_inventory.query(host_id, **snapshot_filters(request.args))
+        data = snapshot_inventory.get(host_id)
+        return jsonify({
+            'success': True,
+            'snapshots': snapshots,
+            'index': snapshot_index(snapshots),
+            'fetched': data['fetched'],
+            'errors': data['errors']
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/host/<host_id>/snapshots/bulk_create', methods=['POST'])
+def bulk_create_snapshots(host_id):
+    """Snapshot many guests at once with per-storage and per-node concurrency limits"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    name = request.form.get('name', '').strip()
+    description = request.form.get('description', '')
+    include_ram = request.form.get('include_ram') == 'true'
+    
+    if not valid_snapshot_name(name):
+        return jsonify({'success': False, 'error': 'Snapshot names must start with a letter and contain only letters, digits, - and _'})
+    
+    try:
+        limits = snapshot_job_limits(request.form)
+        task_timeout = int(request.form.get('task_timeout', 3600))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Concurrency limits must be whole numbers of at least 1 '
+                                                   'and the task timeout a whole number of seconds'})
+    
+    try:
+        vmids = json.loads(request.form.get('vmids', '[]'))
+        if not isinstance(vmids, list):
+            raise ValueError("expected a list")
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({'success': False, 'error': f"Invalid VMID list: {str(e)}"})
+    
+    guests = select_guests(inventory.get_snapshot(host_id), vmids,
+                           node=request.form.get('node') or None,
+                           guest_type=request.form.get('type') or None,
+                           tag=request.form.get('tag') or None,
+                           pool=request.form.get('pool') or None)
+    if not guests:
+        return jsonify({'success': False, 'error': 'No guests match the selection'})
+    
+    # Guests that already carry a snapshot of this name would fail
+    existing = {entry['vmid'] for entry in snapshot_inventory.query(host_id, name=name)}
+    skipped = [int(guest['vmid']) for guest in guests if int(guest['vmid']) in existing]
+    guests = [guest for guest in guests if int(guest['vmid']) not in existing]
+    if not guests:
+        return jsonify({'success': False, 'error': f"Every selected guest already has a snapshot named '{name}'"})
+    
+    connection = proxmox_connections[host_id]['connection']
+    items = [{
+        'label': f"{guest.get('name') or guest['vmid']} ({guest['type']} {guest['vmid']} on {guest['node']})",
+        'node': guest['node'],
+        'type': guest['type'],
+        'vmid': int(guest['vmid']),
+        'phase': 'queued',
+        'keys': [('node', guest['node']), ('guest', int(guest['vmid']))]
+    } for guest in guests]
+    
+    def create_snapshot(item):
+        params = {'snapname': name, 'description': description}
+        if include_ram and item['type'] == 'qemu':
+            params['vmstate'] = 1
+        item['upid'] = guest_api(connection, item['type'], item['node'], item['vmid']).snapshot.post(**params)
+        job.update_item(item, phase='snapshotting')
+        
+        status = wait_for_task(connection, item['node'], item['upid'], timeout=task_timeout)
+        if not task_succeeded(status):
+            raise Exception(f"Snapshot task failed: {status.get('exitstatus', 'unknown error')}")
+        job.update_item(item, phase='created')
+    
+    job = BulkJob('snapshot_create', host_id, items, create_snapshot, limits=limits)
+    register_job(job).start(prepare=resolve_snapshot_storages(connection),
+                            finish=lambda job: snapshot_inventory.invalidate(host_id))
+    
+    app_logger.info(f"Started bulk snapshot job {job.id} creating '{name}' on {len(items)} guests of host {host_id}")
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'skipped': skipped,
+        'message': f"Creating snapshot '{name}' on {len(items)} guests",
+        'status_url': url_for('bulk_job_status', job_id=job.id)
+    })
+
+@app.route('/api/host/<host_id>/snapshots/bulk_delete', methods=['POST'])
+def bulk_delete_snapshots(host_id):
+    """Delete many snapshots, given explicitly or by inventory filters, with concurrency limits"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    try:
+        limits = snapshot_job_limits(request.form)
+        task_timeout = int(request.form.get('task_timeout', 3600))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Concurrency limits must be whole numbers of at least 1 '
+                                                   'and the task timeout a whole number of seconds'})
+    
+    try:
+        selected = json.loads(request.form.get('snapshots', '[]'))
+        if selected:
+            # Explicit {vmid, name} pairs are resolved against the inventory for node and type
+            wanted = {(int(entry['vmid']), entry['name']) for entry in selected}
+            targets = [entry for entry in snapshot_inventory.query(host_id)
+                       if (entry['vmid'], entry['name']) in wanted]
+        else:
+            filters = snapshot_filters(request.form)
+            if not filters['name'] and not filters['older_than']:
+                return jsonify({'success': False, 'error': 'Select snapshots or give a name pattern or minimum age'})
+            targets = snapshot_inventory.query(host_id, **filters)
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({'success': False, 'error': f"Invalid snapshot selection: {str(e)}"})
+    
+    if not targets:
+        return jsonify({'success': False, 'error': 'No snapshots match the selection'})
+    
+    if request.form.get('dry_run') == 'true':
+        return jsonify({'success': True, 'dry_run': True, 'snapshots': targets, 'index': snapshot_index(targets)})
+    
+    connection = proxmox_connections[host_id]['connection']
+    items = [{
+        'label': f"{target['name']} of {target['guest_name']} ({target['type']} {target['vmid']})",
+        'node': target['node'],
+        'type': target['type'],
+        'vmid': target['vmid'],
+        'snapname': target['name'],
+        'phase': 'queued',
+        'keys': [('node', target['node']), ('guest', target['vmid'])]
+    } for target in targets]
+    
+    def delete_snapshot(item):
+        item['upid'] = guest_api(connection, item['type'], item['node'], item['vmid']).snapshot(item['snapname']).delete()
+        job.update_item(item, phase='deleting')
+        
+        status = wait_for_task(connection, item['node'], item['upid'], timeout=task_timeout)
+        if not task_succeeded(status):
+            raise Exception(f"Snapshot delete task failed: {status.get('exitstatus', 'unknown error')}")
+        job.update_item(item, phase='deleted')
+    
+    job = BulkJob('snapshot_delete', host_id, items, delete_snapshot, limits=limits)
+    register_job(job).start(prepare=resolve_snapshot_storages(connection),
+                            finish=lambda job: snapshot_inventory.invalidate(host_id))
+    
+    app_logger.info(f"Started bulk snapshot job {job.id} deleting {len(items)} snapshots on host {host_id}")
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'message': f"Deleting {len(items)} snapshots",
+        'status_url': url_for('bulk_job_status', job_id=job.id)
+    })
+
+@app.route('/host/<host_id>/snapshots/schedules')
+def snapshot_policies(host_id):
+    """Snapshot policies of a host selecting guests by VMID, node, type, tag and pool"""
+    if host_id not in proxmox_connections:
+        flash("Host not found", 'danger')
+        return redirect(url_for('index'))
+    
+    try:
+        inventory_snapshot = inventory.get_snapshot(host_id)
+        policies = snapshot_scheduler.list(host_id)
+        for policy in policies:
+            selector = policy['selector']
+            policy['matched'] = len(select_guests(inventory_snapshot, selector.get('vmids'),
+                                                  node=selector.get('node'), guest_type=selector.get('guest_type'),
+                                                  tag=selector.get('tag'), pool=selector.get('pool')))
+        
+        return render_template('snapshot_policies.html',
+                              host_id=host_id,
+                              policies=policies,
+                              schedule_types=SCHEDULE_TYPES,
+                              nodes=sorted(node['node'] for node in inventory_snapshot['nodes']),
+                              pools=sorted({guest['pool'] for guest in inventory_snapshot['guests'] if guest.get('pool')}),
+                              job_id=request.args.get('job'))
+    except Exception as e:
+        flash(f"Failed to load snapshot policies: {str(e)}", 'danger')
+        return redirect(url_for('snapshot_inventory_page', host_id=host_id))
+
+@app.route('/host/<host_id>/snapshots/schedules/create', methods=['POST'])
+def create_snapshot_policy(host_id):
+    if host_id not in proxmox_connections:
+        flash("Host not found", 'danger')
+        return redirect(url_for('index'))
+    
+    try:
+        vmids = [int(vmid) for vmid in re.split(r'[,\s]+', request.form.get('vmids', '')) if vmid]
+        policy = snapshot_scheduler.create(host_id, vmids=vmids,
+                                           guest_type=request.form.get('type') or None,
+                                           node=request.form.get('node') or None,
+                                           tag=request.form.get('tag', '').strip() or None,
+                                           pool=request.form.get('pool') or None,
+                                           **snapshot_policy_fields(request.form))
+        flash(f"Snapshot policy '{policy['name_prefix']}' created", 'success')
+    except ValueError as e:
+        flash(f"Failed to create snapshot policy: {str(e)}", 'danger')
+    
+    return redirect(url_for('snapshot_policies', host_id=host_id))
+
+@app.route('/host/<host_id>/snapshots/schedules/<policy_id>/toggle', methods=['POST'])
+def toggle_snapshot_policy(host_id, policy_id):
+    policy = scheduled_policy(host_id, policy_id)
+    if policy is None:
+        flash("Snapshot policy not found", 'danger')
+    else:
+        snapshot_scheduler.set_enabled(policy_id, not policy['enabled'])
+        flash(f"Snapshot policy '{policy['name_prefix']}' {'disabled' if policy['enabled'] else 'enabled'}", 'success')
+    
+    return redirect(url_for('snapshot_policies', host_id=host_id))
+
+@app.route('/host/<host_id>/snapshots/schedules/<policy_id>/delete', methods=['POST'])
+def delete_snapshot_policy(host_id, policy_id):
+    policy = scheduled_policy(host_id, policy_id)
+    if policy is None:
+        flash("Snapshot policy not found", 'danger')
+    else:
+        snapshot_scheduler.delete(policy_id)
+        flash(f"Snapshot policy '{policy['name_prefix']}' deleted; its snapshots were kept", 'success')
+    
+    return redirect(url_for('snapshot_policies', host_id=host_id))
+
+@app.route('/host/<host_id>/snapshots/schedules/<policy_id>/run', methods=['POST'])
+def run_snapshot_policy(host_id, policy_id):
+    """Run a policy now, without waiting for its next slot or spreading its guests"""
+    if host_id not in proxmox_connections or scheduled_policy(host_id, policy_id) is None:
+        flash("Snapshot policy not found", 'danger')
+        return redirect(url_for('snapshot_policies', host_id=host_id))
+    
+    try:
+        job = snapshot_scheduler.run_now(policy_id)
+        if job is None:
+            flash("The policy is already running or matches no guests", 'warning')
+            return redirect(url_for('snapshot_policies', host_id=host_id))
+        return redirect(url_for('snapshot_policies', host_id=host_id, job=job.id))
     except Exception as e:
-        flash(f"Failed to delete snapshot: {str(e)}", 'danger')
+        flash(f"Failed to run snapshot policy: {str(e)}", 'danger')
+        return redirect(url_for('snapshot_policies', host_id=host_id))
+
+@app.route('/api/host/<host_id>/snapshots/schedules')
+def api_snapshot_policies(host_id):
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
     
-    return redirect(url_for('container_snapshots', host_id=host_id, node=node, vmid=vmid))
+    return jsonify({'success': True, 'policies': snapshot_scheduler.list(host_id)})
 
 @app.route('/api/vm/action', methods=['POST'])
 def vm_action():
@@ -1037,50 +1685,56 @@ def storage_list(host_id):
         return redirect(url_for('index'))
     
     try:
-        connection = proxmox_connections[host_id]['connection']
-        
-        # Get storage pools
-        storage_pools = connection.storage.get()
-        
-        # Get all nodes for this host
-        nodes = connection.nodes.get()
-        nodes_dict = {node['node']: node for node in nodes}
+        # Usage of every (node, storage) pair comes from the inventory; shared storages count once
+        status = storage_collector.get(host_id, refresh=bool(request.args.get('refresh')))
         
-        # Enhance storage info with usage statistics from first available node
-        if nodes:
-            sample_node = nodes[0]['node']
-            
-            for storage in storage_pools:
-                try:
-                    # Get detailed storage info for the pool from the sample node
-                    storage_details = connection.nodes(sample_node).storage(storage['storage']).status.get()
-                    
-                    # Add usage info to the storage object
-                    storage['total'] = storage_details.get('total', 0)
-                    storage['used'] = storage_details.get('used', 0)
-                    storage['available'] = storage_details.get('avail', 0)
-                    
-                    # Calculate percentage used
-                    if storage['total'] > 0:
-                        storage['percent_used'] = (storage['used'] / storage['total']) * 100
-                    else:
-                        storage['percent_used'] = 0
-                        
-                except Exception:
-                    # If we can't get details, set defaults
-                    storage['total'] = 0
-                    storage['used'] = 0 
-                    storage['available'] = 0
-                    storage['percent_used'] = 0
+        # Forecasts come soonest-full first, so a local pool shows its fullest node
+        forecasts = {}
+        for forecast in storage_history.forecast(host_id):
+            forecasts.setdefault(forecast['storage'], forecast)
         
         return render_template('storage_list.html',
                             host_id=host_id,
-                            storage_pools=storage_pools,
-                            nodes=nodes_dict)
+                            storage_pools=status['pools'],
+                            node_totals=status['nodes'],
+                            cluster_totals=status['cluster'],
+                            fetched=status['fetched'],
+                            forecasts=forecasts,
+                            warn_days=STORAGE_FORECAST_WARN_DAYS)
     except Exception as e:
         flash(f"Failed to get storage list: {str(e)}", 'danger')
         return redirect(url_for('host_details', host_id=host_id))
 
+@app.route('/api/host/<host_id>/storage/status')
+def api_storage_status(host_id):
+    """Storage usage per pool, per node and cluster-wide"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    try:
+        status = storage_collector.get(host_id, refresh=bool(request.args.get('refresh')))
+        return jsonify(dict(status, success=True))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/host/<host_id>/storage/forecast')
+def api_storage_forecast(host_id):
+    """Growth per day and days until full of every storage of a host"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    return jsonify({'success': True, 'forecasts': storage_history.forecast(host_id), 'warn_days': STORAGE_FORECAST_WARN_DAYS})
+
+@app.route('/api/storage/forecast')
+def api_fleet_storage_forecast():
+    """Storage forecasts across all hosts, soonest to fill first"""
+    forecasts = storage_history.forecast()
+    if request.args.get('within_days', type=float):
+        forecasts = [forecast for forecast in forecasts
+                     if forecast['days_until_full'] is not None
+                     and forecast['days_until_full'] <= request.args.get('within_days', type=float)]
+    return jsonify({'success': True, 'forecasts': forecasts, 'warn_days': STORAGE_FORECAST_WARN_DAYS})
+
 @app.route('/host/<host_id>/storage/create', methods=['POST'])
 def create_storage(host_id):
     if host_id not in proxmox_connections:
@@ -1117,6 +1771,7 @@ def create_storage(host_id):
     try:
         connection = proxmox_connections[host_id]['connection']
         connection.storage.post(**params)
+        storage_collector.invalidate(host_id)
         flash(f"Storage '{storage_id}' created successfully", 'success')
     except Exception as e:
         flash(f"Failed to create storage: {str(e)}", 'danger')
@@ -1132,6 +1787,7 @@ def delete_storage(host_id, storage_id):
     try:
         connection = proxmox_connections[host_id]['connection']
         connection.storage(storage_id).delete()
+        storage_collector.invalidate(host_id)
         flash(f"Storage '{storage_id}' deleted successfully", 'success')
     except Exception as e:
         flash(f"Failed to delete storage: {str(e)}", 'danger')
@@ -1337,6 +1993,43 @@ def delete_backup_job(host_id, job_id):
     
     return redirect(url_for('backup_list', host_id=host_id))
 
+def backup_guest_info(archive):
+    """Guess the guest type (qemu/lxc) and original VMID from a vzdump archive name"""
+    name = os.path.basename(archive.split(':', 1)[-1])
+    match = re.search(r'vzdump-(qemu|lxc|openvz)-(\d+)-', name)
+    if not match:
+        return None, None
+    vm_type = 'qemu' if match.group(1) == 'qemu' else 'lxc'
+    return vm_type, match.group(2)
+
+def start_restore(connection, node, archive, storage, vmid=None, vm_type=None, force=False):
+    """Start a restore of a backup archive and return the task UPID"""
+    vm_type = vm_type or backup_guest_info(archive)[0]
+    
+    if vm_type == 'qemu' and vmid:
+        params = {'vmid': vmid, 'archive': archive, 'storage': storage}
+        if force:
+            params['force'] = 1
+        return connection.nodes(node).qemu.post(**params)
+    
+    if vm_type == 'lxc' and vmid:
+        params = {'vmid': vmid, 'ostemplate': archive, 'storage': storage, 'restore': 1}
+        if force:
+            params['force'] = 1
+        return connection.nodes(node).lxc.post(**params)
+    
+    # Build parameters for restore
+    params = {
+        'archive': archive,
+        'storage': storage
+    }
+    
+    # Add target VMID if provided (for restoring to a different VM)
+    if vmid:
+        params['vmid'] = vmid
+    
+    return connection.nodes(node).vzdump.restore.post(**params)
+
 @app.route('/host/<host_id>/backups/restore', methods=['POST'])
 def restore_backup(host_id):
     if host_id not in proxmox_connections:
@@ -1355,25 +2048,156 @@ def restore_backup(host_id):
     try:
         connection = proxmox_connections[host_id]['connection']
         
-        # Build parameters for restore
-        params = {
-            'archive': archive,
-            'storage': storage
-        }
-        
-        # Add target VMID if provided (for restoring to a different VM)
-        if target_vmid:
-            params['vmid'] = target_vmid
-        
         # Start restore job
-        result = connection.nodes(node).vzdump.restore.post(**params)
+        upid = start_restore(connection, node, archive, storage, target_vmid)
         
-        flash(f"Restore job started successfully. Task ID: {result.get('data')}", 'success')
+        flash(f"Restore job started successfully. Task ID: {upid}", 'success')
     except Exception as e:
         flash(f"Failed to start restore: {str(e)}", 'danger')
     
     return redirect(url_for('backup_list', host_id=host_id))
 
+@app.route('/api/host/<host_id>/backups/bulk_restore', methods=['POST'])
+def bulk_restore(host_id):
+    """Restore many backup archives with per-node and per-storage concurrency limits"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    try:
+        restores = json.loads(request.form.get('restores', '[]'))
+        if not isinstance(restores, list) or not all(isinstance(restore, dict) for restore in restores):
+            raise ValueError("expected a list of objects")
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f"Invalid restore list: {str(e)}"})
+    
+    if not restores:
+        return jsonify({'success': False, 'error': 'No restores specified'})
+    
+    try:
+        max_per_node = int(request.form.get('max_per_node', 2))
+        max_per_storage = int(request.form.get('max_per_storage', 2))
+        task_timeout = int(request.form.get('task_timeout', 6 * 3600))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Concurrency limits must be integers'})
+    if max_per_node < 1 or max_per_storage < 1:
+        return jsonify({'success': False, 'error': 'Concurrency limits must be at least 1'})
+    
+    force = request.form.get('force') == 'true'
+    connection = proxmox_connections[host_id]['connection']
+    
+    try:
+        shared = storage_collector.shared_storages(host_id)
+    except Exception as e:
+        return jsonify({'success': False, 'error': f"Failed to read the storage configuration: {str(e)}"})
+    
+    items = []
+    for restore in restores:
+        node = restore.get('node')
+        archive = restore.get('archive')
+        storage = restore.get('storage')
+        
+        if not node or not archive or not storage:
+            return jsonify({'success': False, 'error': f"Restore entry is missing node, archive or storage: {restore}"})
+        
+        # Default to restoring over the guest the archive was taken from
+        archive_type, archive_vmid = backup_guest_info(archive)
+        
+        # The archive's own storage is read while the target storage is written
+        source_storage = archive.split(':', 1)[0] if ':' in archive else storage
+        items.append({
+            'label': f"{archive} -> {node}/{storage}",
+            'node': node,
+            'archive': archive,
+            'storage': storage,
+            'source_storage': source_storage,
+            'vmid': restore.get('vmid') or archive_vmid,
+            'type': restore.get('type') or archive_type,
+            'keys': [('node', node), storage_limit_key(node, storage, shared),
+                     storage_limit_key(node, source_storage, shared)]
+        })
+    
+    def lookup_archive_sizes(job):
+        # One content listing per (node, backup storage) gives sizes for throughput reporting
+        listings = {}
+        for item in job.items:
+            listing_key = (item['node'], item['source_storage'])
+            if listing_key not in listings:
+                try:
+                    content = connection.nodes(item['node']).storage(item['source_storage']).content.get(content='backup')
+                    listings[listing_key] = {entry.get('volid'): entry.get('size', 0) for entry in content}
+                except Exception as e:
+                    app_logger.warning(f"Could not list backups on {item['node']}/{item['source_storage']}: {str(e)}")
+                    listings[listing_key] = {}
+            item['size'] = listings[listing_key].get(item['archive'], 0)
+    
+    def run_restore(item):
+        item['upid'] = start_restore(connection, item['node'], item['archive'], item['storage'],
+                                     item['vmid'], item['type'], force)
+        status = wait_for_task(connection, item['node'], item['upid'], timeout=task_timeout)
+        if not task_succeeded(status):
+            raise Exception(f"Restore task failed: {status.get('exitstatus', 'unknown error')}")
+    
+    job = BulkJob('restore', host_id, items, run_restore,
+                  limits={'node': max_per_node, 'storage': max_per_storage})
+    register_job(job).start(prepare=lookup_archive_sizes)
+    
+    app_logger.info(f"Started bulk restore job {job.id} with {len(items)} archives on host {host_id}")
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'message': f"Scheduled {len(items)} restores",
+        'status_url': url_for('bulk_job_status', job_id=job.id)
+    })
+
+@app.route('/api/bulk/jobs')
+def bulk_job_list():
+    host_id = request.args.get('host_id')
+    kind = request.args.get('kind')
+    return jsonify({'success': True, 'jobs': [job.progress() for job in list_jobs(host_id, kind)]})
+
+@app.route('/api/bulk/jobs/<job_id>')
+def bulk_job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/api/bulk/jobs/<job_id>/events')
+def bulk_job_events(job_id):
+    """Stream job progress to the browser as server-sent events"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    def generate():
+        version = None
+        while True:
+            new_version = job.wait_for_change(version, timeout=15)
+            if new_version == version and job.finished is None:
+                # Keep the connection alive through proxies
+                yield ": keepalive\n\n"
+                continue
+            
+            version = new_version
+            yield f"data: {json.dumps(job.to_dict())}\n\n"
+            if job.finished is not None:
+                yield "event: done\ndata: {}\n\n"
+                break
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/bulk/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_bulk_job(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    job.cancel()
+    return jsonify({'success': True, 'job': job.progress()})
+
 @app.route('/node/<host_id>/<node>/create_vm', methods=['GET', 'POST'])
 def create_vm(host_id, node):
     if host_id not in proxmox_connections:
@@ -1383,38 +2207,21 @@ def create_vm(host_id, node):
     try:
         connection = proxmox_connections[host_id]['connection']
         
-        # Get available storage pools for this node
-        storages = connection.nodes(node).storage.get()
+        # Get available storage pools and their ISO images from the shared catalog
+        catalog = get_content_catalog(host_id, node)
         
         # Filter storages that can contain disk images
-        vm_storages = [storage for storage in storages if 'images' in storage.get('content', '').split(',')]
+        vm_storages = catalog_storages(catalog, 'images')
         
         # Get ISO storages and images
-        iso_storages = [storage for storage in storages if 'iso' in storage.get('content', '').split(',')]
-        iso_images = []
-        
-        for storage in iso_storages:
-            try:
-                content = connection.nodes(node).storage(storage['storage']).content.get()
-                iso_list = [item for item in content if item.get('content') == 'iso']
-                for iso in iso_list:
-                    iso['storage'] = storage['storage']
-                iso_images.extend(iso_list)
-            except Exception as e:
-                print(f"Error getting ISO list from {storage['storage']}: {str(e)}")
+        iso_storages = catalog_storages(catalog, 'iso')
+        iso_images = catalog_items(catalog, 'iso')
         
         # Get node CPU and memory info for resource allocation
         node_status = connection.nodes(node).status.get()
         
         # Get next available VMID
-        try:
-            next_vmid = connection.cluster.nextid.get()
-        except Exception:
-            # Fallback if cluster API not available
-            vms = connection.nodes(node).qemu.get()
-            containers = connection.nodes(node).lxc.get()
-            existing_ids = [int(vm['vmid']) for vm in vms + containers]
-            next_vmid = max(existing_ids) + 1 if existing_ids else 100
+        next_vmid = vmid_allocator.next_free(host_id)
         
         if request.method == 'POST':
             # Process VM creation form
@@ -1454,8 +2261,10 @@ def create_vm(host_id, node):
                 params['boot'] = 'order=ide2;virtio0'
             
             try:
-                # Create the VM
-                connection.nodes(node).qemu.post(**params)
+                # Create the VM, holding its VMID until the inventory sees it
+                with vmid_allocator.hold(host_id, vmid):
+                    connection.nodes(node).qemu.post(**params)
+                inventory.invalidate(host_id)
                 
                 flash(f"VM {name} (ID: {vmid}) created successfully", 'success')
                 return redirect(url_for('node_details', host_id=host_id, node=node))
@@ -1483,38 +2292,21 @@ def create_container(host_id, node):
     try:
         connection = proxmox_connections[host_id]['connection']
         
-        # Get available storage pools for this node
-        storages = connection.nodes(node).storage.get()
+        # Get available storage pools and their templates from the shared catalog
+        catalog = get_content_catalog(host_id, node)
         
         # Filter storages that can contain container templates
-        container_storages = [storage for storage in storages if 'rootdir' in storage.get('content', '').split(',')]
+        container_storages = catalog_storages(catalog, 'rootdir')
         
         # Get template storages and templates
-        template_storages = [storage for storage in storages if 'vztmpl' in storage.get('content', '').split(',')]
-        templates = []
-        
-        for storage in template_storages:
-            try:
-                content = connection.nodes(node).storage(storage['storage']).content.get()
-                template_list = [item for item in content if item.get('content') == 'vztmpl']
-                for tmpl in template_list:
-                    tmpl['storage'] = storage['storage']
-                templates.extend(template_list)
-            except Exception as e:
-                print(f"Error getting template list from {storage['storage']}: {str(e)}")
+        template_storages = catalog_storages(catalog, 'vztmpl')
+        templates = catalog_items(catalog, 'vztmpl')
         
         # Get node CPU and memory info for resource allocation
         node_status = connection.nodes(node).status.get()
         
         # Get next available VMID
-        try:
-            next_vmid = connection.cluster.nextid.get()
-        except Exception:
-            # Fallback if cluster API not available
-            vms = connection.nodes(node).qemu.get()
-            containers = connection.nodes(node).lxc.get()
-            existing_ids = [int(vm['vmid']) for vm in vms + containers]
-            next_vmid = max(existing_ids) + 1 if existing_ids else 100
+        next_vmid = vmid_allocator.next_free(host_id)
         
         if request.method == 'POST':
             # Process container creation form
@@ -1557,8 +2349,10 @@ def create_container(host_id, node):
             params['start'] = 1 if start_after_create else 0
             
             try:
-                # Create the container
-                connection.nodes(node).lxc.post(**params)
+                # Create the container, holding its VMID until the inventory sees it
+                with vmid_allocator.hold(host_id, vmid):
+                    connection.nodes(node).lxc.post(**params)
+                inventory.invalidate(host_id)
                 
                 flash(f"Container {hostname} (ID: {vmid}) created successfully", 'success')
                 return redirect(url_for('node_details', host_id=host_id, node=node))
@@ -1776,26 +2570,19 @@ def user_management(host_id):
         return redirect(url_for('index'))
     
     try:
-        connection = proxmox_connections[host_id]['connection']
-        
-        # Get users
-        users = connection.access.users.get()
-        
-        # Get groups
-        groups = connection.access.groups.get()
-        
-        # Get roles
-        roles = connection.access.roles.get()
-        
-        # Get domains (authentication realms)
-        domains = connection.access.domains.get()
+        # Users, groups, roles, realms and ACLs are fetched together and cached
+        if request.args.get('refresh'):
+            identity_service.refresh_host(host_id)
+        identity = identity_service.get(host_id)
         
         return render_template('user_management.html',
                             host_id=host_id,
-                            users=users,
-                            groups=groups,
-                            roles=roles,
-                            domains=domains)
+                            users=identity['users'],
+                            groups=identity['groups'],
+                            roles=identity['roles'],
+                            domains=identity['domains'],
+                            permissions=identity['index'].acl_entries(),
+                            identity_errors=identity['errors'])
     except Exception as e:
         flash(f"Failed to get user list: {str(e)}", 'danger')
         return redirect(url_for('host_details', host_id=host_id))
@@ -1836,6 +2623,7 @@ def create_user(host_id):
         
         # Create the user
         connection.access.users.post(**params)
+        identity_service.invalidate(host_id)
         
         flash(f"User '{userid}' created successfully", 'success')
     except Exception as e:
@@ -1880,6 +2668,7 @@ def update_user(host_id, userid):
         
         # Update the user
         connection.access.users(userid).put(**params)
+        identity_service.invalidate(host_id)
         
         flash(f"User '{userid}' updated successfully", 'success')
     except Exception as e:
@@ -1898,6 +2687,7 @@ def delete_user(host_id, userid):
         
         # Delete the user
         connection.access.users(userid).delete()
+        identity_service.invalidate(host_id)
         
         flash(f"User '{userid}' deleted successfully", 'success')
     except Exception as e:
@@ -1920,6 +2710,7 @@ def create_group(host_id):
         
         # Create the group
         connection.access.groups.post(groupid=groupid, comment=comment)
+        identity_service.invalidate(host_id)
         
         flash(f"Group '{groupid}' created successfully", 'success')
     except Exception as e:
@@ -1938,6 +2729,7 @@ def delete_group(host_id, groupid):
         
         # Delete the group
         connection.access.groups(groupid).delete()
+        identity_service.invalidate(host_id)
         
         flash(f"Group '{groupid}' deleted successfully", 'success')
     except Exception as e:
@@ -1976,6 +2768,7 @@ def add_permission(host_id):
         
         # Add the permission
         connection.access.acl.put(**params)
+        identity_service.invalidate(host_id)
         
         flash("Permission added successfully", 'success')
     except Exception as e:
@@ -1983,6 +2776,161 @@ def add_permission(host_id):
     
     return redirect(url_for('user_management', host_id=host_id))
 
+def identity_hosts(args):
+    """The hosts selected by a host_id query argument (repeatable), all hosts when absent"""
+    host_ids = [host_id for host_id in args.getlist('host_id') if host_id]
+    return [host_id for host_id in host_ids if host_id in proxmox_connections] if host_ids else None
+
+@app.route('/permissions')
+def permission_matrix():
+    path = request.args.get('path') or '/'
+    privilege = request.args.get('privilege') or None
+    host_ids = identity_hosts(request.args)
+    if request.args.get('refresh'):
+        for host_id in host_ids or list(proxmox_connections):
+            identity_service.invalidate(host_id)
+
+    matrix = identity_service.matrix(path, privilege, host_ids)
+    userid = request.args.get('userid')
+    lookup = identity_service.permissions(userid, path, host_ids)[0] if userid else None
+    privileges = sorted({name for host_id in matrix['hosts']
+                         for name in identity_service.get(host_id)['index'].all_privileges})
+    return render_template('permission_matrix.html',
+                          matrix=matrix,
+                          lookup=lookup,
+                          privileges=privileges,
+                          all_hosts=sorted(proxmox_connections),
+                          filters={'path': path, 'privilege': privilege, 'userid': userid,
+                                   'host_id': host_ids or []})
+
+@app.route('/api/identity/permissions')
+def api_identity_permissions():
+    """Effective roles and privileges of a user or API token on a path, per host"""
+    userid = request.args.get('userid')
+    if not userid:
+        return jsonify({'success': False, 'error': 'userid is required'})
+
+    results, errors = identity_service.permissions(userid, request.args.get('path') or '/',
+                                                   identity_hosts(request.args))
+    return jsonify({'success': True, 'permissions': results, 'errors': errors})
+
+@app.route('/api/identity/matrix')
+def api_identity_matrix():
+    """Privileges of every user and token on a path across hosts"""
+    matrix = identity_service.matrix(request.args.get('path') or '/', request.args.get('privilege') or None,
+                                     identity_hosts(request.args))
+    return jsonify(dict(matrix, success=True))
+
+def identity_sync_reports(desired, host_ids, prune):
+    """Diff every host against a desired state from freshly fetched data, concurrently"""
+    def diff_host(host_id):
+        return identity_diff(identity_service.refresh_host(host_id), desired, prune)
+    
+    reports = {}
+    for host_id, result, error in parallel_map(diff_host, host_ids, max_workers=IDENTITY_FETCH_WORKERS):
+        if error:
+            reports[host_id] = {'operations': [], 'changes': {}, 'problems': [], 'error': str(error)}
+            continue
+        operations, problems = result
+        reports[host_id] = {
+            'operations': operations,
+            'changes': dict(Counter(operation['action'] for operation in operations)),
+            'problems': problems,
+            'error': None
+        }
+    return reports
+
+def start_identity_sync(reports):
+    """Start a bulk job applying each host's operations in order, several hosts at a time"""
+    items = [{
+        'label': f"{host_id}: {len(report['operations'])} change(s)",
+        'host_id': host_id,
+        'changes': report['changes'],
+        'applied': 0,
+        'params': report['operations'],
+        'phase': 'queued'
+    } for host_id, report in sorted(reports.items())]
+    
+    def sync_host(item):
+        host_id, operations = item['host_id'], item['params']
+        access = proxmox_connections[host_id]['connection'].access
+        try:
+            for done, operation in enumerate(operations):
+                try:
+                    apply_identity_operation(access, operation)
+                except Exception as e:
+                    raise Exception(f"{operation['action']} {operation['id']} failed after {done} of "
+                                    f"{len(operations)} change(s): {str(e)}")
+                job.update_item(item, applied=done + 1, phase=f"{done + 1}/{len(operations)}")
+        finally:
+            identity_service.invalidate(host_id)
+    
+    job = BulkJob('identity_sync', None, items, sync_host, total_limit=IDENTITY_SYNC_WORKERS)
+    register_job(job).start()
+    return job
+
+@app.route('/permissions/sync')
+def identity_sync():
+    return render_template('identity_sync.html',
+                          all_hosts=sorted(proxmox_connections),
+                          jobs=[job.progress() for job in list_jobs(kind='identity_sync')][:10],
+                          job_id=request.args.get('job'))
+
+@app.route('/api/identity/sync', methods=['POST'])
+def api_identity_sync():
+    """Bring the users, groups and ACLs of several hosts to one desired state, applying only each host's delta"""
+    try:
+        if request.files.get('file') and request.files['file'].filename:
+            state = json.loads(request.files['file'].read().decode('utf-8'))
+        else:
+            state = json.loads(request.form.get('state') or '{}')
+        desired = parse_identity_state(state)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f"Invalid desired state: {str(e)}"})
+    
+    try:
+        host_ids = json.loads(request.form.get('host_ids') or '[]') or sorted(proxmox_connections)
+        if not isinstance(host_ids, list) or not all(isinstance(host_id, str) for host_id in host_ids):
+            raise ValueError("not a list of host ids")
+    except ValueError:
+        return jsonify({'success': False, 'error': 'host_ids must be a JSON list'})
+    unknown = [host_id for host_id in host_ids if host_id not in proxmox_connections]
+    if unknown:
+        return jsonify({'success': False, 'error': f"Unknown host(s): {', '.join(unknown)}"})
+    if not host_ids:
+        return jsonify({'success': False, 'error': 'No hosts to synchronize'})
+    
+    started = time.time()
+    reports = identity_sync_reports(desired, host_ids, request.form.get('prune') == 'true')
+    # A host with problems is left untouched rather than brought half-way to the desired state
+    ready = {host_id: report for host_id, report in reports.items()
+             if report['operations'] and not report['problems'] and not report['error']}
+    summary = {
+        'hosts': {host_id: dict(report, operations=[
+            {key: operation[key] for key in ('action', 'id', 'fields') if key in operation}
+            for operation in report['operations']
+        ]) for host_id, report in reports.items()},
+        'changes': sum(len(report['operations']) for report in ready.values()),
+        'skipped': sorted(host_id for host_id, report in reports.items() if report['problems'] or report['error']),
+        'in_sync': sorted(host_id for host_id, report in reports.items()
+                          if not report['operations'] and not report['problems'] and not report['error']),
+        'diff_seconds': round(time.time() - started, 3)
+    }
+    
+    if request.form.get('dry_run') == 'true':
+        return jsonify(dict(summary, success=True, dry_run=True))
+    if not ready:
+        return jsonify(dict(summary, success=True, message='No host needs changes that can be applied'))
+    
+    job = start_identity_sync(ready)
+    app_logger.info(f"Started identity sync {job.id}: {summary['changes']} change(s) on {len(ready)} host(s), "
+                    f"{len(summary['skipped'])} skipped")
+    return jsonify(dict(summary,
+                        success=True,
+                        job_id=job.id,
+                        message=f"Applying {summary['changes']} change(s) to {len(ready)} host(s)",
+                        status_url=url_for('bulk_job_status', job_id=job.id)))
+
 @app.route('/host/<host_id>/firewall')
 def cluster_firewall(host_id):
     if host_id not in proxmox_connections:
@@ -1990,24 +2938,25 @@ def cluster_firewall(host_id):
         return redirect(url_for('index'))
     
     try:
-        connection = proxmox_connections[host_id]['connection']
-        
-        # Get cluster firewall configuration
-        firewall_config = connection.cluster.firewall.options.get()
-        security_groups = connection.cluster.firewall.groups.get()
-        
-        # Get IPSets
-        ipsets = connection.cluster.firewall.ipset.get()
-        
-        # Get cluster-wide firewall rules
-        rules = connection.cluster.firewall.rules.get()
+        firewall = proxmox_connections[host_id]['connection'].cluster.firewall
+        
+        # Options, security groups, IP sets and rules are fetched concurrently
+        results, errors = fetch_calls({
+            'options': firewall.options.get,
+            'groups': firewall.groups.get,
+            'ipsets': firewall.ipset.get,
+            'rules': firewall.rules.get
+        })
+        if errors:
+            raise Exception('; '.join(f"{name}: {error}" for name, error in errors.items()))
         
         return render_template('cluster_firewall.html',
                             host_id=host_id,
-                            firewall_config=firewall_config,
-                            security_groups=security_groups,
-                            ipsets=ipsets,
-                            rules=rules)
+                            firewall_config=results['options'],
+                            security_groups=results['groups'],
+                            ipsets=results['ipsets'],
+                            rules=results['rules'],
+                            job_id=request.args.get('job'))
     except Exception as e:
         flash(f"Failed to get firewall configuration: {str(e)}", 'danger')
         return redirect(url_for('host_details', host_id=host_id))
@@ -2024,6 +2973,7 @@ def toggle_cluster_firewall(host_id):
         
         # Update firewall status
         connection.cluster.firewall.options.put(enable=1 if enabled else 0)
+        firewall_inventory.invalidate(host_id)
         
         status = "enabled" if enabled else "disabled"
         flash(f"Firewall {status} successfully", 'success')
@@ -2073,6 +3023,7 @@ def add_cluster_firewall_rule(host_id):
         
         # Add rule to the cluster firewall
         connection.cluster.firewall.rules.post(**params)
+        firewall_inventory.invalidate(host_id)
         
         flash("Firewall rule added successfully", 'success')
     except Exception as e:
@@ -2091,6 +3042,7 @@ def delete_cluster_firewall_rule(host_id, rule_pos):
         
         # Delete the rule
         connection.cluster.firewall.rules.delete(pos=rule_pos)
+        firewall_inventory.invalidate(host_id)
         
         flash("Firewall rule deleted successfully", 'success')
     except Exception as e:
@@ -2111,6 +3063,7 @@ def create_ipset(host_id):
         
         # Create IP set
         connection.cluster.firewall.ipset.post(name=name, comment=comment)
+        firewall_inventory.invalidate(host_id)
         
         flash(f"IP set '{name}' created successfully", 'success')
     except Exception as e:
@@ -2129,6 +3082,7 @@ def delete_ipset(host_id, name):
         
         # Delete IP set
         connection.cluster.firewall.ipset(name).delete()
+        firewall_inventory.invalidate(host_id)
         
         flash(f"IP set '{name}' deleted successfully", 'success')
     except Exception as e:
@@ -2150,6 +3104,7 @@ def add_ipset_entry(host_id, name):
         
         # Add entry to IP set
         connection.cluster.firewall.ipset(name).post(cidr=cidr, comment=comment)
+        firewall_inventory.invalidate(host_id)
         
         flash(f"Entry added to IP set '{name}' successfully", 'success')
     except Exception as e:
@@ -2157,6 +3112,111 @@ def add_ipset_entry(host_id, name):
     
     return redirect(url_for('cluster_firewall', host_id=host_id))
 
+def start_ipset_sync(host_id, name, diff, comment=''):
+    """Start a bulk job applying an IP set diff in batches; removals wait until every addition succeeded"""
+    ipset_api = proxmox_connections[host_id]['connection'].cluster.firewall.ipset(name)
+    
+    def batches(action, cidrs):
+        return [{
+            'label': f"{action.capitalize()} {len(cidrs[start:start + IPSET_SYNC_BATCH])} entries from {cidrs[start]}",
+            'action': action,
+            'entries': len(cidrs[start:start + IPSET_SYNC_BATCH]),
+            'params': cidrs[start:start + IPSET_SYNC_BATCH],
+            'phase': 'queued'
+        } for start in range(0, len(cidrs), IPSET_SYNC_BATCH)]
+    
+    adds, removes = batches('add', diff['add']), batches('remove', diff['remove'])
+    # Removing first could briefly uncover addresses that an aggregated addition still has to cover,
+    # and the old entries are kept when some new ones are missing
+    after = list(range(len(adds)))
+    for item in removes:
+        item['after'] = after
+    
+    def sync_batch(item):
+        started = time.time()
+        for done, cidr in enumerate(item['params'], 1):
+            if item['action'] == 'add':
+                ipset_api.post(cidr=cidr, comment=comment)
+            else:
+                ipset_entry_api(ipset_api, cidr).delete()
+            if done % 10 == 0:
+                job.update_item(item, phase=f"{done}/{item['entries']}")
+        elapsed = time.time() - started
+        job.update_item(item, phase=f"done in {elapsed:.1f}s ({item['entries'] / elapsed if elapsed else 0:.0f}/s)")
+    
+    def finish(job):
+        firewall_inventory.invalidate(host_id)
+        applied = sum(item['entries'] for item in job.items if item['status'] == 'success')
+        elapsed = max(time.time() - job.started, 0.001)
+        app_logger.info(f"IP set sync {job.id} of '{name}' on {host_id} applied {applied} changes in {elapsed:.1f}s "
+                        f"({applied / elapsed:.0f}/s)")
+    
+    job = BulkJob('ipset_sync', host_id, adds + removes, sync_batch, total_limit=IPSET_SYNC_WORKERS)
+    register_job(job).start(finish=finish)
+    return job
+
+@app.route('/api/host/<host_id>/firewall/ipset/<name>/sync', methods=['POST'])
+def api_sync_ipset(host_id, name):
+    """Make an IP set hold exactly an uploaded or local list, aggregated, applying only the difference"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    try:
+        if request.files.get('file') and request.files['file'].filename:
+            text = request.files['file'].read().decode('utf-8', errors='replace')
+        elif request.form.get('path'):
+            text = read_local_list(request.form['path'].strip())
+        else:
+            return jsonify({'success': False, 'error': 'Upload a list file or give a local path'})
+    except (OSError, ValueError) as e:
+        return jsonify({'success': False, 'error': f"Failed to read the list: {str(e)}"})
+    
+    networks, invalid = parse_cidr_list(text)
+    if invalid and request.form.get('ignore_invalid') != 'true':
+        return jsonify({'success': False, 'error': f"{len(invalid)} invalid entries, e.g. {', '.join(invalid[:5])}",
+                        'invalid': invalid[:100]})
+    
+    try:
+        ipset_api = proxmox_connections[host_id]['connection'].cluster.firewall.ipset
+        if name not in {ipset['name'] for ipset in ipset_api.get()}:
+            if request.form.get('create') != 'true':
+                return jsonify({'success': False, 'error': f"IP set '{name}' does not exist"})
+            if request.form.get('dry_run') != 'true':
+                ipset_api.post(name=name, comment=request.form.get('comment', ''))
+            entries = []
+        else:
+            entries = ipset_api(name).get()
+    except Exception as e:
+        return jsonify({'success': False, 'error': f"Failed to read IP set '{name}': {str(e)}"})
+    
+    started = time.time()
+    diff = ipset_diff(entries, networks)
+    summary = {
+        'listed': len(networks),
+        'invalid': len(invalid),
+        'aggregated': diff['desired'],
+        'current': len(entries),
+        'add': len(diff['add']),
+        'remove': len(diff['remove']),
+        'unchanged': diff['unchanged'],
+        'kept': diff['kept'],
+        'diff_seconds': round(time.time() - started, 3)
+    }
+    
+    if request.form.get('dry_run') == 'true':
+        return jsonify(dict(summary, success=True, dry_run=True, adds=diff['add'][:500], removes=diff['remove'][:500]))
+    if not diff['add'] and not diff['remove']:
+        return jsonify(dict(summary, success=True, message=f"IP set '{name}' is already in sync"))
+    
+    job = start_ipset_sync(host_id, name, diff, request.form.get('comment', ''))
+    app_logger.info(f"Started IP set sync {job.id} of '{name}' on {host_id}: {summary['add']} additions, "
+                    f"{summary['remove']} removals")
+    return jsonify(dict(summary,
+                        success=True,
+                        job_id=job.id,
+                        message=f"Adding {summary['add']} and removing {summary['remove']} entries of '{name}'",
+                        status_url=url_for('bulk_job_status', job_id=job.id)))
+
 @app.route('/host/<host_id>/firewall/security-group', methods=['POST'])
 def create_security_group(host_id):
     if host_id not in proxmox_connections:
@@ -2171,6 +3231,7 @@ def create_security_group(host_id):
         
         # Create security group
         connection.cluster.firewall.groups.post(group=group_name, comment=comment)
+        firewall_inventory.invalidate(host_id)
         
         flash(f"Security group '{group_name}' created successfully", 'success')
     except Exception as e:
@@ -2178,6 +3239,313 @@ def create_security_group(host_id):
     
     return redirect(url_for('cluster_firewall', host_id=host_id))
 
+def firewall_filters(args):
+    """Firewall rule search filters from request args"""
+    return {
+        'direction': args.get('direction') or None,
+        'action': args.get('action') or None,
+        'proto': args.get('proto') or None,
+        'port': args.get('port', type=int),
+        'scope': args.get('scope') or None,
+        'vmid': args.get('vmid') or None,
+        'node': args.get('node') or None,
+        'text': args.get('q') or None,
+        'enabled_only': args.get('enabled_only') in ('1', 'true', 'on')
+    }
+
+@app.route('/host/<host_id>/firewall/audit')
+def firewall_audit(host_id):
+    """Search the rules of every firewall scope of a host at once"""
+    if host_id not in proxmox_connections:
+        flash("Host not found", 'danger')
+        return redirect(url_for('index'))
+    
+    try:
+        if request.args.get('refresh'):
+            firewall_inventory.refresh_host(host_id)
+        
+        data = firewall_inventory.get(host_id)
+        rules = firewall_inventory.search(host_id, **firewall_filters(request.args))
+        
+        return render_template('firewall_audit.html',
+                              host_id=host_id,
+                              rules=rules,
+                              firewall=data,
+                              guest_count=len({rule['vmid'] for rule in rules if rule.get('vmid') is not None}),
+                              nodes=sorted(data['nodes']),
+                              filters={key: value for key, value in request.args.items() if key != 'refresh'})
+    except Exception as e:
+        flash(f"Failed to collect firewall rules: {str(e)}", 'danger')
+        return redirect(url_for('cluster_firewall', host_id=host_id))
+
+@app.route('/api/host/<host_id>/firewall/rules')
+def api_firewall_rules(host_id):
+    """Rules of every firewall scope of a host, filtered by direction, action, protocol, port, scope and text"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    try:
+        if request.args.get('refresh'):
+            firewall_inventory.refresh_host(host_id)
+        
+        rules = firewall_inventory.search(host_id, **firewall_filters(request.args))
+        data = firewall_inventory.get(host_id)
+        return jsonify({
+            'success': True,
+            'rules': rules,
+            'guests': sorted({rule['vmid'] for rule in rules if rule.get('vmid') is not None}),
+            'fetched': data['fetched'],
+            'errors': data['errors']
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+def firewall_packet(args):
+    """A firewall check packet from request args"""
+    return {
+        'direction': args.get('direction') or 'in',
+        'proto': args.get('proto') or 'tcp',
+        'port': args.get('port', type=int),
+        'source': args.get('source') or None,
+        'dest': args.get('dest') or None
+    }
+
+@app.route('/host/<host_id>/firewall/analysis')
+def firewall_analysis(host_id):
+    """Check which guests or nodes a packet reaches and what changed since the previous collection"""
+    if host_id not in proxmox_connections:
+        flash("Host not found", 'danger')
+        return redirect(url_for('index'))
+    
+    try:
+        if request.args.get('refresh'):
+            firewall_inventory.refresh_host(host_id)
+        
+        policy = firewall_inventory.policy(host_id)
+        results = None
+        if request.args.get('check'):
+            packet = firewall_packet(request.args)
+            if request.args.get('vmid'):
+                results = [policy.check('guest', request.args['vmid'], **packet)]
+            elif request.args.get('node'):
+                results = [policy.check('node', request.args['node'], **packet)]
+            else:
+                results = policy.reachable(request.args.get('kind') or 'guest', **packet)
+        
+        return render_template('firewall_analysis.html',
+                              host_id=host_id,
+                              firewall=firewall_inventory.get(host_id),
+                              entries=len(policy.entries),
+                              results=results,
+                              changes=firewall_inventory.changes(host_id),
+                              nodes=sorted(firewall_inventory.get(host_id)['nodes']),
+                              filters={key: value for key, value in request.args.items() if key != 'refresh'})
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('firewall_analysis', host_id=host_id))
+    except Exception as e:
+        flash(f"Failed to analyze the firewall: {str(e)}", 'danger')
+        return redirect(url_for('cluster_firewall', host_id=host_id))
+
+@app.route('/api/host/<host_id>/firewall/check')
+def api_firewall_check(host_id):
+    """Whether a packet reaches a guest (vmid) or node, or every guest or node when neither is given"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    try:
+        policy = firewall_inventory.policy(host_id)
+        packet = firewall_packet(request.args)
+        if request.args.get('vmid'):
+            return jsonify({'success': True, 'result': policy.check('guest', request.args['vmid'], **packet)})
+        if request.args.get('node'):
+            return jsonify({'success': True, 'result': policy.check('node', request.args['node'], **packet)})
+        
+        results = policy.reachable(request.args.get('kind') or 'guest', **packet)
+        return jsonify({
+            'success': True,
+            'results': results,
+            'allowed': [result['target'] for result in results if result['allowed']]
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/host/<host_id>/firewall/changes', methods=['GET', 'POST'])
+def api_firewall_changes(host_id):
+    """Firewall changes since the previous collection, or since a snapshot posted as JSON"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    try:
+        baseline = None
+        if request.method == 'POST':
+            if 'snapshot' in request.files:
+                baseline = json.load(request.files['snapshot'])
+            else:
+                baseline = request.get_json(silent=True)
+            if not baseline:
+                return jsonify({'success': False, 'error': 'No firewall snapshot provided'})
+        
+        if request.args.get('refresh'):
+            firewall_inventory.refresh_host(host_id)
+        changes = firewall_inventory.changes(host_id, baseline)
+        return jsonify({
+            'success': True,
+            'changes': changes or [],
+            'baseline': changes is not None,
+            'fetched': firewall_inventory.get(host_id)['fetched']
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+def start_firewall_deployment(host_id, guests, rules, at_top=True, rollback=True):
+    """Start a bulk job adding rules to every given guest, rolled back everywhere if any guest fails"""
+    connection = proxmox_connections[host_id]['connection']
+    limiter = RateLimiter(FIREWALL_DEPLOY_RATE)
+    before = {}
+    
+    items = [{
+        'label': f"{guest.get('name') or guest['vmid']} ({guest['type']} {guest['vmid']} on {guest['node']})",
+        'node': guest['node'],
+        'type': guest['type'],
+        'vmid': int(guest['vmid']),
+        'phase': 'queued',
+        'posted': 0,
+        'keys': [('node', guest['node'])]
+    } for guest in guests]
+    
+    def rules_api(item):
+        return guest_api(connection, item['type'], item['node'], item['vmid']).firewall.rules
+    
+    def deploy(item):
+        api = rules_api(item)
+        before[item['index']] = api.get()
+        job.update_item(item, phase='posting')
+        try:
+            added = apply_rules(api, before[item['index']], rules, at_top, limiter,
+                                progress=lambda done, total: job.update_item(item, posted=done, phase=f"posted {done}/{total}"))
+        except Exception:
+            # One failure dooms the whole deployment, so stop starting new guests
+            if rollback:
+                job.cancel()
+            raise
+        job.update_item(item, phase='verified' if added else 'unchanged')
+    
+    def finish(job):
+        failed = [item for item in job.items if item['status'] in ('failed', 'cancelled')]
+        if rollback and failed:
+            changed = [item for item in job.items if item['posted']]
+            app_logger.warning(f"Firewall deployment {job.id} on {host_id}: {len(failed)} guests failed, "
+                               f"rolling back {len(changed)}")
+            
+            def undo(item):
+                removed = revert_rules(rules_api(item), before[item['index']], at_top, limiter)
+                job.update_item(item, phase=f"rolled back ({removed} removed)")
+            
+            for item, _, error in parallel_map(undo, changed, max_workers=FIREWALL_DEPLOY_WORKERS):
+                if error:
+                    job.update_item(item, phase='rollback failed',
+                                    error=f"{item['error'] + '; ' if item['error'] else ''}rollback failed: {str(error)}")
+        firewall_inventory.invalidate(host_id)
+    
+    job = BulkJob('firewall_deploy', host_id, items, deploy,
+                  limits={'node': FIREWALL_DEPLOY_MAX_PER_NODE}, total_limit=FIREWALL_DEPLOY_WORKERS)
+    register_job(job).start(finish=finish)
+    
+    app_logger.info(f"Started firewall deployment {job.id} of {len(rules)} rules to {len(items)} guests on {host_id}")
+    return job
+
+def firewall_deploy_rules(form):
+    """Rules to deploy from a form: a JSON 'rules' list, or the fields of a single rule"""
+    if form.get('rules'):
+        rules = json.loads(form['rules'])
+        if not isinstance(rules, list):
+            raise ValueError("Rules must be a list")
+    else:
+        rules = [{field: form.get(field) for field in ('type', 'action', 'macro', 'proto', 'source', 'dest',
+                                                       'dport', 'sport', 'icmp-type', 'iface', 'log', 'comment')}]
+        rules[0]['enable'] = form.get('enable', 'on')
+    if not rules:
+        raise ValueError("No rules given")
+    return [deployable_rule(rule) for rule in rules]
+
+@app.route('/host/<host_id>/firewall/deploy')
+def firewall_deploy(host_id):
+    """Add firewall rules to every guest matching a selection"""
+    if host_id not in proxmox_connections:
+        flash("Host not found", 'danger')
+        return redirect(url_for('index'))
+    
+    try:
+        inventory_snapshot = inventory.get_snapshot(host_id)
+        groups = proxmox_connections[host_id]['connection'].cluster.firewall.groups.get()
+        
+        return render_template('firewall_deploy.html',
+                              host_id=host_id,
+                              nodes=sorted(node['node'] for node in inventory_snapshot['nodes']),
+                              pools=sorted({guest['pool'] for guest in inventory_snapshot['guests'] if guest.get('pool')}),
+                              groups=sorted(group['group'] for group in groups),
+                              macros=sorted(FIREWALL_MACROS),
+                              jobs=[job.progress() for job in list_jobs(host_id, 'firewall_deploy')][:10],
+                              job_id=request.args.get('job'))
+    except Exception as e:
+        flash(f"Failed to prepare firewall deployment: {str(e)}", 'danger')
+        return redirect(url_for('cluster_firewall', host_id=host_id))
+
+@app.route('/api/host/<host_id>/firewall/deploy', methods=['POST'])
+def api_firewall_deploy(host_id):
+    """Add rules to every guest matching the selection concurrently, verified by read-back and rolled back on failure"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    try:
+        rules = firewall_deploy_rules(request.form)
+        vmids = json.loads(request.form.get('vmids', '[]'))
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({'success': False, 'error': f"Invalid rules: {str(e)}"})
+    
+    # 'type' is the rule direction here, so the guest type filter is 'guest_type'
+    guests = select_guests(inventory.get_snapshot(host_id), vmids,
+                           node=request.form.get('node') or None,
+                           guest_type=request.form.get('guest_type') or None,
+                           tag=request.form.get('tag') or None,
+                           pool=request.form.get('pool') or None)
+    if not guests:
+        return jsonify({'success': False, 'error': 'No guests match the selection'})
+    
+    if request.form.get('dry_run') == 'true':
+        return jsonify({
+            'success': True,
+            'dry_run': True,
+            'rules': rules,
+            'guests': [{'vmid': int(guest['vmid']), 'name': guest.get('name'), 'type': guest['type'],
+                        'node': guest['node']} for guest in guests]
+        })
+    
+    job = start_firewall_deployment(host_id, guests, rules,
+                                    at_top=request.form.get('position', 'top') != 'bottom',
+                                    rollback=request.form.get('rollback', 'true') == 'true')
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'message': f"Deploying {len(rules)} rules to {len(guests)} guests",
+        'status_url': url_for('bulk_job_status', job_id=job.id)
+    })
+
+@app.route('/api/host/<host_id>/firewall/snapshot')
+def api_firewall_snapshot(host_id):
+    """The collected firewall configuration of a host: options, rules, groups, IP sets and aliases of every scope"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    try:
+        if request.args.get('refresh'):
+            firewall_inventory.refresh_host(host_id)
+        data = firewall_inventory.get(host_id)
+        return jsonify(dict({key: value for key, value in data.items() if key != 'rows'}, success=True))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/node/<host_id>/<node>/firewall')
 def node_firewall(host_id, node):
     if host_id not in proxmox_connections:
@@ -2185,19 +3553,18 @@ def node_firewall(host_id, node):
         return redirect(url_for('index'))
     
     try:
-        connection = proxmox_connections[host_id]['connection']
-        
-        # Get node firewall configuration
-        firewall_config = connection.nodes(node).firewall.options.get()
+        firewall = proxmox_connections[host_id]['connection'].nodes(node).firewall
         
-        # Get node-specific firewall rules
-        rules = connection.nodes(node).firewall.rules.get()
+        # Options and rules are fetched concurrently
+        results, errors = fetch_calls({'options': firewall.options.get, 'rules': firewall.rules.get})
+        if errors:
+            raise Exception('; '.join(f"{name}: {error}" for name, error in errors.items()))
         
         return render_template('node_firewall.html',
                             host_id=host_id,
                             node=node,
-                            firewall_config=firewall_config,
-                            rules=rules)
+                            firewall_config=results['options'],
+                            rules=results['rules'])
     except Exception as e:
         flash(f"Failed to get node firewall configuration: {str(e)}", 'danger')
         return redirect(url_for('node_details', host_id=host_id, node=node))
@@ -2214,6 +3581,7 @@ def toggle_node_firewall(host_id, node):
         
         # Update firewall status
         connection.nodes(node).firewall.options.put(enable=1 if enabled else 0)
+        firewall_inventory.invalidate(host_id)
         
         status = "enabled" if enabled else "disabled"
         flash(f"Node firewall {status} successfully", 'success')
@@ -2263,6 +3631,7 @@ def add_node_firewall_rule(host_id, node):
         
         # Add rule to the node firewall
         connection.nodes(node).firewall.rules.post(**params)
+        firewall_inventory.invalidate(host_id)
         
         flash("Node firewall rule added successfully", 'success')
     except Exception as e:
@@ -2281,6 +3650,7 @@ def delete_node_firewall_rule(host_id, node, rule_pos):
         
         # Delete the rule
         connection.nodes(node).firewall.rules.delete(pos=rule_pos)
+        firewall_inventory.invalidate(host_id)
         
         flash("Node firewall rule deleted successfully", 'success')
     except Exception as e:
@@ -2297,20 +3667,21 @@ def vm_firewall(host_id, node, vmid):
     try:
         connection = proxmox_connections[host_id]['connection']
         
-        # Get VM information for the header
-        vm_info = connection.nodes(node).qemu(vmid).status.current.get()
-        
-        # Get VM firewall configuration
-        firewall_config = connection.nodes(node).qemu(vmid).firewall.options.get()
+        # The name comes from the inventory rather than an extra status call
+        vm_info = snapshot_guest(inventory.get_snapshot(host_id), vmid) or {}
         
-        # Get VM-specific firewall rules
-        rules = connection.nodes(node).qemu(vmid).firewall.rules.get()
-        
-        # Get available security groups
-        security_groups = connection.cluster.firewall.groups.get()
-        
-        # Get current assigned security groups
-        refs = connection.nodes(node).qemu(vmid).firewall.refs.get()
+        # Options, rules, security groups and refs are fetched concurrently
+        firewall = connection.nodes(node).qemu(vmid).firewall
+        results, errors = fetch_calls({
+            'options': firewall.options.get,
+            'rules': firewall.rules.get,
+            'groups': connection.cluster.firewall.groups.get,
+            'refs': firewall.refs.get
+        })
+        if errors:
+            raise Exception('; '.join(f"{name}: {error}" for name, error in errors.items()))
+        firewall_config, rules = results['options'], results['rules']
+        security_groups, refs = results['groups'], results['refs']
         
         return render_template('vm_firewall.html',
                             host_id=host_id,
@@ -2337,6 +3708,7 @@ def toggle_vm_firewall(host_id, node, vmid):
         
         # Update firewall status
         connection.nodes(node).qemu(vmid).firewall.options.put(enable=1 if enabled else 0)
+        firewall_inventory.invalidate(host_id)
         
         status = "enabled" if enabled else "disabled"
         flash(f"VM firewall {status} successfully", 'success')
@@ -2386,6 +3758,7 @@ def add_vm_firewall_rule(host_id, node, vmid):
         
         # Add rule to the VM firewall
         connection.nodes(node).qemu(vmid).firewall.rules.post(**params)
+        firewall_inventory.invalidate(host_id)
         
         flash("VM firewall rule added successfully", 'success')
     except Exception as e:
@@ -2404,6 +3777,7 @@ def delete_vm_firewall_rule(host_id, node, vmid, rule_pos):
         
         # Delete the rule
         connection.nodes(node).qemu(vmid).firewall.rules.delete(pos=rule_pos)
+        firewall_inventory.invalidate(host_id)
         
         flash("VM firewall rule deleted successfully", 'success')
     except Exception as e:
@@ -2423,6 +3797,7 @@ def add_vm_security_group(host_id, node, vmid):
         
         # Add security group reference
         connection.nodes(node).qemu(vmid).firewall.refs.post(group=group)
+        firewall_inventory.invalidate(host_id)
         
         flash(f"Security group '{group}' assigned to VM successfully", 'success')
     except Exception as e:
@@ -2441,6 +3816,7 @@ def delete_vm_security_group(host_id, node, vmid, group):
         
         # Delete security group reference
         connection.nodes(node).qemu(vmid).firewall.refs(group).delete()
+        firewall_inventory.invalidate(host_id)
         
         flash(f"Security group '{group}' removed from VM successfully", 'success')
     except Exception as e:
@@ -2457,20 +3833,21 @@ def container_firewall(host_id, node, vmid):
     try:
         connection = proxmox_connections[host_id]['connection']
         
-        # Get container information for the header
-        container_info = connection.nodes(node).lxc(vmid).status.current.get()
-        
-        # Get container firewall configuration
-        firewall_config = connection.nodes(node).lxc(vmid).firewall.options.get()
-        
-        # Get container-specific firewall rules
-        rules = connection.nodes(node).lxc(vmid).firewall.rules.get()
-        
-        # Get available security groups
-        security_groups = connection.cluster.firewall.groups.get()
+        # The name comes from the inventory rather than an extra status call
+        container_info = snapshot_guest(inventory.get_snapshot(host_id), vmid) or {}
         
-        # Get current assigned security groups
-        refs = connection.nodes(node).lxc(vmid).firewall.refs.get()
+        # Options, rules, security groups and refs are fetched concurrently
+        firewall = connection.nodes(node).lxc(vmid).firewall
+        results, errors = fetch_calls({
+            'options': firewall.options.get,
+            'rules': firewall.rules.get,
+            'groups': connection.cluster.firewall.groups.get,
+            'refs': firewall.refs.get
+        })
+        if errors:
+            raise Exception('; '.join(f"{name}: {error}" for name, error in errors.items()))
+        firewall_config, rules = results['options'], results['rules']
+        security_groups, refs = results['groups'], results['refs']
         
         return render_template('container_firewall.html',
                             host_id=host_id,
@@ -2497,6 +3874,7 @@ def toggle_container_firewall(host_id, node, vmid):
         
         # Update firewall status
         connection.nodes(node).lxc(vmid).firewall.options.put(enable=1 if enabled else 0)
+        firewall_inventory.invalidate(host_id)
         
         status = "enabled" if enabled else "disabled"
         flash(f"Container firewall {status} successfully", 'success')
@@ -2546,6 +3924,7 @@ def add_container_firewall_rule(host_id, node, vmid):
         
         # Add rule to the container firewall
         connection.nodes(node).lxc(vmid).firewall.rules.post(**params)
+        firewall_inventory.invalidate(host_id)
         
         flash("Container firewall rule added successfully", 'success')
     except Exception as e:
@@ -2564,6 +3943,7 @@ def delete_container_firewall_rule(host_id, node, vmid, rule_pos):
         
         # Delete the rule
         connection.nodes(node).lxc(vmid).firewall.rules.delete(pos=rule_pos)
+        firewall_inventory.invalidate(host_id)
         
         flash("Container firewall rule deleted successfully", 'success')
     except Exception as e:
@@ -2583,6 +3963,7 @@ def add_container_security_group(host_id, node, vmid):
         
         # Add security group reference
         connection.nodes(node).lxc(vmid).firewall.refs.post(group=group)
+        firewall_inventory.invalidate(host_id)
         
         flash(f"Security group '{group}' assigned to container successfully", 'success')
     except Exception as e:
@@ -2601,6 +3982,7 @@ def delete_container_security_group(host_id, node, vmid, group):
         
         # Delete security group reference
         connection.nodes(node).lxc(vmid).firewall.refs(group).delete()
+        firewall_inventory.invalidate(host_id)
         
         flash(f"Security group '{group}' removed from container successfully", 'success')
     except Exception as e:
@@ -2617,44 +3999,27 @@ def template_management(host_id, node):
     try:
         connection = proxmox_connections[host_id]['connection']
         
-        # Get available storage pools for this node
-        storages = connection.nodes(node).storage.get()
+        # Get available storage pools and their contents from the shared catalog
+        catalog = get_content_catalog(host_id, node, refresh=request.args.get('refresh') == '1')
         
         # Filter storages that can contain templates (vztmpl) and ISO images
-        template_storages = [storage for storage in storages if 'vztmpl' in storage.get('content', '').split(',')]
-        iso_storages = [storage for storage in storages if 'iso' in storage.get('content', '').split(',')]
-        vm_storages = [storage for storage in storages if 'images' in storage.get('content', '').split(',')]
+        template_storages = catalog_storages(catalog, 'vztmpl')
+        iso_storages = catalog_storages(catalog, 'iso')
+        vm_storages = catalog_storages(catalog, 'images')
         
-        # Get existing templates
-        templates = []
-        for storage in template_storages:
-            try:
-                content = connection.nodes(node).storage(storage['storage']).content.get()
-                template_list = [item for item in content if item.get('content') == 'vztmpl']
-                for tmpl in template_list:
-                    tmpl['storage'] = storage['storage']
-                templates.extend(template_list)
-            except Exception as e:
-                print(f"Error getting template list from {storage['storage']}: {str(e)}")
-        
-        # Get existing ISO images
-        iso_images = []
-        for storage in iso_storages:
-            try:
-                content = connection.nodes(node).storage(storage['storage']).content.get()
-                iso_list = [item for item in content if item.get('content') == 'iso']
-                for iso in iso_list:
-                    iso['storage'] = storage['storage']
-                iso_images.extend(iso_list)
-            except Exception as e:
-                print(f"Error getting ISO list from {storage['storage']}: {str(e)}")
+        # Get existing templates and ISO images
+        templates = catalog_items(catalog, 'vztmpl')
+        iso_images = catalog_items(catalog, 'iso')
         
-        # Get VMs and containers for template creation
+        # Get VMs and containers for template creation (existing templates can't be converted again)
         vms = []
         containers = []
+        vm_templates = []
         try:
-            vms = connection.nodes(node).qemu.get()
-            containers = connection.nodes(node).lxc.get()
+            snapshot = inventory.get_snapshot(host_id)
+            vms = snapshot_guests(snapshot, 'qemu', node)
+            containers = snapshot_guests(snapshot, 'lxc', node)
+            vm_templates = snapshot_templates(snapshot, 'qemu', node)
         except Exception as e:
             print(f"Error getting VMs or containers: {str(e)}")
                 
@@ -2667,11 +4032,79 @@ def template_management(host_id, node):
                             templates=templates,
                             iso_images=iso_images,
                             vms=vms,
-                            containers=containers)
+                            containers=containers,
+                            vm_templates=vm_templates)
     except Exception as e:
         flash(f"Failed to get template information: {str(e)}", 'danger')
         return redirect(url_for('node_details', host_id=host_id, node=node))
 
+@app.route('/api/host/<host_id>/templates')
+def api_template_registry(host_id):
+    """List VM and container templates across the cluster from the inventory snapshot"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    try:
+        snapshot = inventory.get_snapshot(host_id)
+        templates = snapshot_templates(snapshot, request.args.get('type'), request.args.get('node'))
+        return jsonify({'success': True, 'templates': templates, 'fetched': snapshot['fetched']})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/live/events')
+def live_events():
+    """Push node and guest state changes and alert updates from the inventory poller as server-sent events"""
+    host_ids = request.args.getlist('host_id') or None
+    if host_ids:
+        for host_id in host_ids:
+            if host_id not in proxmox_connections:
+                return jsonify({'success': False, 'error': 'Host not found'}), 404
+            
+            # Make sure the feed has a baseline for hosts nobody asked about yet
+            try:
+                inventory.get_snapshot(host_id)
+            except Exception as e:
+                app_logger.warning(f"Live feed could not load inventory for {host_id}: {str(e)}")
+    
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('since'))
+    
+    def full_snapshot():
+        version, states = live_feed.current(host_ids)
+        alerts = [alert for alert in alert_engine.active_alerts() if host_ids is None or alert['host_id'] in host_ids]
+        return version, (f"id: {version}\nevent: snapshot\ndata: {json.dumps(states)}\n\n"
+                         f"event: alerts\ndata: {json.dumps({'active': alerts, 'fired': [], 'resolved': []})}\n\n")
+    
+    def generate():
+        version, events = None, None
+        if last_event_id and last_event_id.isdigit():
+            # Reconnecting client: replay what it missed if history still covers it
+            version, events = live_feed.events_since(int(last_event_id), host_ids)
+        
+        if events is None:
+            version, message = full_snapshot()
+            yield message
+        else:
+            for event in events:
+                yield f"id: {event['version']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+        
+        while True:
+            if live_feed.wait(version, timeout=15) == version:
+                # Keep the connection alive through proxies
+                yield ": keepalive\n\n"
+                continue
+            
+            version, events = live_feed.events_since(version, host_ids)
+            if events is None:
+                version, message = full_snapshot()
+                yield message
+                continue
+            
+            for event in events:
+                yield f"id: {event['version']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/host/<host_id>/<node>/templates/download_container_template', methods=['POST'])
 def download_container_template(host_id, node):
     if host_id not in proxmox_connections:
@@ -2695,6 +4128,7 @@ def download_container_template(host_id, node):
             url=template_url
         )
         
+        invalidate_content_catalog_when_done(host_id, node, task)
         flash(f"Started download of container template: {os.path.basename(template_url)}", 'success')
     except Exception as e:
         flash(f"Failed to download template: {str(e)}", 'danger')
@@ -2724,6 +4158,7 @@ def download_iso(host_id, node):
             url=iso_url
         )
         
+        invalidate_content_catalog_when_done(host_id, node, task)
         flash(f"Started download of ISO image: {os.path.basename(iso_url)}", 'success')
     except Exception as e:
         flash(f"Failed to download ISO: {str(e)}", 'danger')
@@ -2748,7 +4183,8 @@ def delete_template(host_id, node):
         connection = proxmox_connections[host_id]['connection']
         
         # Delete the template/ISO
-        connection.nodes(node).storage(storage).content(volume).delete()
+        task = connection.nodes(node).storage(storage).content(volume).delete()
+        invalidate_content_catalog_when_done(host_id, node, task)
         
         content_name = "container template" if content_type == 'vztmpl' else "ISO image"
         flash(f"Deleted {content_name}: {os.path.basename(volume)}", 'success')
@@ -2807,25 +4243,141 @@ def upload_template(host_id, node):
     try:
         connection = proxmox_connections[host_id]['connection']
         
-        # Get upload URL for the storage
-        upload_url = connection.nodes(node).storage(storage).get_upload_url(content=content_type)
+        # Werkzeug spools large uploads to disk, so stream from there instead of reading it all
+        file.stream.seek(0, os.SEEK_END)
+        size = file.stream.tell()
+        file.stream.seek(0)
         
-        # Upload the file to Proxmox
-        response = requests.post(
-            upload_url, 
-            files={"filename": (file.filename, file.read())},
-            verify=False
-        )
+        progress = register_upload(UploadProgress(file.filename, size))
+        upid = stream_to_proxmox(connection, node, storage, content_type, file.stream, file.filename, size,
+                                 progress=progress)
         
-        if response.status_code == 200:
-            flash(f"Template uploaded successfully", 'success')
-        else:
-            flash(f"Failed to upload template: {response.text}", 'danger')
+        invalidate_content_catalog_when_done(host_id, node, upid)
+        flash(f"Template uploaded successfully. Task ID: {upid}", 'success')
     except Exception as e:
         flash(f"Failed to upload template: {str(e)}", 'danger')
     
     return redirect(url_for('template_management', host_id=host_id, node=node))
 
+@app.route('/api/host/<host_id>/<node>/templates/upload_stream', methods=['POST', 'PUT'])
+def upload_template_stream(host_id, node):
+    """Pipe a raw request body straight into a Proxmox storage upload"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    storage = request.args.get('storage')
+    content_type = request.args.get('content_type')
+    filename = request.args.get('filename')
+    size = request.content_length
+    
+    if not storage or not filename or content_type not in UPLOAD_CONTENT_TYPES:
+        return jsonify({'success': False, 'error': 'Storage, filename and a valid content type are required'})
+    
+    if not size:
+        return jsonify({'success': False, 'error': 'Content-Length is required for streaming uploads'}), 411
+    
+    try:
+        connection = proxmox_connections[host_id]['connection']
+        progress = register_upload(UploadProgress(filename, size))
+        
+        # The incoming stream cannot be rewound, so this path gets a single attempt
+        upid = stream_to_proxmox(connection, node, storage, content_type, request.stream, filename, size,
+                                 progress=progress, retries=1)
+        invalidate_content_catalog_when_done(host_id, node, upid)
+        
+        return jsonify({'success': True, 'upid': upid, 'upload': progress.to_dict()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/host/<host_id>/<node>/uploads', methods=['POST'])
+def create_upload_session(host_id, node):
+    """Start a resumable upload; chunks are sent with PUT /api/uploads/<id>?offset=N"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    storage = request.form.get('storage')
+    content_type = request.form.get('content_type')
+    filename = request.form.get('filename')
+    
+    try:
+        size = int(request.form.get('size', 0))
+    except ValueError:
+        size = 0
+    
+    if not storage or not filename or content_type not in UPLOAD_CONTENT_TYPES or size <= 0:
+        return jsonify({'success': False, 'error': 'Storage, filename, size and a valid content type are required'})
+    
+    try:
+        session_upload = UploadSession(host_id, node, storage, content_type, filename, size,
+                                       verify_checksum=request.form.get('verify_checksum') == 'true')
+        register_upload(session_upload)
+        
+        return jsonify({'success': True, 'upload_id': session_upload.id, 'offset': 0})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    upload = get_upload(upload_id)
+    if upload is None:
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+    
+    return jsonify({'success': True, 'upload': upload.to_dict()})
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    upload = get_upload(upload_id)
+    if not isinstance(upload, UploadSession):
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+    
+    if upload.host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    try:
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid offset'})
+    
+    length = request.content_length or 0
+    
+    try:
+        received = upload.write_chunk(request.stream, offset, length)
+    except ValueError as e:
+        # Tell the client where to resume from
+        return jsonify({'success': False, 'error': str(e), 'offset': upload.received}), 409
+    
+    if upload.claim('receiving'):
+        start_background_upload(upload, proxmox_connections[upload.host_id]['connection'],
+                                on_success=lambda upid: invalidate_content_catalog_when_done(
+                                    upload.host_id, upload.node, upid))
+    
+    return jsonify({'success': True, 'offset': received, 'upload': upload.to_dict()})
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    if remove_upload(upload_id) is None:
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+    
+    return jsonify({'success': True})
+
+@app.route('/api/uploads/<upload_id>/retry', methods=['POST'])
+def retry_upload(upload_id):
+    upload = get_upload(upload_id)
+    if not isinstance(upload, UploadSession):
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+    
+    if upload.host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    if not upload.claim('failed'):
+        return jsonify({'success': False, 'error': 'Only complete, failed uploads can be retried'})
+    
+    start_background_upload(upload, proxmox_connections[upload.host_id]['connection'],
+                            on_success=lambda upid: invalidate_content_catalog_when_done(
+                                upload.host_id, upload.node, upid))
+    
+    return jsonify({'success': True, 'upload': upload.to_dict()})
+
 @app.route('/host/<host_id>/cluster')
 def cluster_management(host_id):
     if host_id not in proxmox_connections:
@@ -3253,14 +4805,7 @@ def clone_vm(host_id, node, vmid):
         vm_info = connection.nodes(node).qemu(vmid).status.current.get()
         
         # Get next available VMID
-        try:
-            next_vmid = connection.cluster.nextid.get()
-        except Exception:
-            # Fallback if cluster API not available
-            vms = connection.nodes(node).qemu.get()
-            containers = connection.nodes(node).lxc.get()
-            existing_ids = [int(vm['vmid']) for vm in vms + containers]
-            next_vmid = max(existing_ids) + 1 if existing_ids else 100
+        next_vmid = vmid_allocator.next_free(host_id)
         
         # Get available storage pools and nodes
         storages = connection.nodes(node).storage.get()
@@ -3290,7 +4835,9 @@ def clone_vm(host_id, node, vmid):
                 params['target'] = target_node
             
             # Start clone operation
-            connection.nodes(node).qemu(vmid).clone.post(**params)
+            with vmid_allocator.hold(host_id, target_vmid):
+                connection.nodes(node).qemu(vmid).clone.post(**params)
+            inventory.invalidate(host_id)
             
             flash(f"Started cloning VM {vmid} to {target_name} (ID: {target_vmid})", 'success')
             
@@ -3326,14 +4873,7 @@ def clone_container(host_id, node, vmid):
         container_info = connection.nodes(node).lxc(vmid).status.current.get()
         
         # Get next available VMID
-        try:
-            next_vmid = connection.cluster.nextid.get()
-        except Exception:
-            # Fallback if cluster API not available
-            vms = connection.nodes(node).qemu.get()
-            containers = connection.nodes(node).lxc.get()
-            existing_ids = [int(vm['vmid']) for vm in vms + containers]
-            next_vmid = max(existing_ids) + 1 if existing_ids else 100
+        next_vmid = vmid_allocator.next_free(host_id)
         
         # Get available storage pools and nodes
         storages = connection.nodes(node).storage.get()
@@ -3361,7 +4901,9 @@ def clone_container(host_id, node, vmid):
                 params['target'] = target_node
             
             # Start clone operation
-            connection.nodes(node).lxc(vmid).clone.post(**params)
+            with vmid_allocator.hold(host_id, target_vmid):
+                connection.nodes(node).lxc(vmid).clone.post(**params)
+            inventory.invalidate(host_id)
             
             flash(f"Started cloning Container {vmid} to {target_hostname} (ID: {target_vmid})", 'success')
             
@@ -3701,7 +5243,8 @@ def node_metrics(host_id, node):
             try:
                 storage_id = storage.get('storage')
                 if storage_id:
-                    details = connection.nodes(node).storage(storage_id).status.get()
+                    # The listing already carries usage for active storages; only ask the rest individually
+                    details = storage if 'total' in storage else connection.nodes(node).storage(storage_id).status.get()
                     storage_status.append({
                         'name': storage_id,
                         'type': storage.get('type', 'unknown'),
@@ -4145,21 +5688,12 @@ def create_vm_template(host_id, node):
         # If version flag is set, add version suffix
         if add_version:
             # Find existing templates with similar names to determine version number
-            all_templates = []
-            template_storages = [s for s in connection.nodes(node).storage.get() if 'images' in s.get('content', '').split(',')]
-            
-            for template_storage in template_storages:
-                try:
-                    content = connection.nodes(node).storage(template_storage['storage']).content.get()
-                    vm_templates = [item for item in content if item.get('content') == 'images' and item.get('format') == 'qcow2']
-                    all_templates.extend(vm_templates)
-                except Exception:
-                    continue
+            all_templates = snapshot_templates(inventory.refresh_host(host_id), 'qemu')
             
             # Find highest existing version for this template name
             version = 1
             for template in all_templates:
-                template_name = template.get('volid', '').split('/')[-1]
+                template_name = template['name']
                 if template_name.startswith(f"{vm_name}-v") and template_name[len(f"{vm_name}-v"):].isdigit():
                     existing_version = int(template_name[len(f"{vm_name}-v"):])
                     if existing_version >= version:
@@ -4185,6 +5719,7 @@ def create_vm_template(host_id, node):
             template=1
         )
         
+        inventory.invalidate(host_id)
         flash(f"VM {vm_id} converted to template '{template_name}' successfully", 'success')
     except Exception as e:
         flash(f"Failed to create VM template: {str(e)}", 'danger')
@@ -4221,16 +5756,7 @@ def create_ct_template(host_id, node):
         # If version flag is set, add version suffix
         if add_version:
             # Find existing templates with similar names to determine version number
-            all_templates = []
-            template_storages = [s for s in connection.nodes(node).storage.get() if 'vztmpl' in s.get('content', '').split(',')]
-            
-            for template_storage in template_storages:
-                try:
-                    content = connection.nodes(node).storage(template_storage['storage']).content.get()
-                    ct_templates = [item for item in content if item.get('content') == 'vztmpl']
-                    all_templates.extend(ct_templates)
-                except Exception:
-                    continue
+            all_templates = catalog_items(get_content_catalog(host_id, node, refresh=True), 'vztmpl')
             
             # Find highest existing version for this template name
             version = 1
@@ -4247,7 +5773,7 @@ def create_ct_template(host_id, node):
         
         # Create a backup of the container to be used as template
         # Use vzdump API to create the backup
-        connection.nodes(node).vzdump.post(
+        upid = connection.nodes(node).vzdump.post(
             vmid=ct_id,
             storage=storage,
             mode='snapshot',
@@ -4257,6 +5783,7 @@ def create_ct_template(host_id, node):
             filename=f"{template_name}.tar.zst"  # Custom filename
         )
         
+        invalidate_content_catalog_when_done(host_id, node, upid)
         flash(f"Started creating template from container {ct_id} as '{template_name}.tar.zst'", 'success')
     except Exception as e:
         flash(f"Failed to create container template: {str(e)}", 'danger')
@@ -4281,63 +5808,18 @@ def clone_template(host_id, node):
     try:
         connection = proxmox_connections[host_id]['connection']
         
-        # Clone the template to the new name and target storage
-        # This requires copying the template file
+        # Proxmox copies the volume itself (POST on the volume); the volid is quoted so its '/' stays one segment
+        target_volid = f"{target_storage}:vztmpl/{target_name}"
+        upid = connection.nodes(node).storage(source_storage).content(quote(source_template, safe='')).post(
+            target=target_volid,
+            target_node=node
+        )
+        status = wait_for_task(connection, node, upid, timeout=3600)
+        if not task_succeeded(status):
+            raise Exception(f"Copy task failed: {status.get('exitstatus', 'unknown error')}")
         
-        # First, check if source and target storage are the same
-        if source_storage == target_storage:
-            # Use the content copy API if available, otherwise use a temporary VM
-            try:
-                # Try to copy directly
-                connection.nodes(node).storage(source_storage).content.post(
-                    content='vztmpl',
-                    target=target_storage,
-                    source=source_template
-                )
-                flash(f"Template cloned to '{target_name}' successfully", 'success')
-            except Exception as copy_error:
-                flash(f"Failed to clone template directly: {str(copy_error)}", 'warning')
-                
-                # Need to use a fallback approach - download and re-upload
-                # First get download URL for the source template
-                download_url = connection.nodes(node).storage(source_storage).content(source_template).get_download_url()
-                
-                # Download the template to a temporary file
-                import tempfile
-                import requests
-                import shutil
-                
-                with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-                    response = requests.get(download_url, stream=True)
-                    shutil.copyfileobj(response.raw, tmp_file)
-                    tmp_filename = tmp_file.name
-                
-                # Upload the template with the new name
-                upload_url = connection.nodes(node).storage(target_storage).get_upload_url(content='vztmpl')
-                
-                with open(tmp_filename, 'rb') as f:
-                    upload_response = requests.post(
-                        upload_url,
-                        files={"filename": (target_name, f.read())},
-                        verify=False
-                    )
-                    
-                    if upload_response.status_code == 200:
-                        flash(f"Template cloned to '{target_name}' successfully using download/upload method", 'success')
-                    else:
-                        flash(f"Failed to clone template: Upload error ({upload_response.status_code})", 'danger')
-                
-                # Remove the temporary file
-                import os
-                os.unlink(tmp_filename)
-        else:
-            # Different storage, use copy API
-            connection.nodes(node).storage(source_storage).content(source_template).copy.post(
-                target=target_storage,
-                target_volid=f"{target_storage}:vztmpl/{target_name}"
-            )
-            flash(f"Template cloned to '{target_name}' on storage '{target_storage}' successfully", 'success')
-            
+        flash(f"Template cloned to '{target_name}' on storage '{target_storage}' successfully", 'success')
+        invalidate_content_catalog(host_id)
     except Exception as e:
         flash(f"Failed to clone template: {str(e)}", 'danger')
     
@@ -4585,21 +6067,20 @@ def settings():
         'default_view': request.cookies.get('default_view', 'list')
     }
     
-    # Load resource threshold settings from session if available
-    if 'resource_thresholds' in session:
-        resource_settings = session['resource_thresholds']
-        settings_data.update({
-            'enable_resource_alerts': resource_settings.get('enable_resource_alerts', True),
-            'cpu_threshold': resource_settings.get('cpu_threshold', 80),
-            'cpu_alert_level': resource_settings.get('cpu_alert_level', 'warning'),
-            'memory_threshold': resource_settings.get('memory_threshold', 85),
-            'memory_alert_level': resource_settings.get('memory_alert_level', 'warning'),
-            'storage_threshold': resource_settings.get('storage_threshold', 90),
-            'storage_alert_level': resource_settings.get('storage_alert_level', 'danger'),
-            'show_alerts_dashboard': resource_settings.get('show_alerts_dashboard', True),
-            'show_popup_notifications': resource_settings.get('show_popup_notifications', True),
-            'play_alert_sound': resource_settings.get('play_alert_sound', False)
-        })
+    # Resource threshold settings live with the server-side alert engine
+    resource_settings = alert_engine.get_settings()
+    settings_data.update({
+        'enable_resource_alerts': resource_settings.get('enable_resource_alerts', True),
+        'cpu_threshold': resource_settings.get('cpu_threshold', 80),
+        'cpu_alert_level': resource_settings.get('cpu_alert_level', 'warning'),
+        'memory_threshold': resource_settings.get('memory_threshold', 85),
+        'memory_alert_level': resource_settings.get('memory_alert_level', 'warning'),
+        'storage_threshold': resource_settings.get('storage_threshold', 90),
+        'storage_alert_level': resource_settings.get('storage_alert_level', 'danger'),
+        'show_alerts_dashboard': resource_settings.get('show_alerts_dashboard', True),
+        'show_popup_notifications': resource_settings.get('show_popup_notifications', True),
+        'play_alert_sound': resource_settings.get('play_alert_sound', False)
+    })
     
     return render_template('settings.html', settings=settings_data)
 
@@ -4755,76 +6236,36 @@ def batch_create(host_id, node):
     try:
         connection = proxmox_connections[host_id]['connection']
         
-        # Get available storage pools for this node
-        storages = connection.nodes(node).storage.get()
+        # Get available storage pools and their templates from the shared catalog
+        catalog = get_content_catalog(host_id, node)
+        storages = catalog['storages']
         
         # Get node CPU and memory info for resource allocation
         node_status = connection.nodes(node).status.get()
         
         # Get next available VMID
-        try:
-            next_vmid = connection.cluster.nextid.get()
-        except Exception:
-            # Fallback if cluster API not available
-            vms = connection.nodes(node).qemu.get()
-            containers = connection.nodes(node).lxc.get()
-            existing_ids = [int(vm['vmid']) for vm in vms + containers]
-            next_vmid = max(existing_ids) + 1 if existing_ids else 100
+        next_vmid = vmid_allocator.next_free(host_id)
             
         # Resources for template selection
-        # For VMs: VM templates
-        vm_templates = []
+        # For VMs: VM templates from the inventory's template registry
         vm_storages = [storage for storage in storages if 'images' in storage.get('content', '').split(',')]
-        
-        # Get VMs with template flag set
         try:
-            for vm_storage in vm_storages:
-                storage_id = vm_storage['storage']
-                try:
-                    storage_content = connection.nodes(node).storage(storage_id).content.get()
-                    for item in storage_content:
-                        if item.get('content') == 'images' and item.get('format') == 'qcow2' and item.get('volid', '').endswith('.qcow2'):
-                            # Check if this is a template by looking at the VM config
-                            try:
-                                vm_id = item.get('vmid')
-                                if vm_id:
-                                    vm_config = connection.nodes(node).qemu(vm_id).config.get()
-                                    if vm_config.get('template', 0) == 1:
-                                        template_info = {
-                                            'vmid': vm_id,
-                                            'name': vm_config.get('name', f'vm-{vm_id}'),
-                                            'description': vm_config.get('description', 'No description'),
-                                            'storage': storage_id
-                                        }
-                                        vm_templates.append(template_info)
-                            except Exception as e:
-                                print(f"Error checking VM template status: {str(e)}")
-                except Exception as e:
-                    print(f"Error getting content from storage {storage_id}: {str(e)}")
+            vm_templates = snapshot_templates(inventory.get_snapshot(host_id), 'qemu', node)
         except Exception as e:
+            vm_templates = []
             print(f"Error retrieving VM templates: {str(e)}")
         
         # For Containers: Container templates (vztmpl)
-        container_templates = []
-        template_storages = [storage for storage in storages if 'vztmpl' in storage.get('content', '').split(',')]
-        container_storages = [storage for storage in storages if 'rootdir' in storage.get('content', '').split(',')]
-        
-        # Get container templates
-        for storage in template_storages:
-            try:
-                content = connection.nodes(node).storage(storage['storage']).content.get()
-                template_list = [item for item in content if item.get('content') == 'vztmpl']
-                for tmpl in template_list:
-                    tmpl['storage'] = storage['storage']
-                    # Extract template name without path
-                    template_path = tmpl.get('volid', '').split(':')
-                    if len(template_path) > 1:
-                        tmpl['template_name'] = template_path[1].split('/')[-1]
-                    else:
-                        tmpl['template_name'] = 'Unknown'
-                container_templates.extend(template_list)
-            except Exception as e:
-                print(f"Error getting template list from {storage['storage']}: {str(e)}")
+        container_storages = catalog_storages(catalog, 'rootdir')
+        container_templates = catalog_items(catalog, 'vztmpl')
+        
+        for tmpl in container_templates:
+            # Extract template name without path
+            template_path = tmpl.get('volid', '').split(':')
+            if len(template_path) > 1:
+                tmpl['template_name'] = template_path[1].split('/')[-1]
+            else:
+                tmpl['template_name'] = 'Unknown'
         
         # Get available nodes (for target selection)
         nodes = connection.nodes.get()
@@ -4836,17 +6277,20 @@ def batch_create(host_id, node):
             name_prefix = request.form.get('name_prefix', '')
             id_start = int(request.form.get('id_start', next_vmid))
             target_node = request.form.get('target_node', node)
+            max_parallel = int(request.form.get('max_parallel', 4))
+            if max_parallel < 1:
+                flash("Parallel operations must be at least 1", 'danger')
+                return redirect(url_for('batch_create', host_id=host_id, node=node))
             
             # Common parameters
-            cores = request.form.get('cores', 1)
-            memory = request.form.get('memory', 512)
+            cores = request.form.get('cores')
+            memory = request.form.get('memory')
             storage_name = request.form.get('storage')
             disk_size = request.form.get('disk_size', 8)
+            description = f"Created via batch operation on {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+            shared = storage_collector.shared_storages(host_id)
             
-            # Track successful and failed creations
-            successful = 0
-            failed = 0
-            error_messages = []
+            items = []
             
             if resource_type == 'vm':
                 # VM specific parameters
@@ -4858,52 +6302,64 @@ def batch_create(host_id, node):
                     flash("Template VM ID and storage are required", 'danger')
                     return redirect(url_for('batch_create', host_id=host_id, node=node))
                 
-                # Create VMs in sequence
-                for i in range(count):
-                    current_vmid = id_start + i
-                    current_name = f"{name_prefix}{i+1}" if name_prefix else f"vm-{current_vmid}"
+                # Settings applied once each clone has released its lock
+                config_params = {}
+                if cores:
+                    config_params['cores'] = cores
+                if memory:
+                    config_params['memory'] = memory
+                
+                # Full clones write to the target storage; linked clones add thin volumes next to the template's disks
+                if full_clone:
+                    clone_keys = [storage_limit_key(target_node, storage_name, shared)]
+                else:
+                    template_config = connection.nodes(node).qemu(template_vmid).config.get()
+                    clone_keys = [storage_limit_key(node, storage, shared)
+                                  for storage in guest_disk_storages(template_config, 'qemu')]
+                
+                # Reserve free VMIDs from id_start on, skipping IDs already used or held
+                vmids = vmid_allocator.reserve(host_id, count, start=id_start)
+                
+                for i, current_vmid in enumerate(vmids):
                     
-                    try:
-                        # Clone parameters
-                        params = {
-                            'newid': current_vmid,
-                            'name': current_name,
-                            'full': 1 if full_clone else 0,
-                            'description': f"Created via batch operation on {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                        }
-                        
-                        # Add target storage if specified
-                        if storage_name:
-                            params['storage'] = storage_name
-                            
-                        # Add target node if different from source
-                        if target_node != node:
-                            params['target'] = target_node
-                        
-                        # Clone the VM from template
-                        connection.nodes(node).qemu(template_vmid).clone.post(**params)
-                        
-                        # Update resource settings if needed
-                        if cores != 1 or memory != 512:
-                            # Allow time for clone operation to start
-                            time.sleep(1)
-                            config_params = {}
-                            
-                            if cores != 1:
-                                config_params['cores'] = cores
-                            if memory != 512:
-                                config_params['memory'] = memory
-                                
-                            if config_params:
-                                connection.nodes(target_node).qemu(current_vmid).config.put(**config_params)
-                        
-                        successful += 1
-                    except Exception as e:
-                        failed += 1
-                        error_message = f"VM {current_vmid}: {str(e)}"
-                        error_messages.append(error_message)
-                        print(error_message)
-                        
+                    # Clone parameters
+                    params = {
+                        'newid': current_vmid,
+                        'name': f"{name_prefix}{i+1}" if name_prefix else f"vm-{current_vmid}",
+                        'full': 1 if full_clone else 0,
+                        'description': description
+                    }
+                    
+                    # Target storage only applies to full clones
+                    if full_clone:
+                        params['storage'] = storage_name
+                    
+                    # Add target node if different from source
+                    if target_node != node:
+                        params['target'] = target_node
+                    
+                    items.append({
+                        'label': f"VM {current_vmid} ({params['name']})",
+                        'vmid': current_vmid,
+                        'phase': 'queued',
+                        'params': params,
+                        'keys': clone_keys
+                    })
+                
+                def provision(item):
+                    # Clone the VM from template and wait for the clone task (and its lock) to finish
+                    job.update_item(item, phase='cloning')
+                    item['upid'] = connection.nodes(node).qemu(template_vmid).clone.post(**item['params'])
+                    status = wait_for_task(connection, node, item['upid'], poll_interval=1)
+                    if not task_succeeded(status):
+                        raise Exception(f"Clone failed: {status.get('exitstatus', 'unknown error')}")
+                    
+                    if config_params:
+                        job.update_item(item, phase='configuring')
+                        connection.nodes(target_node).qemu(item['vmid']).config.put(**config_params)
+                    
+                    job.update_item(item, phase='done')
+                
             elif resource_type == 'container':
                 # Container specific parameters
                 template = request.form.get('template')
@@ -4917,60 +6373,68 @@ def batch_create(host_id, node):
                 # Network settings
                 net0 = request.form.get('net0', 'name=eth0,bridge=vmbr0,ip=dhcp')
                 
-                # Create containers in sequence
-                for i in range(count):
-                    current_vmid = id_start + i
-                    current_hostname = f"{name_prefix}{i+1}" if name_prefix else f"ct-{current_vmid}"
+                # Reserve free VMIDs from id_start on, skipping IDs already used or held
+                vmids = vmid_allocator.reserve(host_id, count, start=id_start)
+                
+                for i, current_vmid in enumerate(vmids):
                     
-                    try:
-                        # Build parameters for container creation
-                        params = {
-                            'vmid': current_vmid,
-                            'hostname': current_hostname,
-                            'cores': cores,
-                            'memory': memory,
-                            'net0': net0,
-                            'ostemplate': template,
-                            'password': password,
-                            'description': f"Created via batch operation on {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                        }
-                        
-                        # Add storage parameters
-                        if storage_name and disk_size:
-                            params['rootfs'] = f"{storage_name}:{disk_size}"
-                            
-                        # Create the container
-                        if target_node == node:
-                            connection.nodes(node).lxc.post(**params)
-                        else:
-                            # For different target node
-                            connection.nodes(target_node).lxc.post(**params)
-                            
-                        successful += 1
-                    except Exception as e:
-                        failed += 1
-                        error_message = f"Container {current_vmid}: {str(e)}"
-                        error_messages.append(error_message)
-                        print(error_message)
-            
-            # Show summary message
-            if successful > 0:
-                if failed > 0:
-                    flash(f"Created {successful} resources with {failed} failures. See details below.", 'warning')
-                    for error in error_messages:
-                        flash(error, 'danger')
-                else:
-                    flash(f"Successfully created {successful} resources", 'success')
-            else:
-                flash(f"Failed to create any resources. See details below.", 'danger')
-                for error in error_messages:
-                    flash(error, 'danger')
+                    # Build parameters for container creation
+                    params = {
+                        'vmid': current_vmid,
+                        'hostname': f"{name_prefix}{i+1}" if name_prefix else f"ct-{current_vmid}",
+                        'cores': cores or 1,
+                        'memory': memory or 512,
+                        'net0': net0,
+                        'ostemplate': template,
+                        'password': password,
+                        'description': description
+                    }
                     
-            # Redirect to the node details page
-            if target_node == node:
-                return redirect(url_for('node_details', host_id=host_id, node=node))
+                    # Add storage parameters
+                    if storage_name and disk_size:
+                        params['rootfs'] = f"{storage_name}:{disk_size}"
+                    
+                    items.append({
+                        'label': f"Container {current_vmid} ({params['hostname']})",
+                        'vmid': current_vmid,
+                        'phase': 'queued',
+                        'params': params,
+                        'keys': [storage_limit_key(target_node, storage_name, shared)]
+                    })
+                
+                def provision(item):
+                    # Create the container on the target node and wait for the task
+                    job.update_item(item, phase='creating')
+                    item['upid'] = connection.nodes(target_node).lxc.post(**item['params'])
+                    status = wait_for_task(connection, target_node, item['upid'], poll_interval=1)
+                    if not task_succeeded(status):
+                        raise Exception(f"Create failed: {status.get('exitstatus', 'unknown error')}")
+                    
+                    job.update_item(item, phase='done')
             else:
-                return redirect(url_for('node_details', host_id=host_id, node=target_node))
+                flash("Please select a resource type", 'danger')
+                return redirect(url_for('batch_create', host_id=host_id, node=node))
+            
+            def provision_item(item):
+                try:
+                    provision(item)
+                except Exception:
+                    # Hand the VMID back so later creations can use it
+                    vmid_allocator.release(host_id, [item['vmid']])
+                    raise
+            
+            def finish_provisioning(job):
+                vmid_allocator.release(host_id, [item['vmid'] for item in job.items if item['status'] == 'cancelled'])
+                inventory.invalidate(host_id)
+            
+            job = BulkJob('provision', host_id, items, provision_item, limits={'storage': max_parallel})
+            register_job(job).start(finish=finish_provisioning)
+            
+            app_logger.info(f"Started batch creation job {job.id} for {count} {resource_type}s on host {host_id}")
+            flash(f"Started creating {count} resources. Progress is shown below.", 'info')
+            
+            # Show live progress on the batch creation page
+            return redirect(url_for('batch_create', host_id=host_id, node=node, job=job.id))
             
         # Render the batch creation form
         return render_template('batch_create.html',
@@ -4982,12 +6446,99 @@ def batch_create(host_id, node):
                             container_storages=container_storages,
                             nodes=nodes,
                             node_status=node_status,
-                            next_vmid=next_vmid)
+                            next_vmid=next_vmid,
+                            job_id=request.args.get('job'))
                             
     except Exception as e:
         flash(f"Failed to prepare batch creation: {str(e)}", 'danger')
         return redirect(url_for('node_details', host_id=host_id, node=node))
 
+def batch_config_params(form, resource_type):
+    """Build the config.put parameters selected on the batch configuration form"""
+    config_params = {}
+    
+    # CPU configuration
+    if form.get('update_cpu') == 'on':
+        cores = form.get('cores')
+        if cores and cores.isdigit():
+            config_params['cores'] = int(cores)
+    
+    # Memory configuration
+    if form.get('update_memory') == 'on':
+        memory = form.get('memory')
+        if memory and memory.isdigit():
+            config_params['memory'] = int(memory)
+    
+    # Description update
+    if form.get('update_description') == 'on':
+        description = form.get('description', '')
+        config_params['description'] = description
+    
+    # Network configuration
+    if form.get('update_network') == 'on':
+        net_model = form.get('net_model')
+        net_bridge = form.get('net_bridge')
+        
+        if net_model and net_bridge:
+            if resource_type == 'vm':
+                config_params['net0'] = f"{net_model},bridge={net_bridge}"
+            else:  # container
+                config_params['net0'] = f"name=eth0,bridge={net_bridge}"
+    
+    # CPU type for VMs
+    if resource_type == 'vm' and form.get('update_cpu_type') == 'on':
+        cpu_type = form.get('cpu_type')
+        if cpu_type:
+            config_params['cpu'] = cpu_type
+    
+    # Startup/shutdown configuration
+    if form.get('update_startup') == 'on':
+        startup_order = form.get('order')
+        startup_up = form.get('up')
+        startup_down = form.get('down')
+        
+        if startup_order and startup_order.isdigit():
+            startup_config = []
+            startup_config.append(f"order={startup_order}")
+            
+            if startup_up and startup_up.isdigit():
+                startup_config.append(f"up={startup_up}")
+            
+            if startup_down and startup_down.isdigit():
+                startup_config.append(f"down={startup_down}")
+            
+            config_params['startup'] = ",".join(startup_config)
+    
+    # Custom tags
+    if form.get('update_tags') == 'on':
+        tags = form.get('tags', '')
+        config_params['tags'] = tags
+    
+    return config_params
+
+def parse_resource_ids(resource_ids):
+    """Split 'node:vmid' form values into (node, vmid) pairs, skipping malformed ones"""
+    guests = []
+    for resource_id in resource_ids:
+        parts = resource_id.split(':')
+        if len(parts) == 2:
+            guests.append((parts[0], parts[1]))
+    return guests
+
+def config_diff(current, desired):
+    """Changes needed to bring a guest config to the desired values, as {key: {'old', 'new'}}"""
+    changes = {}
+    for key, value in desired.items():
+        old = current.get(key)
+        if str(old if old is not None else '') != str(value):
+            changes[key] = {'old': old, 'new': value}
+    return changes
+
+def guest_config_resource(connection, resource_type, node, vmid):
+    if resource_type == 'vm':
+        return connection.nodes(node).qemu(vmid).config
+    return connection.nodes(node).lxc(vmid).config
+
 @app.route('/host/<host_id>/<node>/batch_config', methods=['GET', 'POST'])
 def batch_config(host_id, node):
     """
@@ -5000,142 +6551,63 @@ def batch_config(host_id, node):
     try:
         connection = proxmox_connections[host_id]['connection']
         
-        # Get all nodes for this host
-        nodes = connection.nodes.get()
-        
-        # Get all VMs across all nodes
-        vms = []
-        for node_obj in nodes:
-            node_name = node_obj['node']
-            try:
-                node_vms = connection.nodes(node_name).qemu.get()
-                for vm in node_vms:
-                    vm['node'] = node_name
-                vms.extend(node_vms)
-            except Exception as e:
-                print(f"Error getting VMs from node {node_name}: {str(e)}")
-        
-        # Get all containers across all nodes
-        containers = []
-        for node_obj in nodes:
-            node_name = node_obj['node']
-            try:
-                node_containers = connection.nodes(node_name).lxc.get()
-                for container in node_containers:
-                    container['node'] = node_name
-                containers.extend(container)
-            except Exception as e:
-                print(f"Error getting containers from node {node_name}: {str(e)}")
-        
         if request.method == 'POST':
             resource_type = request.form.get('resource_type')
-            resource_ids = request.form.getlist('resource_ids')
+            guests = parse_resource_ids(request.form.getlist('resource_ids'))
             
-            if not resource_type or not resource_ids:
+            if not resource_type or not guests:
                 flash("Resource type and at least one resource must be selected", 'danger')
                 return redirect(url_for('batch_config', host_id=host_id, node=node))
             
             # Common configuration parameters
-            config_params = {}
-            
-            # CPU configuration
-            if request.form.get('update_cpu') == 'on':
-                cores = request.form.get('cores')
-                if cores and cores.isdigit():
-                    config_params['cores'] = int(cores)
-            
-            # Memory configuration
-            if request.form.get('update_memory') == 'on':
-                memory = request.form.get('memory')
-                if memory and memory.isdigit():
-                    config_params['memory'] = int(memory)
+            config_params = batch_config_params(request.form, resource_type)
+            if not config_params:
+                flash("No configuration changes selected", 'warning')
+                return redirect(url_for('batch_config', host_id=host_id, node=node))
             
-            # Description update
-            if request.form.get('update_description') == 'on':
-                description = request.form.get('description', '')
-                config_params['description'] = description
+            try:
+                max_per_node = int(request.form.get('max_per_node', 4))
+            except ValueError:
+                max_per_node = 4
+            if max_per_node < 1:
+                flash("Parallel updates per node must be at least 1", 'danger')
+                return redirect(url_for('batch_config', host_id=host_id, node=node))
+
+            items = [{
+                'label': f"{'VM' if resource_type == 'vm' else 'Container'} {vmid} on {resource_node}",
+                'node': resource_node,
+                'vmid': vmid,
+                'phase': 'queued',
+                'keys': [('node', resource_node)]
+            } for resource_node, vmid in guests]
             
-            # Network configuration
-            if request.form.get('update_network') == 'on':
-                net_model = request.form.get('net_model')
-                net_bridge = request.form.get('net_bridge')
+            def apply_config(item):
+                # Only send the keys that actually differ from the current config
+                config = guest_config_resource(connection, resource_type, item['node'], item['vmid'])
+                job.update_item(item, phase='comparing')
+                changes = config_diff(config.get(), config_params)
                 
-                if net_model and net_bridge:
-                    if resource_type == 'vm':
-                        config_params['net0'] = f"{net_model},bridge={net_bridge}"
-                    else:  # container
-                        config_params['net0'] = f"name=eth0,bridge={net_bridge}"
-            
-            # CPU type for VMs
-            if resource_type == 'vm' and request.form.get('update_cpu_type') == 'on':
-                cpu_type = request.form.get('cpu_type')
-                if cpu_type:
-                    config_params['cpu'] = cpu_type
-            
-            # Startup/shutdown configuration
-            if request.form.get('update_startup') == 'on':
-                startup_order = request.form.get('order')
-                startup_up = request.form.get('up')
-                startup_down = request.form.get('down')
+                if not changes:
+                    job.update_item(item, phase='unchanged', changes={})
+                    return
                 
-                if startup_order and startup_order.isdigit():
-                    startup_config = []
-                    startup_config.append(f"order={startup_order}")
-                    
-                    if startup_up and startup_up.isdigit():
-                        startup_config.append(f"up={startup_up}")
-                    
-                    if startup_down and startup_down.isdigit():
-                        startup_config.append(f"down={startup_down}")
-                    
-                    config_params['startup'] = ",".join(startup_config)
-            
-            # Custom tags
-            if request.form.get('update_tags') == 'on':
-                tags = request.form.get('tags', '')
-                config_params['tags'] = tags
-            
-            # Track successful and failed updates
-            successful = 0
-            failed = 0
-            errors = []
+                job.update_item(item, phase='applying', changes=changes)
+                config.put(**{key: change['new'] for key, change in changes.items()})
+                job.update_item(item, phase='applied')
             
-            # Apply configuration changes to all selected resources
-            for resource_id in resource_ids:
-                parts = resource_id.split(':')
-                if len(parts) != 2:
-                    continue
-                
-                resource_node, vmid = parts
-                
-                try:
-                    if resource_type == 'vm':
-                        connection.nodes(resource_node).qemu(vmid).config.put(**config_params)
-                    else:  # container
-                        connection.nodes(resource_node).lxc(vmid).config.put(**config_params)
-                    
-                    successful += 1
-                except Exception as e:
-                    failed += 1
-                    error_message = f"Resource {vmid} on node {resource_node}: {str(e)}"
-                    errors.append(error_message)
-                    print(error_message)
+            job = BulkJob('config', host_id, items, apply_config, limits={'node': max_per_node})
+            register_job(job).start(finish=lambda job: inventory.invalidate(host_id))
             
-            # Show summary message
-            if successful > 0:
-                if failed > 0:
-                    flash(f"Updated configuration for {successful} resources with {failed} failures. See details below.", 'warning')
-                    for error in errors:
-                        flash(error, 'danger')
-                else:
-                    flash(f"Successfully updated configuration for {successful} resources", 'success')
-            else:
-                flash(f"Failed to update any resources. See details below.", 'danger')
-                for error in errors:
-                    flash(error, 'danger')
+            app_logger.info(f"Started batch configuration job {job.id} for {len(items)} resources on host {host_id}")
+            flash(f"Applying configuration to {len(items)} resources. Results are shown below.", 'info')
             
-            # Redirect to the node details page
-            return redirect(url_for('node_details', host_id=host_id, node=node))
+            return redirect(url_for('batch_config', host_id=host_id, node=node, job=job.id))
+        
+        # All guests across the cluster come from one inventory call
+        snapshot = inventory.get_snapshot(host_id)
+        vms = [dict(vm, cpus=vm.get('maxcpu')) for vm in snapshot_guests(snapshot, 'qemu')]
+        containers = [dict(ct, cpus=ct.get('maxcpu')) for ct in snapshot_guests(snapshot, 'lxc')]
+        nodes = snapshot['nodes']
         
         # GET request - render form
         return render_template('batch_config.html',
@@ -5143,12 +6615,54 @@ def batch_config(host_id, node):
                               node=node,
                               vms=vms,
                               containers=containers,
-                              nodes=nodes)
+                              nodes=nodes,
+                              job_id=request.args.get('job'))
     
     except Exception as e:
         flash(f"Failed to prepare batch configuration: {str(e)}", 'danger')
         return redirect(url_for('node_details', host_id=host_id, node=node))
 
+@app.route('/api/host/<host_id>/batch_config/preview', methods=['POST'])
+def batch_config_preview(host_id):
+    """Dry run: diff the requested changes against every selected guest's current config"""
+    if host_id not in proxmox_connections:
+        return jsonify({'success': False, 'error': 'Host not found'})
+    
+    resource_type = request.form.get('resource_type')
+    guests = parse_resource_ids(request.form.getlist('resource_ids'))
+    
+    if resource_type not in ('vm', 'container') or not guests:
+        return jsonify({'success': False, 'error': 'Resource type and at least one resource must be selected'})
+    
+    config_params = batch_config_params(request.form, resource_type)
+    if not config_params:
+        return jsonify({'success': False, 'error': 'No configuration changes selected'})
+    
+    connection = proxmox_connections[host_id]['connection']
+    
+    # Current configs are fetched in parallel
+    results = parallel_map(
+        lambda guest: guest_config_resource(connection, resource_type, *guest).get(), guests)
+    
+    preview = []
+    for (resource_node, vmid), config, error in results:
+        entry = {'node': resource_node, 'vmid': vmid, 'name': None, 'changes': {}, 'error': None}
+        if error:
+            entry['error'] = str(error)
+        else:
+            entry['name'] = config.get('name') or config.get('hostname')
+            entry['changes'] = config_diff(config, config_params)
+        preview.append(entry)
+    
+    return jsonify({
+        'success': True,
+        'params': config_params,
+        'guests': preview,
+        'changed': sum(1 for entry in preview if entry['changes']),
+        'unchanged': sum(1 for entry in preview if not entry['changes'] and not entry['error']),
+        'errors': sum(1 for entry in preview if entry['error'])
+    })
+
 @app.route('/api/settings/resource_thresholds', methods=['GET', 'POST'])
 def save_resource_thresholds():
     """
@@ -5168,30 +6682,43 @@ def save_resource_thresholds():
             'play_alert_sound': request.form.get('play_alert_sound') == 'true'
         }
         
-        # In a production environment, these settings would typically be saved to a database
-        # For now, we'll use Flask's session to persist between requests
-        session['resource_thresholds'] = settings
+        # Thresholds are evaluated server-side, so they are stored with the alert engine
+        alert_engine.update_settings(settings)
         
         return jsonify({'success': True})
     else:
         # Handle GET request - return current settings
-        if 'resource_thresholds' in session:
-            return jsonify({'success': True, 'settings': session['resource_thresholds']})
-        else:
-            # Return default settings if none are saved
-            default_settings = {
-                'enable_resource_alerts': True,
-                'cpu_threshold': 80,
-                'cpu_alert_level': 'warning',
-                'memory_threshold': 85,
-                'memory_alert_level': 'warning',
-                'storage_threshold': 90,
-                'storage_alert_level': 'danger',
-                'show_alerts_dashboard': True,
-                'show_popup_notifications': True,
-                'play_alert_sound': False
-            }
-            return jsonify({'success': True, 'settings': default_settings})
+        return jsonify({'success': True, 'settings': alert_engine.get_settings()})
+
+@app.route('/api/alerts')
+def api_alerts():
+    """Active resource alerts and recent alert history, optionally for one host"""
+    host_id = request.args.get('host_id')
+    
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        limit = 100
+    
+    return jsonify({
+        'success': True,
+        'active': alert_engine.active_alerts(host_id),
+        'history': alert_engine.alert_history(host_id, limit)
+    })
+
+@app.route('/api/alerts/notifications', methods=['GET'])
+def alert_notification_status():
+    """Configured alert sinks with their delivery queues and counters"""
+    return jsonify({'success': True, 'status': alert_dispatcher.status()})
+
+@app.route('/api/alerts/notifications/test', methods=['POST'])
+def test_alert_notifications():
+    """Queue a test digest for every configured sink"""
+    if not alert_dispatcher.sinks:
+        return jsonify({'success': False, 'error': 'No notification sinks configured'})
+    
+    alert_dispatcher.send_test()
+    return jsonify({'success': True, 'status': alert_dispatcher.status()})
 
 # Maintenance Mode & Scheduling routes and functionality
 @app.route('/node/<host_id>/<node>/maintenance', methods=['GET', 'POST'])
@@ -5572,15 +7099,75 @@ def check_scheduled_maintenance():
             except Exception:
                 continue
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Fleet and application metrics in the Prometheus text format"""
+    lines = inventory_exporter.render()
+
+    lines.extend([
+        '# HELP proxima_inventory_requests_total Inventory snapshot reads served from cache (hit) or fetched (miss)',
+        '# TYPE proxima_inventory_requests_total counter',
+        f'proxima_inventory_requests_total{{result="hit"}} {inventory.stats["hits"]}',
+        f'proxima_inventory_requests_total{{result="miss"}} {inventory.stats["misses"]}'
+    ])
+    lines.extend(metrics.render())
+    lines.append('')
+    
+    return Response('\n'.join(lines), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/profiler')
+def profiler_report():
+    """Slowest routes, the upstream calls behind them and captured profiles"""
+    return render_template('profiler.html', report=profiler.report(), now=time.time(),
+                          allow_capture=PROFILER_ALLOW_CAPTURE)
+
+@app.route('/profiler/reset', methods=['POST'])
+def profiler_reset():
+    profiler.reset()
+    flash("Profiler statistics reset", 'success')
+    return redirect(url_for('profiler_report'))
+
+@app.route('/profiler/profiles/<profile_id>')
+def profiler_profile(profile_id):
+    """Text report of a captured request profile"""
+    trace = profiler.get_profile(profile_id)
+    if trace is None:
+        flash("Profile not found", 'danger')
+        return redirect(url_for('profiler_report'))
+    
+    header = f"{trace['method']} {trace['path']} ({trace['endpoint']}) took {trace['duration'] * 1000:.1f} ms\n\n"
+    return Response(header + trace['profile'], mimetype='text/plain')
+
 # Register background task with Flask
 @app.before_request
 def before_request():
+    # ?profile=1 (cProfile) or ?profile=pyinstrument captures a profile of this request
+    g.trace = profiler.begin(request.endpoint, request.method, request.path, capture=request.args.get('profile'))
+    
     # Check for scheduled maintenance
     check_scheduled_maintenance()
 
+@app.after_request
+def record_request_metrics(response):
+    trace = g.get('trace')
+    if trace is not None:
+        profile_id = profiler.finish(trace, response.status_code)
+        metrics.observe('proxima_http_request_duration_seconds', trace['duration'],
+                        endpoint=trace['endpoint'], method=request.method, status=response.status_code)
+        if profile_id:
+            response.headers['X-Profile-Id'] = profile_id
+    return response
+
 # Register imported routes from app_utils
 register_all_routes(app, proxmox_connections, cache, cache_lock)
 
+# Keep the inventory snapshots fresh in the background
+if os.getenv('ENABLE_INVENTORY_POLLER', 'True').lower() == 'true':
+    inventory.start()
+
+# Deliver alert digests in the background (no-op when no sinks are configured)
+alert_dispatcher.start()
+
 # Configure scheduled task for maintenance checks
 if os.getenv('ENABLE_SCHEDULED_MAINTENANCE_CHECKS', 'True').lower() == 'true':
     def check_maintenance():
@@ -5588,7 +7175,12 @@ if os.getenv('ENABLE_SCHEDULED_MAINTENANCE_CHECKS', 'True').lower() == 'true':
         
     # Run maintenance check every 5 minutes
     schedule.every(5).minutes.do(check_maintenance)
-    
+
+# Look for due snapshot policies
+if os.getenv('ENABLE_SNAPSHOT_SCHEDULES', 'True').lower() == 'true':
+    schedule.every(SNAPSHOT_SCHEDULE_CHECK_INTERVAL).seconds.do(snapshot_scheduler.run_once)
+
+if schedule.get_jobs():
     # Start scheduler in a background thread
     def run_scheduler():
         while True:
@@ -0,0 +1,923 @@
+import os
+import time
+import socket
+import bisect
+import ipaddress
+import threading
+import logging
+from collections import Counter
+from urllib.parse import quote, urlparse, unquote
+
+from task_utils import fetch_calls, RateLimiter
+from inventory_utils import snapshot_guests
+from snapshot_utils import guest_api
+
+app_logger = logging.getLogger('proxima-ui')
+
+# Concurrent firewall API calls while collecting a host
+FIREWALL_FETCH_WORKERS = int(os.getenv('FIREWALL_FETCH_WORKERS', 16))
+
+# A collected firewall snapshot older than this is refreshed when read (seconds)
+FIREWALL_SNAPSHOT_MAX_AGE = int(os.getenv('FIREWALL_SNAPSHOT_MAX_AGE', 120))
+
+# Guests changed concurrently by a bulk rule deployment, overall and per node
+FIREWALL_DEPLOY_WORKERS = int(os.getenv('FIREWALL_DEPLOY_WORKERS', 8))
+FIREWALL_DEPLOY_MAX_PER_NODE = int(os.getenv('FIREWALL_DEPLOY_MAX_PER_NODE', 4))
+
+# Firewall write calls per second during a bulk rule deployment or rollback (0 disables the limit)
+FIREWALL_DEPLOY_RATE = float(os.getenv('FIREWALL_DEPLOY_RATE', 20))
+
+# Directory IP set lists may be read from by path; empty disables reading local files
+IPSET_SYNC_DIR = os.getenv('IPSET_SYNC_DIR', '')
+
+# Concurrent batches and entries per batch when synchronizing an IP set
+IPSET_SYNC_WORKERS = int(os.getenv('IPSET_SYNC_WORKERS', 8))
+IPSET_SYNC_BATCH = int(os.getenv('IPSET_SYNC_BATCH', 50))
+
+# Rule fields that identify a rule regardless of its position
+FIREWALL_RULE_FIELDS = ('type', 'action', 'macro', 'proto', 'source', 'dest', 'dport', 'sport',
+                        'icmp-type', 'iface', 'log', 'enable', 'comment')
+
+# Services of the common Proxmox firewall macros: name -> [(proto, dport)]
+FIREWALL_MACROS = {
+    'SSH': [('tcp', '22')],
+    'Telnet': [('tcp', '23')],
+    'FTP': [('tcp', '21')],
+    'SMTP': [('tcp', '25')],
+    'SMTPS': [('tcp', '465')],
+    'Submission': [('tcp', '587')],
+    'DNS': [('tcp', '53'), ('udp', '53')],
+    'HTTP': [('tcp', '80')],
+    'HTTPS': [('tcp', '443')],
+    'Web': [('tcp', '80'), ('tcp', '443')],
+    'POP3': [('tcp', '110')],
+    'POP3S': [('tcp', '995')],
+    'IMAP': [('tcp', '143')],
+    'IMAPS': [('tcp', '993')],
+    'NTP': [('udp', '123')],
+    'SNMP': [('udp', '161:162'), ('tcp', '161')],
+    'LDAP': [('tcp', '389')],
+    'LDAPS': [('tcp', '636')],
+    'SMB': [('tcp', '139'), ('tcp', '445'), ('udp', '137:138')],
+    'NFS': [('tcp', '2049'), ('udp', '2049')],
+    'MySQL': [('tcp', '3306')],
+    'PostgreSQL': [('tcp', '5432')],
+    'RDP': [('tcp', '3389')],
+    'VNC': [('tcp', '5900:5999')],
+    'Ceph': [('tcp', '3300'), ('tcp', '6789'), ('tcp', '6800:7300')],
+    'Ping': [('icmp', None)],
+}
+
+
+def port_ranges(spec, unresolved=None):
+    """A port spec ('22', '80:90', '22,443', 'ssh') as [(low, high)]; None means any port
+
+    Service names that do not resolve are left out and appended to unresolved, so
+    a spec of only unknown names is an empty list that matches no port.
+    """
+    if spec in (None, ''):
+        return None
+    ranges = []
+    for part in str(spec).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        bounds = []
+        for bound in part.split(':', 1):
+            if bound.isdigit():
+                bounds.append(int(bound))
+            else:
+                try:
+                    bounds.append(socket.getservbyname(bound))
+                except OSError:
+                    app_logger.debug(f"Unknown service name in port spec: {bound}")
+                    if unresolved is not None:
+                        unresolved.append(bound)
+                    bounds = None
+                    break
+        if bounds:
+            ranges.append((bounds[0], bounds[-1]))
+    return ranges
+
+
+def rule_services(rule):
+    """((proto, port ranges) pairs, unresolved names) of a rule, with macros expanded; None means any
+
+    A macro missing from FIREWALL_MACROS could be any service, so it is one
+    any-protocol service matching no port and is reported as unresolved.
+    """
+    unresolved = []
+    if rule.get('macro'):
+        macro = FIREWALL_MACROS.get(rule['macro'])
+        if macro is None:
+            return [(None, [])], [rule['macro']]
+        return [(proto, port_ranges(dport, unresolved)) for proto, dport in macro], unresolved
+    return [(rule.get('proto') or None, port_ranges(rule.get('dport'), unresolved))], unresolved
+
+
+def ports_match(ranges, port):
+    return ranges is None or any(low <= port <= high for low, high in ranges)
+
+
+def rule_enabled(rule):
+    return rule.get('enable') in (1, '1', True)
+
+
+def firewall_rule_key(rule):
+    """Position independent identity of a rule, comparable between what is posted and what is read back"""
+    return tuple('1' if field == 'enable' and rule.get(field) in (1, '1', True) else
+                 '0' if field == 'enable' else str(rule.get(field) or '')
+                 for field in FIREWALL_RULE_FIELDS)
+
+
+def deployable_rule(rule):
+    """Validated POST parameters of a rule to deploy; raises ValueError"""
+    if rule.get('type') not in ('in', 'out', 'group'):
+        raise ValueError("Rule type must be in, out or group")
+    if not rule.get('action'):
+        raise ValueError("Rule action is required")
+    params = {field: rule[field] for field in FIREWALL_RULE_FIELDS if rule.get(field) not in (None, '')}
+    params['enable'] = 1 if rule.get('enable', 1) in (1, '1', True, 'on', 'true') else 0
+    if params.get('proto') == 'all':
+        del params['proto']
+    if 'dport' in params or 'sport' in params:
+        if params.get('proto') not in ('tcp', 'udp') and not params.get('macro'):
+            raise ValueError("Ports need the tcp or udp protocol")
+    return params
+
+
+def missing_rules(current, rules):
+    """Rules not yet present among current ones, counting duplicates"""
+    present = Counter(firewall_rule_key(rule) for rule in current)
+    missing = []
+    for rule in rules:
+        key = firewall_rule_key(rule)
+        if present[key] > 0:
+            present[key] -= 1
+        else:
+            missing.append(rule)
+    return missing
+
+
+def added_positions(before, after, at_top):
+    """Positions in after of the rules that were not in before, picked from the deployment side"""
+    extra = Counter(firewall_rule_key(rule) for rule in after) - Counter(firewall_rule_key(rule) for rule in before)
+    positions = []
+    for rule in (after if at_top else reversed(after)):
+        key = firewall_rule_key(rule)
+        if extra[key] > 0:
+            extra[key] -= 1
+            positions.append(int(rule['pos']))
+    return sorted(positions)
+
+
+def apply_rules(rules_api, before, rules, at_top=True, limiter=None, progress=None):
+    """Post the rules missing from a guest's current (before) rules and verify them by reading back
+
+    New rules land at the top in the given order, or after the existing ones.
+    Returns the number of rules posted; raises when a post fails or the read-back
+    does not show exactly the posted rules in place.
+    """
+    missing = missing_rules(before, rules)
+    posted = []
+    # Proxmox inserts rules without a position at the top, so those go in reverse
+    for offset, rule in enumerate(reversed(missing) if at_top else missing):
+        params = dict(rule) if at_top else dict(rule, pos=len(before) + offset)
+        if limiter:
+            limiter.wait()
+        rules_api.post(**params)
+        posted.append(rule)
+        if progress:
+            progress(len(posted), len(missing))
+
+    if posted:
+        after = rules_api.get()
+        expected = sorted(firewall_rule_key(rule) for rule in posted)
+        if sorted(firewall_rule_key(after[pos]) for pos in added_positions(before, after, at_top)) != expected:
+            raise Exception("Read-back does not show the deployed rules")
+        placed = after[:len(posted)] if at_top else after[len(after) - len(posted):]
+        if [firewall_rule_key(rule) for rule in placed] != [firewall_rule_key(rule) for rule in missing]:
+            raise Exception("Read-back shows the deployed rules out of order")
+    return len(posted)
+
+
+def revert_rules(rules_api, before, at_top=True, limiter=None):
+    """Delete the rules added since before; returns how many were removed"""
+    positions = added_positions(before, rules_api.get(), at_top)
+    # Deleting from the bottom up keeps the remaining positions valid
+    for pos in reversed(positions):
+        if limiter:
+            limiter.wait()
+        rules_api(pos).delete()
+    if Counter(firewall_rule_key(rule) for rule in rules_api.get()) != \
+            Counter(firewall_rule_key(rule) for rule in before):
+        raise Exception("Rules still differ from before the deployment")
+    return len(positions)
+
+
+def parse_cidr_list(text):
+    """Networks of a blocklist style text (one or more addresses per line, # and ; comments) and invalid tokens"""
+    networks, invalid = [], []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].split(';', 1)[0]
+        for token in line.replace(',', ' ').split():
+            try:
+                networks.append(ipaddress.ip_network(token, strict=False))
+            except ValueError:
+                invalid.append(token)
+    return networks, invalid
+
+
+def aggregate_networks(networks):
+    """The smallest set of networks covering the same addresses, IPv4 first"""
+    return (list(ipaddress.collapse_addresses(n for n in networks if n.version == 4)) +
+            list(ipaddress.collapse_addresses(n for n in networks if n.version == 6)))
+
+
+def read_local_list(location):
+    """Contents of a list file given as a path or file:// URL inside IPSET_SYNC_DIR"""
+    if not IPSET_SYNC_DIR:
+        raise ValueError("Reading lists from local files is disabled (set IPSET_SYNC_DIR)")
+    if location.startswith('file:'):
+        location = unquote(urlparse(location).path)
+    root = os.path.realpath(IPSET_SYNC_DIR)
+    path = os.path.realpath(os.path.join(root, location))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"{location} is outside {IPSET_SYNC_DIR}")
+    with open(path, encoding='utf-8', errors='replace') as handle:
+        return handle.read()
+
+
+def ipset_diff(entries, networks):
+    """Entries to add and remove so an IP set holds exactly the aggregated networks
+
+    nomatch entries and entries that are not addresses (aliases) are left alone.
+    Returns {'add', 'remove', 'unchanged', 'kept', 'desired'}; removals are the
+    entries' original cidr strings.
+    """
+    desired = {str(network) for network in aggregate_networks(networks)}
+    current, kept = {}, 0
+    remove = []
+    for entry in entries:
+        try:
+            if entry.get('nomatch') in (1, '1', True):
+                raise ValueError('nomatch')
+            key = str(ipaddress.ip_network(entry['cidr'], strict=False))
+        except ValueError:
+            kept += 1
+            continue
+        if key in current:
+            remove.append(entry['cidr'])
+        else:
+            current[key] = entry['cidr']
+
+    remove.extend(current[key] for key in current.keys() - desired)
+    return {
+        'add': sorted(desired - current.keys(), key=lambda cidr: (ipaddress.ip_network(cidr).version, ipaddress.ip_network(cidr))),
+        'remove': remove,
+        'unchanged': len(desired & current.keys()),
+        'kept': kept,
+        'desired': len(desired)
+    }
+
+
+def ipset_entry_api(ipset_api, cidr):
+    # proxmoxer splits resource ids on '/', so the prefix length is encoded
+    return ipset_api(quote(cidr, safe=''))
+
+
+def firewall_rule_rows(data):
+    """Every rule of a firewall snapshot as one flat row, with security group references expanded"""
+    rows = []
+
+    def add_rules(rules, scope, scope_id, firewall_enabled, **fields):
+        for rule in rules:
+            if rule.get('type') == 'group':
+                # A group reference applies the group's rules in its place; a disabled reference applies none
+                group = data['groups'].get(rule.get('action'), {'rules': []})
+                for group_rule in group['rules']:
+                    services, unresolved = rule_services(group_rule)
+                    rows.append(dict(group_rule, scope=scope, scope_id=scope_id, firewall_enabled=firewall_enabled,
+                                     enabled=rule_enabled(rule) and rule_enabled(group_rule), services=services,
+                                     unresolved_services=unresolved, via_group=rule.get('action'),
+                                     ref_pos=rule.get('pos'), **fields))
+            else:
+                services, unresolved = rule_services(rule)
+                rows.append(dict(rule, scope=scope, scope_id=scope_id, firewall_enabled=firewall_enabled,
+                                 enabled=rule_enabled(rule), services=services, unresolved_services=unresolved,
+                                 **fields))
+
+    cluster_enabled = data['cluster']['options'].get('enable') in (1, '1', True)
+    add_rules(data['cluster']['rules'], 'cluster', 'cluster', cluster_enabled)
+    for name, group in data['groups'].items():
+        add_rules(group['rules'], 'group', name, cluster_enabled, group=name)
+    for node, node_data in data['nodes'].items():
+        node_enabled = cluster_enabled and node_data['options'].get('enable', 1) in (1, '1', True)
+        add_rules(node_data['rules'], 'node', node, node_enabled, node=node)
+    for vmid, guest in data['guests'].items():
+        guest_enabled = cluster_enabled and guest['options'].get('enable') in (1, '1', True)
+        add_rules(guest['rules'], 'guest', str(vmid), guest_enabled, vmid=vmid, node=guest['node'],
+                  guest_type=guest['type'], guest_name=guest['name'])
+    return rows
+
+
+def search_rules(rows, direction=None, action=None, proto=None, port=None, scope=None, vmid=None,
+                 node=None, text=None, enabled_only=False):
+    """Rule rows matching every given filter; port and proto match rules known to cover them"""
+    text = text.lower() if text else None
+    matches = []
+    for row in rows:
+        if direction and row.get('type') != direction:
+            continue
+        if action and (row.get('action') or '').upper() != action.upper():
+            continue
+        if scope and row['scope'] != scope:
+            continue
+        if vmid is not None and str(row.get('vmid')) != str(vmid):
+            continue
+        if node and row.get('node') != node:
+            continue
+        if enabled_only and not (row['enabled'] and row['firewall_enabled']):
+            continue
+        if proto or port is not None:
+            # An unknown macro could be any service, so it is not shown as covering one
+            if row.get('macro') and row['macro'] in row['unresolved_services']:
+                continue
+            if not any((not proto or service_proto in (None, proto)) and
+                       (port is None or (service_proto in (None, 'tcp', 'udp') and ports_match(ranges, port)))
+                       for service_proto, ranges in row['services']):
+                continue
+        if text and not any(text in str(row.get(field) or '').lower()
+                            for field in ('comment', 'source', 'dest', 'macro', 'guest_name', 'group', 'via_group')):
+            continue
+        matches.append(row)
+    return matches
+
+
+def merge_ranges(ranges):
+    """Sorted port ranges with overlapping and adjacent ranges merged"""
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def exclude_networks(networks, excluded):
+    """Networks with every excluded network cut out of them"""
+    result = []
+    for network in networks:
+        pieces = [network]
+        for exclude in excluded:
+            remaining = []
+            for piece in pieces:
+                if piece.version != exclude.version or not piece.overlaps(exclude):
+                    remaining.append(piece)
+                elif not piece.subnet_of(exclude):
+                    remaining.extend(piece.address_exclude(exclude))
+            pieces = remaining
+        result.extend(pieces)
+    return result
+
+
+class AddressResolver:
+    """Resolves firewall address specs of one scope to networks.
+
+    A spec is a comma separated list of addresses, networks, address ranges,
+    alias names and IP set references (+name). Guest scopes look names up in the
+    guest's own aliases and IP sets before the cluster's, as Proxmox does; the
+    dc/ and guest/ prefixes pick one explicitly. IP set nomatch entries are cut
+    out of the set's networks.
+    """
+
+    def __init__(self, data, vmid=None):
+        guest = data['guests'].get(vmid, {}) if vmid is not None else {}
+        self.aliases = {
+            'dc': {alias['name'].lower(): alias['cidr'] for alias in data['cluster'].get('aliases', [])},
+            'guest': {alias['name'].lower(): alias['cidr'] for alias in guest.get('aliases', [])}
+        }
+        self.ipsets = {
+            'dc': {name.lower(): ipset['entries'] for name, ipset in data['ipsets'].items()},
+            'guest': {name.lower(): entries for name, entries in guest.get('ipsets', {}).items()}
+        }
+
+    def _lookup(self, table, name):
+        scope, _, short = name.lower().rpartition('/')
+        for candidate in ([scope] if scope else ['guest', 'dc']):
+            if short in table.get(candidate, {}):
+                return table[candidate][short]
+        return None
+
+    def _address(self, item, unresolved, depth):
+        if '-' in item and not item.startswith('+'):
+            first, last = item.split('-', 1)
+            try:
+                return list(ipaddress.summarize_address_range(ipaddress.ip_address(first.strip()),
+                                                              ipaddress.ip_address(last.strip())))
+            except (ValueError, TypeError):
+                unresolved.append(item)
+                return []
+        try:
+            return [ipaddress.ip_network(item, strict=False)]
+        except ValueError:
+            pass
+
+        if depth < 4:
+            if item.startswith('+'):
+                entries = self._lookup(self.ipsets, item[1:])
+                if entries is not None:
+                    included, excluded = [], []
+                    for entry in entries:
+                        target = excluded if entry.get('nomatch') in (1, '1', True) else included
+                        target.extend(self._address(entry['cidr'], unresolved, depth + 1))
+                    return exclude_networks(list(ipaddress.collapse_addresses([n for n in included if n.version == 4])) +
+                                            list(ipaddress.collapse_addresses([n for n in included if n.version == 6])),
+                                            excluded)
+            else:
+                cidr = self._lookup(self.aliases, item)
+                if cidr is not None:
+                    return self._address(cidr, unresolved, depth + 1)
+        unresolved.append(item)
+        return []
+
+    def networks(self, spec):
+        """(networks, unresolved names) of an address spec; networks is None for any address"""
+        if not spec:
+            return None, []
+        networks, unresolved = [], []
+        for item in str(spec).split(','):
+            if item.strip():
+                networks.extend(self._address(item.strip(), unresolved, 0))
+        return networks, unresolved
+
+
+class PortIntervalIndex:
+    """Stabbing index over port ranges: which entries cover a given port.
+
+    The ranges are cut into elementary intervals at their boundaries, each holding
+    the bit mask of the entries covering it, so a lookup is one binary search.
+    Entries without port restriction live in a separate mask.
+    """
+
+    def __init__(self):
+        self.any_mask = 0
+        self.events = {}
+        self.starts = []
+        self.masks = []
+
+    def add(self, bit, ranges):
+        if ranges is None:
+            self.any_mask |= bit
+            return
+        for low, high in merge_ranges(ranges):
+            self.events.setdefault(low, [0, 0])[0] |= bit
+            self.events.setdefault(high + 1, [0, 0])[1] |= bit
+
+    def build(self):
+        mask = 0
+        for point in sorted(self.events):
+            added, removed = self.events[point]
+            mask = (mask & ~removed) | added
+            self.starts.append(point)
+            self.masks.append(mask)
+
+    def stab(self, port):
+        index = bisect.bisect_right(self.starts, port) - 1
+        return self.any_mask | (self.masks[index] if index >= 0 else 0)
+
+
+class PrefixTrie:
+    """Binary trie of IPv4 and IPv6 prefixes holding entry bit masks.
+
+    Looking up an address walks at most 32 or 128 levels and collects the masks of
+    every prefix containing it. Entries without address restriction live in a
+    separate mask.
+    """
+
+    def __init__(self):
+        self.any_mask = 0
+        self.roots = {4: [None, None, 0], 6: [None, None, 0]}
+
+    def add(self, bit, networks):
+        if networks is None:
+            self.any_mask |= bit
+            return
+        for network in networks:
+            node = self.roots[network.version]
+            value, width = int(network.network_address), network.max_prefixlen
+            for depth in range(network.prefixlen):
+                branch = (value >> (width - 1 - depth)) & 1
+                if node[branch] is None:
+                    node[branch] = [None, None, 0]
+                node = node[branch]
+            node[2] |= bit
+
+    def match(self, address):
+        """Mask of the entries matching an address; every entry when the address is None"""
+        if address is None:
+            return -1
+        address = ipaddress.ip_address(address)
+        node = self.roots[address.version]
+        value, width = int(address), address.max_prefixlen
+        mask = self.any_mask | node[2]
+        for depth in range(width):
+            node = node[(value >> (width - 1 - depth)) & 1]
+            if node is None:
+                break
+            mask |= node[2]
+        return mask
+
+
+def rule_summary(row):
+    return {key: row.get(key) for key in ('scope', 'scope_id', 'pos', 'via_group', 'ref_pos', 'type', 'action',
+                                          'macro', 'proto', 'dport', 'source', 'dest', 'comment')}
+
+
+class FirewallPolicy:
+    """Effective firewall policy of a host compiled from a firewall snapshot.
+
+    Every enabled rule service (a macro may expand to several) becomes one entry
+    whose bit position follows rule order: node rules, then cluster rules, then
+    each guest's rules with security groups expanded in place. Protocols, port
+    ranges and source and destination networks (aliases and IP sets resolved) are
+    indexed as bit masks, so a query intersects a handful of masks and the lowest
+    remaining bit is the first matching rule. Node chains hold the node's own rules
+    followed by the cluster rules, so host rules can override cluster-wide ones;
+    guest chains hold only the guest's own rules, as in Proxmox. Rules with names
+    that do not resolve (aliases, IP sets, services or macros) never decide a
+    packet on what is unknown; they are reported as uncertain instead.
+    """
+
+    def __init__(self, data):
+        self.entries = []
+        self.protos = {}
+        self.any_proto = 0
+        self.ports = PortIntervalIndex()
+        self.sources = PrefixTrie()
+        self.dests = PrefixTrie()
+        self.unresolved = 0
+        self.unknown_services = 0
+        self.chains = {}
+        self.targets = {}
+
+        cluster_options = data['cluster']['options']
+        cluster_enabled = cluster_options.get('enable') in (1, '1', True)
+        for node, node_data in data['nodes'].items():
+            self.targets[('node', str(node))] = {
+                'enabled': cluster_enabled and node_data['options'].get('enable', 1) in (1, '1', True),
+                'policy_in': cluster_options.get('policy_in') or 'DROP',
+                'policy_out': cluster_options.get('policy_out') or 'ACCEPT'
+            }
+        for vmid, guest in data['guests'].items():
+            self.targets[('guest', str(vmid))] = {
+                'enabled': cluster_enabled and guest['options'].get('enable') in (1, '1', True),
+                'policy_in': guest['options'].get('policy_in') or 'DROP',
+                'policy_out': guest['options'].get('policy_out') or 'ACCEPT',
+                'name': guest['name'],
+                'node': guest['node'],
+                'guest_type': guest['type']
+            }
+
+        resolvers = {}
+        rows = data['rows'] if 'rows' in data else firewall_rule_rows(data)
+        # Node rules get lower bits than cluster rules, which only share a chain with them
+        for row in sorted(rows, key=lambda row: row['scope'] == 'cluster'):
+            if row['scope'] == 'group' or not row['enabled'] or row.get('type') not in ('in', 'out'):
+                continue
+            vmid = row.get('vmid') if row['scope'] == 'guest' else None
+            if vmid not in resolvers:
+                resolvers[vmid] = AddressResolver(data, vmid)
+            sources, source_unresolved = resolvers[vmid].networks(row.get('source'))
+            dests, dest_unresolved = resolvers[vmid].networks(row.get('dest'))
+
+            for proto, ranges in row['services']:
+                bit = 1 << len(self.entries)
+                self.entries.append(row)
+                if proto:
+                    self.protos[str(proto).lower()] = self.protos.get(str(proto).lower(), 0) | bit
+                else:
+                    self.any_proto |= bit
+                self.ports.add(bit, ranges)
+                self.sources.add(bit, sources)
+                self.dests.add(bit, dests)
+                if source_unresolved or dest_unresolved:
+                    self.unresolved |= bit
+                if row['unresolved_services']:
+                    # Could cover any port; only matches definitively on the ports that did resolve
+                    self.unresolved |= bit
+                    self.unknown_services |= bit
+                chain = (row['scope'], str(row['scope_id']), row['type'])
+                self.chains[chain] = self.chains.get(chain, 0) | bit
+        self.ports.build()
+
+        # Every node's chain continues with the cluster rules after its own
+        for kind, name in self.targets:
+            if kind == 'node':
+                for direction in ('in', 'out'):
+                    self.chains[('node', name, direction)] = (self.chains.get(('cluster', 'cluster', direction), 0) |
+                                                              self.chains.get(('node', name, direction), 0))
+
+    def check(self, kind, target, direction='in', proto='tcp', port=None, source=None, dest=None):
+        """First rule deciding a packet to (in) or from (out) a node or guest, or its default policy"""
+        info = self.targets.get((kind, str(target)))
+        if info is None:
+            raise ValueError(f"No firewall data for {kind} {target}")
+        result = {'kind': kind, 'target': str(target), 'name': info.get('name'), 'node': info.get('node', target),
+                  'guest_type': info.get('guest_type'), 'direction': direction, 'firewall_enabled': info['enabled'],
+                  'rule': None, 'uncertain': []}
+        if not info['enabled']:
+            return dict(result, allowed=True, action='ACCEPT', policy=False)
+
+        proto = (proto or '').lower()
+        mask = self.chains.get((kind, str(target), direction), 0)
+        mask &= self.any_proto | self.protos.get(proto, 0)
+        candidates = mask & self.unknown_services
+        if proto in ('tcp', 'udp') and port is not None:
+            mask &= self.ports.stab(int(port))
+        else:
+            mask &= self.ports.any_mask
+        candidates |= mask
+        mask &= self.sources.match(source) & self.dests.match(dest)
+
+        if mask:
+            first = (mask & -mask).bit_length() - 1
+            row = self.entries[first]
+            action = (row.get('action') or '').upper()
+            result['rule'] = rule_summary(row)
+            earlier = (1 << first) - 1
+        else:
+            action = info['policy_out' if direction == 'out' else 'policy_in'].upper()
+            earlier = -1
+
+        # Rules with names that did not resolve might have matched before the deciding one
+        uncertain = candidates & self.unresolved & earlier & ~mask
+        while uncertain:
+            bit = uncertain & -uncertain
+            result['uncertain'].append(rule_summary(self.entries[bit.bit_length() - 1]))
+            uncertain ^= bit
+
+        return dict(result, allowed=action == 'ACCEPT', action=action, policy=not mask)
+
+    def reachable(self, kind='guest', **packet):
+        """check() of every node or guest for the same packet"""
+        return [self.check(target_kind, target, **packet)
+                for target_kind, target in sorted(self.targets) if target_kind == kind]
+
+
+def rule_signature(rule):
+    return tuple(sorted((key, str(value)) for key, value in rule.items() if key not in ('pos', 'digest', 'ipversion')))
+
+
+def firewall_scopes(data):
+    """Options, rules, aliases and IP sets of every scope of a firewall snapshot, keyed by (scope, id)"""
+    scopes = {('cluster', 'cluster'): {
+        'options': data['cluster']['options'],
+        'rules': data['cluster']['rules'],
+        'aliases': data['cluster'].get('aliases', []),
+        'ipsets': {name: ipset['entries'] for name, ipset in data['ipsets'].items()}
+    }}
+    for name, group in data['groups'].items():
+        scopes[('group', str(name))] = {'rules': group['rules']}
+    for node, node_data in data['nodes'].items():
+        scopes[('node', str(node))] = {'options': node_data['options'], 'rules': node_data['rules']}
+    for vmid, guest in data['guests'].items():
+        scopes[('guest', str(vmid))] = {
+            'options': guest['options'],
+            'rules': guest['rules'],
+            'aliases': guest.get('aliases', []),
+            'ipsets': guest.get('ipsets', {})
+        }
+    return scopes
+
+
+def firewall_diff(old, new):
+    """Changes between two firewall snapshots, found with one hash pass over each scope"""
+    changes = []
+    old_scopes, new_scopes = firewall_scopes(old), firewall_scopes(new)
+
+    def change(scope, kind, what, **fields):
+        changes.append(dict({'scope': scope[0], 'scope_id': scope[1], 'kind': kind, 'change': what}, **fields))
+
+    for scope in list(old_scopes) + [scope for scope in new_scopes if scope not in old_scopes]:
+        before, after = old_scopes.get(scope), new_scopes.get(scope)
+        if before is None or after is None:
+            change(scope, 'scope', 'added' if before is None else 'removed')
+            continue
+
+        old_options, new_options = before.get('options', {}), after.get('options', {})
+        for key in sorted(set(old_options) | set(new_options)):
+            if key != 'digest' and str(old_options.get(key)) != str(new_options.get(key)):
+                change(scope, 'option', 'changed', name=key, old=old_options.get(key), new=new_options.get(key))
+
+        old_rules = [rule_signature(rule) for rule in before['rules']]
+        new_rules = [rule_signature(rule) for rule in after['rules']]
+        removed = Counter(old_rules) - Counter(new_rules)
+        added = Counter(new_rules) - Counter(old_rules)
+        for rule, signature in zip(before['rules'], old_rules):
+            if removed[signature] > 0:
+                removed[signature] -= 1
+                change(scope, 'rule', 'removed', old=rule)
+        for rule, signature in zip(after['rules'], new_rules):
+            if added[signature] > 0:
+                added[signature] -= 1
+                change(scope, 'rule', 'added', new=rule)
+        if old_rules != new_rules and Counter(old_rules) == Counter(new_rules):
+            change(scope, 'rule', 'reordered')
+
+        old_aliases = {alias['name']: alias.get('cidr') for alias in before.get('aliases', [])}
+        new_aliases = {alias['name']: alias.get('cidr') for alias in after.get('aliases', [])}
+        for name in sorted(set(old_aliases) | set(new_aliases)):
+            if old_aliases.get(name) != new_aliases.get(name):
+                what = 'added' if name not in old_aliases else 'removed' if name not in new_aliases else 'changed'
+                change(scope, 'alias', what, name=name, old=old_aliases.get(name), new=new_aliases.get(name))
+
+        old_ipsets, new_ipsets = before.get('ipsets', {}), after.get('ipsets', {})
+        for name in sorted(set(old_ipsets) | set(new_ipsets)):
+            if name not in old_ipsets or name not in new_ipsets:
+                change(scope, 'ipset', 'added' if name not in old_ipsets else 'removed', name=name)
+                continue
+            old_entries = {(entry['cidr'], entry.get('nomatch') in (1, '1', True)) for entry in old_ipsets[name]}
+            new_entries = {(entry['cidr'], entry.get('nomatch') in (1, '1', True)) for entry in new_ipsets[name]}
+            removed, added = sorted(old_entries - new_entries), sorted(new_entries - old_entries)
+            if removed or added:
+                change(scope, 'ipset', 'changed', name=name,
+                       old=[('!' if nomatch else '') + cidr for cidr, nomatch in removed],
+                       new=[('!' if nomatch else '') + cidr for cidr, nomatch in added])
+    return changes
+
+
+class FirewallInventory:
+    """Cluster, node and guest firewall configuration of a whole host, collected concurrently.
+
+    Cluster options, rules, aliases, security group listings and IP set listings are
+    fetched together with every node's and guest's options and rules
+    (FIREWALL_FETCH_WORKERS at a time); group rules and IP set entries follow in a
+    second concurrent round once their names are known. The result is kept until it
+    is older than FIREWALL_SNAPSHOT_MAX_AGE or invalidated by a firewall change; the
+    snapshot it replaced is kept as the baseline for changes().
+    """
+
+    def __init__(self, connections, inventory, max_age=FIREWALL_SNAPSHOT_MAX_AGE, workers=FIREWALL_FETCH_WORKERS):
+        self.connections = connections
+        self.inventory = inventory
+        self.max_age = max_age
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.refresh_locks = {}
+        self.hosts = {}
+        self.previous = {}
+        self.policies = {}
+
+    def _collect(self, host_id):
+        connection = self.connections[host_id]['connection']
+        snapshot = self.inventory.get_snapshot(host_id)
+        nodes = [node['node'] for node in snapshot['nodes'] if node.get('status') == 'online']
+        guests = {int(guest['vmid']): guest for guest in snapshot_guests(snapshot)}
+        firewall = connection.cluster.firewall
+
+        calls = {
+            ('cluster', 'options'): firewall.options.get,
+            ('cluster', 'rules'): firewall.rules.get,
+            ('cluster', 'aliases'): firewall.aliases.get,
+            ('cluster', 'groups'): firewall.groups.get,
+            ('cluster', 'ipsets'): firewall.ipset.get,
+        }
+        for node in nodes:
+            calls[('node', node, 'options')] = connection.nodes(node).firewall.options.get
+            calls[('node', node, 'rules')] = connection.nodes(node).firewall.rules.get
+        for vmid, guest in guests.items():
+            guest_firewall = guest_api(connection, guest['type'], guest['node'], vmid).firewall
+            calls[('guest', vmid, 'options')] = guest_firewall.options.get
+            calls[('guest', vmid, 'rules')] = guest_firewall.rules.get
+            calls[('guest', vmid, 'ipsets')] = guest_firewall.ipset.get
+            calls[('guest', vmid, 'aliases')] = guest_firewall.aliases.get
+        results, errors = fetch_calls(calls, self.workers)
+
+        # Group rules and IP set members need the names from the first round
+        second = {}
+        for group in results.get(('cluster', 'groups'), []):
+            second[('group', group['group'])] = firewall.groups(group['group']).get
+        for ipset in results.get(('cluster', 'ipsets'), []):
+            second[('ipset', ipset['name'])] = firewall.ipset(ipset['name']).get
+        for vmid, guest in guests.items():
+            for ipset in results.get(('guest', vmid, 'ipsets'), []):
+                second[('guest_ipset', vmid, ipset['name'])] = \
+                    guest_api(connection, guest['type'], guest['node'], vmid).firewall.ipset(ipset['name']).get
+        second_results, second_errors = fetch_calls(second, self.workers)
+        results.update(second_results)
+        errors.update(second_errors)
+
+        return {
+            'cluster': {
+                'options': results.get(('cluster', 'options'), {}),
+                'rules': results.get(('cluster', 'rules'), []),
+                'aliases': results.get(('cluster', 'aliases'), [])
+            },
+            'groups': {
+                group['group']: {'comment': group.get('comment', ''), 'rules': results.get(('group', group['group']), [])}
+                for group in results.get(('cluster', 'groups'), [])
+            },
+            'ipsets': {
+                ipset['name']: {'comment': ipset.get('comment', ''), 'entries': results.get(('ipset', ipset['name']), [])}
+                for ipset in results.get(('cluster', 'ipsets'), [])
+            },
+            'nodes': {
+                node: {'options': results.get(('node', node, 'options'), {}), 'rules': results.get(('node', node, 'rules'), [])}
+                for node in nodes
+            },
+            'guests': {
+                vmid: {
+                    'vmid': vmid,
+                    'node': guest['node'],
+                    'type': guest['type'],
+                    'name': guest.get('name') or f"{guest['type']}-{vmid}",
+                    'options': results.get(('guest', vmid, 'options'), {}),
+                    'rules': results.get(('guest', vmid, 'rules'), []),
+                    'aliases': results.get(('guest', vmid, 'aliases'), []),
+                    'ipsets': {
+                        ipset['name']: results.get(('guest_ipset', vmid, ipset['name']), [])
+                        for ipset in results.get(('guest', vmid, 'ipsets'), [])
+                    }
+                }
+                for vmid, guest in guests.items()
+            },
+            'errors': {'/'.join(str(part) for part in key): error for key, error in errors.items()},
+            'calls': len(calls) + len(second)
+        }
+
+    def refresh_host(self, host_id):
+        """Collect a host's firewall configuration; concurrent callers share one collection"""
+        with self.lock:
+            refresh_lock = self.refresh_locks.setdefault(host_id, threading.Lock())
+            before = self.hosts.get(host_id)
+
+        with refresh_lock:
+            with self.lock:
+                current = self.hosts.get(host_id)
+            if current is not None and current is not before:
+                return current
+
+            started = time.time()
+            data = self._collect(host_id)
+            data.update({'host_id': host_id, 'fetched': time.time(), 'duration': round(time.time() - started, 2)})
+            data['rows'] = firewall_rule_rows(data)
+            app_logger.info(f"Collected firewall configuration of {host_id} ({data['calls']} calls, "
+                            f"{len(data['rows'])} rules) in {data['duration']}s")
+
+            with self.lock:
+                if host_id in self.hosts:
+                    self.previous[host_id] = self.hosts[host_id]
+                self.hosts[host_id] = data
+            return data
+
+    def get(self, host_id, max_age=None):
+        with self.lock:
+            data = self.hosts.get(host_id)
+        max_age = self.max_age if max_age is None else max_age
+        if data is None or time.time() - data['fetched'] > max_age:
+            data = self.refresh_host(host_id)
+        return data
+
+    def search(self, host_id, **filters):
+        return search_rules(self.get(host_id)['rows'], **filters)
+
+    def policy(self, host_id, max_age=None):
+        """The compiled FirewallPolicy of a host's current snapshot"""
+        data = self.get(host_id, max_age)
+        with self.lock:
+            compiled = self.policies.get(host_id)
+        if compiled is not None and compiled[0] is data:
+            return compiled[1]
+
+        started = time.time()
+        policy = FirewallPolicy(data)
+        app_logger.debug(f"Compiled firewall policy of {host_id} ({len(policy.entries)} entries) "
+                         f"in {time.time() - started:.3f}s")
+        with self.lock:
+            self.policies[host_id] = (data, policy)
+        return policy
+
+    def changes(self, host_id, baseline=None):
+        """Changes from a baseline snapshot (the previous collection by default) to the current one"""
+        data = self.get(host_id)
+        if baseline is None:
+            with self.lock:
+                baseline = self.previous.get(host_id)
+        if baseline is None:
+            return None
+        return firewall_diff(baseline, data)
+
+    def invalidate(self, host_id):
+        """Mark a host's firewall snapshot stale so the next reader collects again"""
+        with self.lock:
+            data = self.hosts.get(host_id)
+            if data is not None:
+                self.hosts[host_id] = dict(data, fetched=0)
+
+    def forget(self, host_id):
+        with self.lock:
+            self.hosts.pop(host_id, None)
+            self.previous.pop(host_id, None)
+            self.policies.pop(host_id, None)
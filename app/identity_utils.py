@@ -0,0 +1,466 @@
+import os
+import time
+import threading
+import logging
+
+from task_utils import parallel_map, fetch_calls
+
+app_logger = logging.getLogger('proxima-ui')
+
+# Users, groups, roles and ACLs of a host older than this are refetched when read (seconds)
+IDENTITY_MAX_AGE = int(os.getenv('IDENTITY_MAX_AGE', 300))
+
+# Hosts whose identity data is fetched at the same time for cross-host queries
+IDENTITY_FETCH_WORKERS = int(os.getenv('IDENTITY_FETCH_WORKERS', 8))
+
+# The built-in superuser holds every privilege on every path
+SUPERUSER = 'root@pam'
+
+# Hosts synchronized at the same time by a bulk identity sync
+IDENTITY_SYNC_WORKERS = int(os.getenv('IDENTITY_SYNC_WORKERS', 4))
+
+# Account fields a desired state may manage; the password is only used when creating a user
+IDENTITY_USER_FIELDS = ('email', 'firstname', 'lastname', 'comment', 'enable', 'expire', 'groups')
+
+# ACL entry types and the acl PUT parameter each is passed in
+ACL_TYPE_PARAMS = {'user': 'users', 'group': 'groups', 'token': 'tokens'}
+
+
+def split_list(value):
+    """A Proxmox list field that may come as a list or a comma separated string"""
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    return [item.strip() for item in str(value).split(',') if item.strip()]
+
+
+def normalize_acl_path(path):
+    """An ACL path with a leading slash and no empty or trailing segments"""
+    return '/' + '/'.join(part for part in str(path or '/').split('/') if part)
+
+
+def acl_path_chain(path):
+    """A path and its ancestors from the root down: /vms/100 -> ['/', '/vms', '/vms/100']"""
+    parts = [part for part in normalize_acl_path(path).split('/') if part]
+    return ['/'] + ['/' + '/'.join(parts[:depth]) for depth in range(1, len(parts) + 1)]
+
+
+def user_active(user, now=None):
+    """Whether a user account is enabled and not expired"""
+    if user.get('enable', 1) in (0, '0', False):
+        return False
+    expire = int(user.get('expire') or 0)
+    return not expire or expire > (now or time.time())
+
+
+class IdentityIndex:
+    """Users, group memberships, role privileges and ACLs of one host, indexed for permission queries.
+
+    ACL entries are grouped by path and then by user, group or API token, so
+    resolving a path walks only the path's own ancestors. Resolution follows
+    Proxmox: at each level from / down, entries that propagate (or sit on the
+    queried path itself) replace what was inherited; a user's own entries win over
+    its groups' entries at the same level, and NoAccess revokes everything.
+    Privilege separated API tokens get the intersection of their own and their
+    user's privileges.
+    """
+
+    def __init__(self, data):
+        self.users = {user['userid']: user for user in data['users']}
+        self.groups = {group['groupid']: group for group in data['groups']}
+        self.roles = {role['roleid']: set(split_list(role.get('privs'))) for role in data['roles']}
+        self.all_privileges = sorted(set().union(*self.roles.values())) if self.roles else []
+
+        self.user_groups = {userid: set(split_list(user.get('groups'))) for userid, user in self.users.items()}
+        for groupid, group in self.groups.items():
+            # Group listings carry members too; either side may be missing depending on the API version
+            for userid in split_list(group.get('users')):
+                self.user_groups.setdefault(userid, set()).add(groupid)
+
+        self.tokens = {}
+        for userid, user in self.users.items():
+            for token in user.get('tokens') or []:
+                self.tokens[f"{userid}!{token['tokenid']}"] = token
+
+        self.acl = {}
+        for entry in data['acl']:
+            path = normalize_acl_path(entry.get('path'))
+            kind = entry.get('type', 'user')
+            grants = self.acl.setdefault(path, {}).setdefault(kind, {}).setdefault(entry['ugid'], {})
+            grants[entry['roleid']] = entry.get('propagate', 1) in (1, '1', True)
+
+    def _roles(self, ugid, path, groups=(), kind='user'):
+        roles, sources = {}, []
+        for level in acl_path_chain(path):
+            final = level == path
+            entries = self.acl.get(level)
+            if not entries:
+                continue
+
+            own = {role: propagate for role, propagate in entries.get(kind, {}).get(ugid, {}).items()
+                   if final or propagate}
+            if own:
+                roles = own
+                sources = [{'path': level, 'type': kind, 'ugid': ugid, 'roleid': role} for role in own]
+                continue
+
+            inherited, from_groups = {}, []
+            for groupid in groups:
+                for role, propagate in entries.get('group', {}).get(groupid, {}).items():
+                    if final or propagate:
+                        inherited[role] = propagate
+                        from_groups.append({'path': level, 'type': 'group', 'ugid': groupid, 'roleid': role})
+            if inherited:
+                roles, sources = inherited, from_groups
+        return roles, sources
+
+    def _privileges(self, roles):
+        if 'NoAccess' in roles:
+            return set()
+        return set().union(*(self.roles.get(role, set()) for role in roles)) if roles else set()
+
+    def permissions(self, userid, path):
+        """Effective roles and privileges of a user or API token (user@realm!token) on a path"""
+        path = normalize_acl_path(path)
+        owner, _, token_name = userid.partition('!')
+        result = {'userid': userid, 'path': path, 'roles': [], 'privileges': [], 'sources': [],
+                  'groups': sorted(self.user_groups.get(owner, ())), 'reason': None}
+
+        if owner == SUPERUSER and not token_name:
+            return dict(result, roles=['Administrator'], privileges=self.all_privileges, reason='superuser')
+        user = self.users.get(owner)
+        if user is None and owner != SUPERUSER:
+            return dict(result, reason='unknown user')
+        if user is not None and not user_active(user):
+            return dict(result, reason='user disabled or expired')
+
+        if owner == SUPERUSER:
+            roles, sources, privileges = {'Administrator': True}, [], set(self.all_privileges)
+        else:
+            roles, sources = self._roles(owner, path, self.user_groups.get(owner, ()))
+            privileges = self._privileges(roles)
+
+        if token_name:
+            token = self.tokens.get(userid)
+            if token is None:
+                return dict(result, reason='unknown token')
+            expire = int(token.get('expire') or 0)
+            if expire and expire <= time.time():
+                return dict(result, reason='token expired')
+            if token.get('privsep', 1) in (1, '1', True):
+                token_roles, token_sources = self._roles(userid, path, kind='token')
+                privileges &= self._privileges(token_roles)
+                roles, sources = token_roles, token_sources + sources
+
+        return dict(result, roles=sorted(roles), privileges=sorted(privileges), sources=sources)
+
+    def acl_entries(self):
+        """Every ACL entry as a flat row, sorted by path"""
+        return [
+            {'path': path, 'type': kind, 'ugid': ugid, 'roleid': role, 'propagate': propagate}
+            for path in sorted(self.acl)
+            for kind, grants in sorted(self.acl[path].items())
+            for ugid, roles in sorted(grants.items())
+            for role, propagate in sorted(roles.items())
+        ]
+
+
+def flag(value):
+    """A Proxmox boolean (1/0) from a JSON, form or API value"""
+    return 1 if value in (1, '1', True, 'on', 'true') else 0
+
+
+def desired_acl_entry(entry):
+    """An ACL entry of a desired state as (path, type, ugid, roleid, propagate); raises ValueError"""
+    if not isinstance(entry, dict):
+        raise ValueError(f"ACL entry {entry!r} must be an object")
+    kinds = [kind for kind in ACL_TYPE_PARAMS if entry.get(kind)]
+    if entry.get('ugid'):
+        kind, ugid = entry.get('type', 'user'), entry['ugid']
+    elif len(kinds) == 1:
+        kind, ugid = kinds[0], entry[kinds[0]]
+    else:
+        raise ValueError(f"ACL entry {entry} needs exactly one of user, group or token")
+    if not isinstance(kind, str) or kind not in ACL_TYPE_PARAMS:
+        raise ValueError(f"Unknown ACL entry type '{kind}'")
+    if not isinstance(ugid, str):
+        raise ValueError(f"ACL entry {entry} must name its {kind} as a string")
+    roleid = entry.get('roleid') or entry.get('role')
+    if not isinstance(entry.get('path'), str) or not entry['path'] or not isinstance(roleid, str) or not roleid:
+        raise ValueError(f"ACL entry {entry} needs a path and a role")
+    return normalize_acl_path(entry['path']), kind, ugid, roleid, flag(entry.get('propagate', 1))
+
+
+def state_section(state, name):
+    """Entries of one section of a desired state; raises ValueError unless it is a list"""
+    entries = state.get(name) or []
+    if not isinstance(entries, list):
+        raise ValueError(f"'{name}' must be a list")
+    return entries
+
+
+def parse_identity_state(state):
+    """Validate a desired state {groups, users, acl} and index it by id; raises ValueError"""
+    if not isinstance(state, dict):
+        raise ValueError("The desired state must be a JSON object")
+    unknown = set(state) - {'groups', 'users', 'acl'}
+    if unknown:
+        raise ValueError(f"Unknown sections: {', '.join(sorted(unknown))}")
+
+    groups = {}
+    for group in state_section(state, 'groups'):
+        if isinstance(group, str):
+            group = {'groupid': group}
+        if not isinstance(group, dict):
+            raise ValueError(f"Group {group!r} must be a name or an object")
+        if not group.get('groupid') or not isinstance(group['groupid'], str):
+            raise ValueError(f"Group {group} has no groupid")
+        groups[group['groupid']] = {key: group[key] for key in ('comment',) if key in group}
+
+    users = {}
+    for user in state_section(state, 'users'):
+        if not isinstance(user, dict):
+            raise ValueError(f"User {user!r} must be an object")
+        userid = user.get('userid', '')
+        if not isinstance(userid, str) or '@' not in userid or '!' in userid:
+            raise ValueError(f"User '{userid}' must be given as name@realm")
+        fields = {field: user[field] for field in IDENTITY_USER_FIELDS if field in user}
+        if 'enable' in fields:
+            fields['enable'] = flag(fields['enable'])
+        if 'expire' in fields:
+            try:
+                fields['expire'] = int(fields['expire'] or 0)
+            except (ValueError, TypeError):
+                raise ValueError(f"User '{userid}' has an invalid expire time: {fields['expire']!r}")
+        if 'groups' in fields:
+            fields['groups'] = sorted(set(split_list(fields['groups'])))
+        if user.get('password'):
+            fields['password'] = user['password']
+        users[userid] = fields
+
+    acl = {}
+    for entry in state_section(state, 'acl'):
+        path, kind, ugid, roleid, propagate = desired_acl_entry(entry)
+        acl[(path, kind, ugid, roleid)] = propagate
+
+    if not groups and not users and not acl:
+        raise ValueError("The desired state is empty")
+    return {'groups': groups, 'users': users, 'acl': acl}
+
+
+def identity_diff(data, desired, prune=False):
+    """Operations that bring a host's identity data to a desired state, and problems that prevent it.
+
+    Groups are created first, then users, then ACL entries are added; entries are
+    removed last, and only with prune, and only for users, groups and tokens the
+    desired state mentions. Fields a desired user leaves out are not touched.
+    """
+    operations, problems = [], []
+    current_groups = {group['groupid']: group for group in data['groups']}
+    current_users = {user['userid']: user for user in data['users']}
+    roles = {role['roleid'] for role in data['roles']}
+    realms = {domain['realm'] for domain in data['domains']}
+
+    for groupid, group in sorted(desired['groups'].items()):
+        current = current_groups.get(groupid)
+        if current is None:
+            operations.append({'action': 'create_group', 'id': groupid, 'params': dict(group, groupid=groupid)})
+        elif 'comment' in group and (current.get('comment') or '') != group['comment']:
+            operations.append({'action': 'update_group', 'id': groupid, 'params': {'comment': group['comment']}})
+
+    known_groups = set(current_groups) | set(desired['groups'])
+    for userid, fields in sorted(desired['users'].items()):
+        realm = userid.rsplit('@', 1)[1]
+        if realms and 'domains' not in data['errors'] and realm not in realms:
+            problems.append(f"User {userid}: realm '{realm}' does not exist")
+            continue
+        missing = set(fields.get('groups', ())) - known_groups
+        if missing:
+            problems.append(f"User {userid}: unknown group(s) {', '.join(sorted(missing))}")
+            continue
+
+        current = current_users.get(userid)
+        if current is None:
+            params = dict(fields, userid=userid)
+            if 'groups' in params:
+                params['groups'] = ','.join(params['groups'])
+            operations.append({'action': 'create_user', 'id': userid, 'params': params,
+                               'fields': sorted(key for key in fields if key != 'password')})
+            continue
+
+        existing = {
+            'email': current.get('email') or '',
+            'firstname': current.get('firstname') or '',
+            'lastname': current.get('lastname') or '',
+            'comment': current.get('comment') or '',
+            'enable': flag(current.get('enable', 1)),
+            'expire': int(current.get('expire') or 0),
+            'groups': sorted(set(split_list(current.get('groups'))))
+        }
+        changed = {field: value for field, value in fields.items()
+                   if field != 'password' and existing[field] != value}
+        if changed:
+            params = dict(changed)
+            if 'groups' in params:
+                params['groups'] = ','.join(params['groups'])
+            operations.append({'action': 'update_user', 'id': userid, 'params': params, 'fields': sorted(changed)})
+
+    current_acl = {}
+    for entry in data['acl']:
+        key = (normalize_acl_path(entry.get('path')), entry.get('type', 'user'), entry['ugid'], entry['roleid'])
+        current_acl[key] = flag(entry.get('propagate', 1))
+
+    known_users = set(current_users) | set(desired['users'])
+    for key, propagate in sorted(desired['acl'].items()):
+        path, kind, ugid, roleid = key
+        if roleid not in roles:
+            problems.append(f"ACL {path} {ugid}: role '{roleid}' does not exist")
+        elif kind == 'group' and ugid not in known_groups:
+            problems.append(f"ACL {path}: group '{ugid}' does not exist")
+        elif kind != 'group' and ugid.split('!')[0] not in known_users:
+            problems.append(f"ACL {path}: user '{ugid.split('!')[0]}' does not exist")
+        elif current_acl.get(key) != propagate:
+            operations.append({'action': 'add_acl', 'id': f"{path} {ugid} {roleid}", 'params': {
+                'path': path, 'roles': roleid, ACL_TYPE_PARAMS[kind]: ugid, 'propagate': propagate
+            }})
+
+    if prune:
+        managed = ({('user', userid) for userid in desired['users']}
+                   | {('group', groupid) for groupid in desired['groups']}
+                   | {(kind, ugid) for _, kind, ugid, _ in desired['acl']})
+        for key in sorted(set(current_acl) - set(desired['acl'])):
+            path, kind, ugid, roleid = key
+            if (kind, ugid) in managed:
+                operations.append({'action': 'remove_acl', 'id': f"{path} {ugid} {roleid}", 'params': {
+                    'path': path, 'roles': roleid, ACL_TYPE_PARAMS[kind]: ugid, 'delete': 1
+                }})
+
+    return operations, problems
+
+
+def apply_identity_operation(access, operation):
+    """Run one operation from identity_diff against a host's access API"""
+    action, params = operation['action'], operation['params']
+    if action == 'create_group':
+        access.groups.post(**params)
+    elif action == 'update_group':
+        access.groups(operation['id']).put(**params)
+    elif action == 'create_user':
+        access.users.post(**params)
+    elif action == 'update_user':
+        access.users(operation['id']).put(**params)
+    elif action in ('add_acl', 'remove_acl'):
+        access.acl.put(**params)
+    else:
+        raise ValueError(f"Unknown identity operation '{action}'")
+
+
+class IdentityService:
+    """Cached users, groups, roles, realms and ACLs of every host.
+
+    A host's five access listings are fetched concurrently and indexed together
+    (IdentityIndex); cross-host queries fetch the hosts concurrently as well. Data
+    is kept until it is older than IDENTITY_MAX_AGE or invalidated by a change made
+    through the UI.
+    """
+
+    def __init__(self, connections, max_age=IDENTITY_MAX_AGE, workers=IDENTITY_FETCH_WORKERS):
+        self.connections = connections
+        self.max_age = max_age
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.refresh_locks = {}
+        self.hosts = {}
+
+    def _collect(self, host_id):
+        access = self.connections[host_id]['connection'].access
+        results, errors = fetch_calls({
+            'users': lambda: access.users.get(full=1),
+            'groups': access.groups.get,
+            'roles': access.roles.get,
+            'acl': access.acl.get,
+            'domains': access.domains.get
+        })
+        if 'users' in errors:
+            raise Exception(f"Failed to list users: {errors['users']}")
+
+        data = {name: results.get(name, []) for name in ('users', 'groups', 'roles', 'acl', 'domains')}
+        data['errors'] = errors
+        return data
+
+    def refresh_host(self, host_id):
+        """Fetch a host's identity data; concurrent callers share one fetch"""
+        with self.lock:
+            refresh_lock = self.refresh_locks.setdefault(host_id, threading.Lock())
+            before = self.hosts.get(host_id)
+
+        with refresh_lock:
+            with self.lock:
+                current = self.hosts.get(host_id)
+            if current is not None and current is not before:
+                return current
+
+            data = self._collect(host_id)
+            data.update({'host_id': host_id, 'fetched': time.time(), 'index': IdentityIndex(data)})
+            with self.lock:
+                self.hosts[host_id] = data
+            return data
+
+    def get(self, host_id, max_age=None):
+        with self.lock:
+            data = self.hosts.get(host_id)
+        max_age = self.max_age if max_age is None else max_age
+        if data is None or time.time() - data['fetched'] > max_age:
+            data = self.refresh_host(host_id)
+        return data
+
+    def get_many(self, host_ids=None):
+        """Identity data of several hosts (all by default), fetched concurrently; returns (data, errors) by host"""
+        host_ids = list(self.connections) if host_ids is None else host_ids
+        data, errors = {}, {}
+        for host_id, result, error in parallel_map(self.get, host_ids, max_workers=self.workers):
+            if error:
+                errors[host_id] = str(error)
+            else:
+                data[host_id] = result
+        return data, errors
+
+    def permissions(self, userid, path, host_ids=None):
+        """Effective permissions of a user on a path on every host; returns (results by host, errors by host)"""
+        data, errors = self.get_many(host_ids)
+        return {host_id: host['index'].permissions(userid, path) for host_id, host in data.items()}, errors
+
+    def matrix(self, path, privilege=None, host_ids=None):
+        """Every user's privileges on a path across hosts; with a privilege, only users holding it somewhere"""
+        data, errors = self.get_many(host_ids)
+        hosts = sorted(data)
+        rows = {}
+        for host_id in hosts:
+            index = data[host_id]['index']
+            for userid in list(index.users) + list(index.tokens):
+                result = index.permissions(userid, path)
+                row = rows.setdefault(userid, {'userid': userid, 'hosts': {}})
+                row['hosts'][host_id] = {
+                    'roles': result['roles'],
+                    'privileges': result['privileges'],
+                    'allowed': privilege in result['privileges'] if privilege else bool(result['privileges']),
+                    'reason': result['reason']
+                }
+
+        users = sorted(rows.values(), key=lambda row: row['userid'])
+        if privilege:
+            users = [row for row in users if any(cell['allowed'] for cell in row['hosts'].values())]
+        return {'path': normalize_acl_path(path), 'privilege': privilege, 'hosts': hosts, 'users': users,
+                'errors': errors}
+
+    def invalidate(self, host_id):
+        """Mark a host's identity data stale so the next reader fetches it again"""
+        with self.lock:
+            data = self.hosts.get(host_id)
+            if data is not None:
+                self.hosts[host_id] = dict(data, fetched=0)
+
+    def forget(self, host_id):
+        with self.lock:
+            self.hosts.pop(host_id, None)
@@ -0,0 +1,253 @@
+import os
+import re
+import threading
+import time
+import logging
+
+from task_utils import parallel_map
+
+app_logger = logging.getLogger('proxima-ui')
+
+# How often the background poller refreshes every host's inventory (seconds)
+INVENTORY_POLL_INTERVAL = int(os.getenv('INVENTORY_POLL_INTERVAL', 15))
+
+# Snapshots older than this are refreshed synchronously when a route asks for them
+INVENTORY_MAX_AGE = int(os.getenv('INVENTORY_MAX_AGE', 60))
+
+
+def build_snapshot(host_id, resources):
+    """Index a cluster/resources listing by resource type"""
+    snapshot = {
+        'host_id': host_id,
+        'fetched': time.time(),
+        'resources': resources,
+        'nodes': [],
+        'guests': [],
+        'storage': [],
+        'templates': []
+    }
+
+    for resource in resources:
+        resource_type = resource.get('type')
+        if resource_type == 'node':
+            snapshot['nodes'].append(resource)
+        elif resource_type in ('qemu', 'lxc'):
+            snapshot['guests'].append(resource)
+            if resource.get('template') in (1, '1', True):
+                snapshot['templates'].append(resource)
+        elif resource_type == 'storage':
+            snapshot['storage'].append(resource)
+
+    return snapshot
+
+
+def snapshot_guests(snapshot, guest_type=None, node=None, include_templates=False):
+    """Guests from a snapshot, optionally filtered by type and node"""
+    return [
+        guest for guest in snapshot['guests']
+        if (guest_type is None or guest.get('type') == guest_type)
+        and (node is None or guest.get('node') == node)
+        and (include_templates or guest.get('template') not in (1, '1', True))
+    ]
+
+
+def snapshot_guest(snapshot, vmid):
+    """The guest with the given VMID from a snapshot, or None"""
+    for guest in snapshot['guests']:
+        if str(guest.get('vmid')) == str(vmid):
+            return guest
+    return None
+
+
+def guest_tags(guest):
+    return {tag for tag in re.split(r'[;,\s]+', guest.get('tags') or '') if tag}
+
+
+def select_guests(snapshot, vmids=None, node=None, guest_type=None, tag=None, pool=None):
+    """Guests of a snapshot matching explicit VMIDs and/or node, type, tag and pool filters"""
+    vmids = {str(vmid) for vmid in vmids} if vmids else None
+    return [
+        guest for guest in snapshot_guests(snapshot, guest_type, node)
+        if (vmids is None or str(guest['vmid']) in vmids)
+        and (not tag or tag in guest_tags(guest))
+        and (not pool or guest.get('pool') == pool)
+    ]
+
+
+def snapshot_templates(snapshot, guest_type=None, node=None):
+    """Template registry entries from a snapshot, sorted by name"""
+    templates = [
+        {
+            'vmid': template.get('vmid'),
+            'name': template.get('name') or f"{template.get('type')}-{template.get('vmid')}",
+            'type': template.get('type'),
+            'node': template.get('node'),
+            'pool': template.get('pool'),
+            'tags': template.get('tags', '')
+        }
+        for template in snapshot['templates']
+        if (guest_type is None or template.get('type') == guest_type)
+        and (node is None or template.get('node') == node)
+    ]
+    return sorted(templates, key=lambda t: (t['name'].lower(), t['vmid'] or 0))
+
+
+def snapshot_node_stats(snapshot):
+    """Per-node usage and guest counts for the online nodes of a snapshot"""
+    stats = []
+    for node_info in snapshot['nodes']:
+        if node_info.get('status') != 'online':
+            continue
+
+        node_name = node_info['node']
+        memory_total = node_info.get('maxmem') or 0
+        memory_used = node_info.get('mem') or 0
+
+        # Average usage over the storages visible on this node
+        storage_usage = [
+            storage['disk'] / storage['maxdisk'] * 100
+            for storage in snapshot['storage']
+            if storage.get('node') == node_name and storage.get('maxdisk')
+        ]
+
+        vms = snapshot_guests(snapshot, 'qemu', node_name, include_templates=True)
+        containers = snapshot_guests(snapshot, 'lxc', node_name, include_templates=True)
+
+        # Rounded to display precision so unchanged figures produce identical stats; uptime stays exact
+        # and is only coarsened for ETags
+        stats.append({
+            'host_id': snapshot['host_id'],
+            'name': node_name,
+            'status': node_info['status'],
+            'cpu': round((node_info.get('cpu') or 0) * 100, 1),
+            'memory_used': round(memory_used / (1024*1024*1024), 1),
+            'memory_total': round(memory_total / (1024*1024*1024), 1),
+            'memory_percent': round(memory_used / memory_total * 100, 1) if memory_total else 0,
+            'storage_percent': round(sum(storage_usage) / len(storage_usage), 1) if storage_usage else 0,
+            'vms_total': len(vms),
+            'vms_running': sum(1 for vm in vms if vm.get('status') == 'running'),
+            'containers_total': len(containers),
+            'containers_running': sum(1 for ct in containers if ct.get('status') == 'running'),
+            'uptime': node_info.get('uptime') or 0
+        })
+    return stats
+
+
+class InventoryPoller:
+    """Keeps one cluster/resources snapshot per host, refreshed by a background thread.
+
+    A single call per cluster returns every node, guest and storage, so routes read
+    from the snapshot instead of walking nodes one API call at a time. Listeners
+    registered with add_listener() are called with (host_id, snapshot) after each poll.
+    """
+
+    def __init__(self, connections, interval=INVENTORY_POLL_INTERVAL):
+        self.connections = connections
+        self.interval = interval
+        self.snapshots = {}
+        self.errors = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.refresh_locks = {}
+        # How often get_snapshot() was served from the cached snapshot vs. fetched
+        self.stats = {'hits': 0, 'misses': 0}
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def refresh_host(self, host_id):
+        """Fetch a fresh snapshot for one host; concurrent callers share one fetch"""
+        with self.lock:
+            refresh_lock = self.refresh_locks.setdefault(host_id, threading.Lock())
+            before = self.snapshots.get(host_id)
+
+        with refresh_lock:
+            # Another caller may have refreshed while we waited for the lock
+            with self.lock:
+                current = self.snapshots.get(host_id)
+            if current is not None and current is not before:
+                return current
+
+            host_data = self.connections.get(host_id)
+            if host_data is None:
+                raise KeyError(f"Host {host_id} not found")
+
+            try:
+                resources = host_data['connection'].cluster.resources.get()
+            except Exception as e:
+                with self.lock:
+                    self.errors[host_id] = str(e)
+                raise
+
+            snapshot = build_snapshot(host_id, resources)
+            with self.lock:
+                self.snapshots[host_id] = snapshot
+                self.errors.pop(host_id, None)
+
+        for listener in self.listeners:
+            try:
+                listener(host_id, snapshot)
+            except Exception as e:
+                app_logger.warning(f"Inventory listener failed for {host_id}: {str(e)}")
+
+        return snapshot
+
+    def get_snapshot(self, host_id, max_age=INVENTORY_MAX_AGE):
+        """Return the cached snapshot, fetching it now if missing or older than max_age"""
+        with self.lock:
+            snapshot = self.snapshots.get(host_id)
+            stale = snapshot is None or time.time() - snapshot['fetched'] > max_age
+            self.stats['misses' if stale else 'hits'] += 1
+        if stale:
+            snapshot = self.refresh_host(host_id)
+        return snapshot
+
+    def cached_snapshot(self, host_id):
+        """Return the last snapshot without triggering a fetch"""
+        with self.lock:
+            return self.snapshots.get(host_id)
+
+    def invalidate(self, host_id):
+        """Mark a host's snapshot stale so the next reader refetches it"""
+        with self.lock:
+            snapshot = self.snapshots.get(host_id)
+            if snapshot is not None:
+                self.snapshots[host_id] = dict(snapshot, fetched=0)
+
+    def forget(self, host_id):
+        with self.lock:
+            self.snapshots.pop(host_id, None)
+            self.errors.pop(host_id, None)
+
+    def poll_all(self):
+        host_ids = list(self.connections.keys())
+        for host_id, _, error in parallel_map(self.refresh_host, host_ids):
+            if error:
+                app_logger.warning(f"Inventory poll failed for {host_id}: {str(error)}")
+
+        # Drop snapshots of hosts that were removed
+        with self.lock:
+            for host_id in list(self.snapshots):
+                if host_id not in self.connections:
+                    del self.snapshots[host_id]
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            started = time.time()
+            try:
+                self.poll_all()
+            except Exception as e:
+                app_logger.error(f"Inventory poller error: {str(e)}")
+            self.stop_event.wait(max(1, self.interval - (time.time() - started)))
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from collections import deque
+
+# Number of diff events kept so reconnecting clients can catch up without a full resync
+LIVE_HISTORY = int(os.getenv('LIVE_HISTORY', 200))
+
+# Fields of a cluster/resources entry that are pushed to the browser
+LIVE_FIELDS = (
+    'type', 'node', 'vmid', 'name', 'status', 'template', 'lock',
+    'cpu', 'maxcpu', 'mem', 'maxmem', 'disk', 'maxdisk', 'uptime'
+)
+
+
+def resource_key(resource):
+    """Stable key of a resource, e.g. 'qemu/100' or 'node/pve1'"""
+    if resource.get('id'):
+        return resource['id']
+    if resource.get('type') in ('qemu', 'lxc'):
+        return f"{resource['type']}/{resource.get('vmid')}"
+    return f"{resource.get('type')}/{resource.get('node')}"
+
+
+def live_state(snapshot):
+    """Reduce an inventory snapshot to the node and guest fields the UI displays"""
+    state = {}
+    for resource in snapshot['nodes'] + snapshot['guests']:
+        entry = {field: resource[field] for field in LIVE_FIELDS if field in resource}
+        # Usage figures jitter slightly on every poll; rounding avoids pushing noise
+        if isinstance(entry.get('cpu'), float):
+            entry['cpu'] = round(entry['cpu'], 3)
+        state[resource_key(resource)] = entry
+    return state
+
+
+def diff_states(old, new):
+    """Resources that were added or changed, and keys that disappeared"""
+    changed = {key: entry for key, entry in new.items() if old.get(key) != entry}
+    removed = [key for key in old if key not in new]
+    return changed, removed
+
+
+class LiveFeed:
+    """Turns inventory snapshots into a stream of resource diffs for push clients.
+
+    Registered as an inventory listener, so every open browser tab is fed from the
+    same background poll; alert changes are pushed on the same stream. Each event
+    gets an increasing version; clients resume from the last version they saw and
+    get a full snapshot when it fell out of history.
+    """
+
+    def __init__(self, history=LIVE_HISTORY):
+        self.states = {}
+        self.events = deque(maxlen=history)
+        self.version = 0
+        self.condition = threading.Condition()
+
+    def _append(self, host_id, event, **payload):
+        # Callers hold self.condition
+        self.version += 1
+        self.events.append(dict(payload, version=self.version, event=event, host_id=host_id, time=time.time()))
+        self.condition.notify_all()
+
+    def publish(self, host_id, snapshot):
+        state = live_state(snapshot)
+        with self.condition:
+            changed, removed = diff_states(self.states.get(host_id, {}), state)
+            self.states[host_id] = state
+            if changed or removed:
+                self._append(host_id, 'diff', changed=changed, removed=removed)
+
+    def publish_alerts(self, host_id, fired, resolved, active):
+        """Alert engine listener: push alert changes to clients alongside resource diffs"""
+        with self.condition:
+            self._append(host_id, 'alerts', fired=fired, resolved=resolved, active=active)
+
+    def forget(self, host_id):
+        with self.condition:
+            state = self.states.pop(host_id, None)
+            if state:
+                self._append(host_id, 'diff', changed={}, removed=list(state))
+
+    def current(self, host_ids=None):
+        """Return (version, {host_id: state}) for a full resync"""
+        with self.condition:
+            states = {
+                host_id: dict(state) for host_id, state in self.states.items()
+                if host_ids is None or host_id in host_ids
+            }
+            return self.version, states
+
+    def events_since(self, version, host_ids=None):
+        """Return (version, events) after version, or (version, None) if history no longer covers it"""
+        with self.condition:
+            if version > self.version or (self.events and version < self.events[0]['version'] - 1):
+                return self.version, None
+            events = [
+                event for event in self.events
+                if event['version'] > version and (host_ids is None or event['host_id'] in host_ids)
+            ]
+            return self.version, events
+
+    def wait(self, version, timeout=15):
+        """Block until a diff newer than version is published (or timeout) and return the current version"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
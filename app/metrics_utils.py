@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+import bisect
+
+# Upper bounds (seconds) of the latency histogram buckets
+METRICS_LATENCY_BUCKETS = tuple(
+    float(bound) for bound in os.getenv('METRICS_LATENCY_BUCKETS', '0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10').split(',')
+)
+
+# Prometheus text exposition format, which OpenMetrics scrapers accept as well
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    """Render a label dict (or sorted item tuple) as {a="1",b="2"}"""
+    items = labels.items() if isinstance(labels, dict) else labels
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in items) + '}'
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return repr(value) if value == value else 'NaN'
+    return str(value)
+
+
+def family_header(name, metric_type, help_text):
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+
+
+class MetricsRegistry:
+    """Counters and histograms of the application itself (requests, upstream calls, caches).
+
+    Families are declared once with counter()/histogram(); samples are keyed by their
+    label values so recording is a dict update under one lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = {}
+
+    def counter(self, name, help_text):
+        self.families.setdefault(name, {'type': 'counter', 'help': help_text, 'samples': {}})
+
+    def histogram(self, name, help_text, buckets=METRICS_LATENCY_BUCKETS):
+        self.families.setdefault(name, {'type': 'histogram', 'help': help_text,
+                                        'buckets': tuple(sorted(buckets)), 'samples': {}})
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            samples = self.families[name]['samples']
+            samples[key] = samples.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.families[name]
+            sample = family['samples'].get(key)
+            if sample is None:
+                sample = family['samples'][key] = {'buckets': [0] * len(family['buckets']), 'sum': 0.0, 'count': 0}
+            # Buckets are stored non-cumulatively and summed up at render time
+            index = bisect.bisect_left(family['buckets'], value)
+            if index < len(family['buckets']):
+                sample['buckets'][index] += 1
+            sample['sum'] += value
+            sample['count'] += 1
+
+    def render(self):
+        """Lines of every family in the text exposition format"""
+        with self.lock:
+            families = {
+                name: dict(family, samples={
+                    key: dict(sample, buckets=list(sample['buckets'])) if isinstance(sample, dict) else sample
+                    for key, sample in family['samples'].items()
+                })
+                for name, family in self.families.items()
+            }
+
+        lines = []
+        for name, family in families.items():
+            lines.extend(family_header(name, family['type'], family['help']))
+            for key, sample in family['samples'].items():
+                if family['type'] == 'counter':
+                    lines.append(f"{name}{format_labels(key)} {format_value(sample)}")
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(family['buckets'], sample['buckets']):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', format_value(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(key + (('le', '+Inf'),))} {sample['count']}")
+                lines.append(f"{name}_sum{format_labels(key)} {format_value(sample['sum'])}")
+                lines.append(f"{name}_count{format_labels(key)} {sample['count']}")
+        return lines
+
+
+# Gauges exported per inventory snapshot: (name, help, resource kind, value function)
+INVENTORY_GAUGES = (
+    ('proxima_node_up', 'Whether the node is online', 'node',
+     lambda node: node.get('status') == 'online'),
+    ('proxima_node_cpu_ratio', 'Node CPU usage (0-1)', 'node', lambda node: node.get('cpu')),
+    ('proxima_node_cpus', 'Number of node CPUs', 'node', lambda node: node.get('maxcpu')),
+    ('proxima_node_memory_used_bytes', 'Node memory in use', 'node', lambda node: node.get('mem')),
+    ('proxima_node_memory_total_bytes', 'Node memory size', 'node', lambda node: node.get('maxmem')),
+    ('proxima_node_uptime_seconds', 'Node uptime', 'node', lambda node: node.get('uptime')),
+    ('proxima_guest_up', 'Whether the guest is running', 'guest',
+     lambda guest: guest.get('status') == 'running'),
+    ('proxima_guest_cpu_ratio', 'Guest CPU usage relative to its vCPUs (0-1)', 'guest', lambda guest: guest.get('cpu')),
+    ('proxima_guest_cpus', 'Number of guest vCPUs', 'guest', lambda guest: guest.get('maxcpu')),
+    ('proxima_guest_memory_used_bytes', 'Guest memory in use', 'guest', lambda guest: guest.get('mem')),
+    ('proxima_guest_memory_total_bytes', 'Guest memory size', 'guest', lambda guest: guest.get('maxmem')),
+    ('proxima_guest_disk_used_bytes', 'Guest filesystem usage (containers only)', 'guest', lambda guest: guest.get('disk')),
+    ('proxima_guest_disk_total_bytes', 'Guest disk size', 'guest', lambda guest: guest.get('maxdisk')),
+    ('proxima_guest_uptime_seconds', 'Guest uptime', 'guest', lambda guest: guest.get('uptime')),
+    ('proxima_storage_up', 'Whether the storage is available', 'storage',
+     lambda storage: storage.get('status') == 'available'),
+    ('proxima_storage_used_bytes', 'Storage space in use', 'storage', lambda storage: storage.get('disk')),
+    ('proxima_storage_total_bytes', 'Storage size', 'storage', lambda storage: storage.get('maxdisk')),
+)
+
+
+def inventory_labels(host_id, kind, resource):
+    """Label string identifying a node, guest or storage"""
+    if kind == 'node':
+        return format_labels((('host', host_id), ('node', resource.get('node'))))
+    if kind == 'guest':
+        return format_labels((('host', host_id), ('node', resource.get('node')), ('type', resource.get('type')),
+                              ('vmid', resource.get('vmid')), ('name', resource.get('name') or '')))
+    return format_labels((('host', host_id), ('node', resource.get('node')), ('storage', resource.get('storage'))))
+
+
+class InventoryExporter:
+    """Renders fleet gauges from inventory snapshots for the /metrics endpoint.
+
+    Registered as an inventory listener, so each poll renders a host's samples once
+    and scrapes only join pre-rendered lines; a scrape never calls Proxmox. The
+    joined output is cached until the next snapshot arrives.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.rendered = None
+
+    def update(self, host_id, snapshot):
+        """Inventory listener: pre-render the gauges of one host"""
+        resources = {
+            'node': snapshot['nodes'],
+            'guest': [guest for guest in snapshot['guests'] if guest.get('template') not in (1, '1', True)],
+            'storage': snapshot['storage']
+        }
+        labels = {
+            kind: [inventory_labels(host_id, kind, resource) for resource in items]
+            for kind, items in resources.items()
+        }
+
+        samples = {}
+        for name, _, kind, value_of in INVENTORY_GAUGES:
+            lines = []
+            for resource, label in zip(resources[kind], labels[kind]):
+                value = value_of(resource)
+                if value is not None:
+                    lines.append(f"{name}{label} {format_value(value)}")
+            samples[name] = lines
+
+        with self.lock:
+            self.hosts[host_id] = {'fetched': snapshot['fetched'], 'samples': samples,
+                                   'resources': len(snapshot['resources'])}
+            self.rendered = None
+
+    def forget(self, host_id):
+        with self.lock:
+            self.hosts.pop(host_id, None)
+            self.rendered = None
+
+    def render(self):
+        """Lines of every inventory gauge; snapshot age is computed per scrape"""
+        with self.lock:
+            if self.rendered is None:
+                lines = []
+                for name, help_text, _, _ in INVENTORY_GAUGES:
+                    lines.extend(family_header(name, 'gauge', help_text))
+                    for host in self.hosts.values():
+                        lines.extend(host['samples'][name])
+
+                lines.extend(family_header('proxima_inventory_resources', 'gauge',
+                                           'Resources in the last inventory snapshot'))
+                lines.extend(f"proxima_inventory_resources{format_labels((('host', host_id),))} {host['resources']}"
+                             for host_id, host in self.hosts.items())
+                self.rendered = lines
+            rendered = self.rendered
+            fetched = {host_id: host['fetched'] for host_id, host in self.hosts.items()}
+
+        now = time.time()
+        age = family_header('proxima_inventory_age_seconds', 'gauge', 'Age of the last inventory snapshot')
+        age.extend(f"proxima_inventory_age_seconds{format_labels((('host', host_id),))} {round(now - value, 3)}"
+                   for host_id, value in fetched.items())
+        return rendered + age
@@ -0,0 +1,320 @@
+import os
+import socket
+import smtplib
+import threading
+import time
+import logging
+import datetime
+from collections import deque
+from email.message import EmailMessage
+
+import requests
+
+app_logger = logging.getLogger('proxima-ui')
+
+# Alerts arriving within this window (seconds) are sent together as one digest
+NOTIFY_BATCH_WINDOW = int(os.getenv('NOTIFY_BATCH_WINDOW', 30))
+
+# Minimum time between two digests, however many alerts arrive (seconds)
+NOTIFY_MIN_INTERVAL = int(os.getenv('NOTIFY_MIN_INTERVAL', 60))
+
+# Failed digests are retried with exponential backoff, up to this many attempts
+NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', 5))
+NOTIFY_RETRY_DELAY = int(os.getenv('NOTIFY_RETRY_DELAY', 30))
+
+# Digests waiting per sink; the oldest are dropped beyond this
+NOTIFY_QUEUE_SIZE = int(os.getenv('NOTIFY_QUEUE_SIZE', 100))
+
+NOTIFY_TIMEOUT = int(os.getenv('NOTIFY_TIMEOUT', 10))
+
+
+def alert_line(alert):
+    """One-line text rendering of an alert for mail and syslog digests"""
+    state = 'RESOLVED' if alert['status'] == 'resolved' else 'FIRED'
+    return (f"{state} [{alert['level']}] {alert['host_id']} {alert['name']}: "
+            f"{alert['metric']} {alert['value']}% (threshold {alert['threshold']:g}%, peak {alert['peak']}%)")
+
+
+def build_digest(fired, resolved):
+    """Summarize a batch of alert changes as one notification"""
+    hosts = sorted({alert['host_id'] for alert in fired + resolved})
+    summary = f"{len(fired)} alert(s) fired, {len(resolved)} resolved on {len(hosts)} host(s)"
+    return {
+        'generated': time.time(),
+        'summary': summary,
+        'hosts': hosts,
+        'fired': fired,
+        'resolved': resolved,
+        'text': '\n'.join([summary, ''] + [alert_line(alert) for alert in fired + resolved])
+    }
+
+
+class WebhookSink:
+    """POST the digest as JSON to an HTTP endpoint"""
+
+    def __init__(self, url, timeout=NOTIFY_TIMEOUT):
+        self.name = 'webhook'
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, digest):
+        response = requests.post(self.url, json=digest, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class SMTPSink:
+    """Mail the digest as plain text"""
+
+    def __init__(self, host, port, sender, recipients, username=None, password=None,
+                 use_tls=False, timeout=NOTIFY_TIMEOUT):
+        self.name = 'smtp'
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = recipients
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+
+    def send(self, digest):
+        message = EmailMessage()
+        message['Subject'] = f"[Proxima UI] {digest['summary']}"
+        message['From'] = self.sender
+        message['To'] = ', '.join(self.recipients)
+        message['Date'] = datetime.datetime.now(datetime.timezone.utc).strftime('%a, %d %b %Y %H:%M:%S +0000')
+        message.set_content(digest['text'])
+
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or '')
+            smtp.send_message(message)
+
+
+class SyslogSink:
+    """Send the digest as a single RFC 3164 syslog datagram"""
+
+    # user.warning
+    PRIORITY = 1 * 8 + 4
+    MAX_MESSAGE = 2048
+
+    def __init__(self, host, port=514, tag='proxima-ui'):
+        self.name = 'syslog'
+        self.host = host
+        self.port = port
+        self.tag = tag
+
+    def send(self, digest):
+        lines = [alert_line(alert) for alert in digest['fired'] + digest['resolved']]
+        text = '; '.join([digest['summary']] + lines)
+        timestamp = time.strftime('%b %d %H:%M:%S')
+        payload = f"<{self.PRIORITY}>{timestamp} {socket.gethostname()} {self.tag}: {text}"
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(payload.encode()[:self.MAX_MESSAGE], (self.host, self.port))
+
+
+def sinks_from_env():
+    """Build the configured notification sinks from NOTIFY_* environment variables"""
+    sinks = []
+
+    if os.getenv('NOTIFY_WEBHOOK_URL'):
+        sinks.append(WebhookSink(os.getenv('NOTIFY_WEBHOOK_URL')))
+
+    if os.getenv('NOTIFY_SMTP_HOST') and os.getenv('NOTIFY_SMTP_TO'):
+        sinks.append(SMTPSink(
+            os.getenv('NOTIFY_SMTP_HOST'),
+            int(os.getenv('NOTIFY_SMTP_PORT', 25)),
+            os.getenv('NOTIFY_SMTP_FROM', 'proxima-ui@localhost'),
+            [address.strip() for address in os.getenv('NOTIFY_SMTP_TO').split(',') if address.strip()],
+            username=os.getenv('NOTIFY_SMTP_USER'),
+            password=os.getenv('NOTIFY_SMTP_PASSWORD'),
+            use_tls=os.getenv('NOTIFY_SMTP_TLS', 'False').lower() == 'true'
+        ))
+
+    if os.getenv('NOTIFY_SYSLOG_HOST'):
+        sinks.append(SyslogSink(os.getenv('NOTIFY_SYSLOG_HOST'), int(os.getenv('NOTIFY_SYSLOG_PORT', 514))))
+
+    return sinks
+
+
+class AlertDispatcher:
+    """Batches alert changes into digests and delivers them to every sink in the background.
+
+    enqueue() is registered as an alert engine listener and never blocks on I/O.
+    A worker thread flushes the batch once it is NOTIFY_BATCH_WINDOW seconds old
+    (and at most once per NOTIFY_MIN_INTERVAL), so a cluster-wide event becomes one
+    digest. Each sink has its own retry queue and its own delivery thread, so a slow
+    or failing sink neither delays nor loses digests for the others.
+    """
+
+    def __init__(self, sinks, batch_window=NOTIFY_BATCH_WINDOW, min_interval=NOTIFY_MIN_INTERVAL,
+                 max_attempts=NOTIFY_MAX_ATTEMPTS, retry_delay=NOTIFY_RETRY_DELAY, queue_size=NOTIFY_QUEUE_SIZE):
+        self.sinks = list(sinks)
+        self.batch_window = batch_window
+        self.min_interval = min_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.queue_size = queue_size
+        self.condition = threading.Condition()
+        self.fired = {}
+        self.resolved = {}
+        self.batch_started = None
+        self.last_flush = 0
+        self.queues = {sink.name: deque() for sink in self.sinks}
+        # The entry each sink is sending right now; it is always the head of that sink's queue
+        self.sending = {sink.name: None for sink in self.sinks}
+        self.stats = {sink.name: {'sent': 0, 'failed': 0, 'dropped': 0, 'last_error': None, 'last_sent': None}
+                      for sink in self.sinks}
+        self.threads = []
+        self.stop_event = threading.Event()
+
+    def enqueue(self, host_id, fired, resolved, active):
+        """Alert engine listener: add alert changes to the current batch"""
+        if not self.sinks:
+            return
+        with self.condition:
+            for alert in fired:
+                self.fired[alert['id']] = alert
+            for alert in resolved:
+                # An alert that fired and cleared within one batch is only reported as resolved
+                self.fired.pop(alert['id'], None)
+                self.resolved[alert['id']] = alert
+            if self.batch_started is None:
+                self.batch_started = time.time()
+            self.condition.notify_all()
+
+    def _take_batch(self, now):
+        # Callers hold self.condition
+        if self.batch_started is None or now - self.batch_started < self.batch_window:
+            return None
+        if now - self.last_flush < self.min_interval:
+            return None
+
+        digest = build_digest(list(self.fired.values()), list(self.resolved.values()))
+        self.fired, self.resolved = {}, {}
+        self.batch_started = None
+        self.last_flush = now
+        return digest
+
+    def _queue_digest(self, digest):
+        # Callers hold self.condition
+        for sink in self.sinks:
+            queue = self.queues[sink.name]
+            sending = self.sending[sink.name] is not None
+            # The oldest waiting digest makes room; the one being sent stays until its delivery is done
+            if len(queue) > sending and len(queue) - sending >= self.queue_size:
+                del queue[1 if sending else 0]
+                self.stats[sink.name]['dropped'] += 1
+            queue.append({'digest': digest, 'attempts': 0, 'next_attempt': 0})
+
+    def _remove(self, queue, entry):
+        # Callers hold self.condition
+        if queue and queue[0] is entry:
+            queue.popleft()
+
+    def _deliver(self, sink, now):
+        """Send every due digest queued for one sink, stopping at the first failure"""
+        while True:
+            with self.condition:
+                queue = self.queues[sink.name]
+                if not queue or queue[0]['next_attempt'] > now:
+                    return
+                entry = self.sending[sink.name] = queue[0]
+
+            try:
+                sink.send(entry['digest'])
+            except Exception as e:
+                with self.condition:
+                    self.sending[sink.name] = None
+                    stats = self.stats[sink.name]
+                    stats['failed'] += 1
+                    stats['last_error'] = str(e)
+                    entry['attempts'] += 1
+                    if entry['attempts'] >= self.max_attempts:
+                        self._remove(queue, entry)
+                        stats['dropped'] += 1
+                        app_logger.error(f"Dropping alert digest for {sink.name} after {entry['attempts']} attempts: {str(e)}")
+                    else:
+                        entry['next_attempt'] = now + self.retry_delay * 2 ** (entry['attempts'] - 1)
+                        app_logger.warning(f"Alert digest delivery to {sink.name} failed, will retry: {str(e)}")
+                return
+
+            with self.condition:
+                self.sending[sink.name] = None
+                self._remove(queue, entry)
+                self.stats[sink.name]['sent'] += 1
+                self.stats[sink.name]['last_sent'] = time.time()
+
+    def flush(self, now=None):
+        """Turn the batch into a digest for every sink's queue if it is due"""
+        now = now or time.time()
+        with self.condition:
+            digest = self._take_batch(now)
+            if digest is not None:
+                self._queue_digest(digest)
+                app_logger.info(f"Dispatching alert digest: {digest['summary']}")
+                self.condition.notify_all()
+
+    def run_once(self, now=None):
+        """Flush the batch if it is due and deliver queued digests in the calling thread"""
+        now = now or time.time()
+        self.flush(now)
+        for sink in self.sinks:
+            self._deliver(sink, now)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.flush()
+            except Exception as e:
+                app_logger.error(f"Alert dispatcher error: {str(e)}")
+            with self.condition:
+                self.condition.wait(1)
+
+    def _run_sink(self, sink):
+        # Woken by new digests; otherwise rechecks once a second for retries coming due
+        while not self.stop_event.is_set():
+            try:
+                self._deliver(sink, time.time())
+            except Exception as e:
+                app_logger.error(f"Alert delivery to {sink.name} failed: {str(e)}")
+            with self.condition:
+                self.condition.wait(1)
+
+    def start(self):
+        if self.sinks and not any(thread.is_alive() for thread in self.threads):
+            self.stop_event.clear()
+            self.threads = [threading.Thread(target=self._run, daemon=True)]
+            self.threads += [threading.Thread(target=self._run_sink, args=(sink,), daemon=True) for sink in self.sinks]
+            for thread in self.threads:
+                thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+
+    def send_test(self):
+        """Queue a test digest for every sink, bypassing batching"""
+        alert = {
+            'id': 'test', 'host_id': 'test', 'resource': 'node/test', 'name': 'Test notification',
+            'metric': 'cpu', 'level': 'warning', 'threshold': 80.0, 'value': 0.0, 'peak': 0.0,
+            'status': 'active', 'started': time.time(), 'last_seen': time.time(), 'resolved': None
+        }
+        with self.condition:
+            self._queue_digest(build_digest([alert], []))
+            self.condition.notify_all()
+
+    def status(self):
+        with self.condition:
+            return {
+                'sinks': [sink.name for sink in self.sinks],
+                'pending_alerts': len(self.fired) + len(self.resolved),
+                'queued': {name: len(queue) for name, queue in self.queues.items()},
+                'stats': {name: dict(stats) for name, stats in self.stats.items()},
+                'batch_window': self.batch_window,
+                'min_interval': self.min_interval
+            }
@@ -0,0 +1,385 @@
+import os
+import io
+import time
+import uuid
+import heapq
+import pstats
+import cProfile
+import threading
+import logging
+from collections import deque
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+app_logger = logging.getLogger('proxima-ui')
+
+# Number of slowest requests (with their upstream calls) kept for the profiler page
+PROFILER_SLOW_REQUESTS = int(os.getenv('PROFILER_SLOW_REQUESTS', 50))
+
+# Upstream calls recorded per request; anything beyond is only counted
+PROFILER_CALLS_PER_REQUEST = int(os.getenv('PROFILER_CALLS_PER_REQUEST', 200))
+
+# Set to true to allow ?profile=1 (cProfile) or ?profile=pyinstrument to capture a profile of one request;
+# off by default because any client could otherwise trigger a profile run
+PROFILER_ALLOW_CAPTURE = os.getenv('PROFILER_ALLOW_CAPTURE', 'False').lower() == 'true'
+PROFILER_KEPT_PROFILES = int(os.getenv('PROFILER_KEPT_PROFILES', 20))
+
+# Share identical GET responses within a request and between concurrent callers
+UPSTREAM_COALESCE_GETS = os.getenv('UPSTREAM_COALESCE_GETS', 'True').lower() == 'true'
+
+# Task status and logs are polled on purpose and are never memoized
+COALESCE_EXCLUDED_PATHS = ('/tasks/',)
+
+# The request trace upstream calls are attributed to; parallel_map copies it into its workers
+current_trace = ContextVar('proxima_request_trace', default=None)
+
+# Path segments following these collections are IDs and are folded into one placeholder
+PATH_PARAMETERS = {
+    'nodes': '{node}', 'qemu': '{vmid}', 'lxc': '{vmid}', 'storage': '{storage}',
+    'tasks': '{upid}', 'snapshot': '{snapname}', 'content': '{volume}', 'users': '{userid}',
+    'groups': '{group}', 'roles': '{roleid}', 'pools': '{poolid}', 'rules': '{pos}',
+    'ipset': '{name}', 'aliases': '{name}', 'backup': '{id}', 'domains': '{realm}', 'acl': '{path}'
+}
+
+
+def normalize_path(url):
+    """Turn a Proxmox API URL into a low-cardinality template, e.g. nodes/{node}/qemu/{vmid}/status/current"""
+    path = urlsplit(url).path
+    if '/api2/' in path:
+        # Drop the /api2/json prefix
+        path = path.split('/api2/', 1)[1].split('/', 1)[-1]
+
+    segments = []
+    previous = None
+    for segment in path.strip('/').split('/'):
+        if previous in PATH_PARAMETERS:
+            segment = PATH_PARAMETERS[previous]
+        elif segment.isdigit():
+            segment = '{id}'
+        segments.append(segment)
+        previous = segment if not segment.startswith('{') else None
+    return '/'.join(segments)
+
+
+def instrument_connection(connection, host_id, profiler, coalescer=None):
+    """Time every HTTP request a proxmoxer connection makes and report it to the profiler.
+
+    With a coalescer, identical GETs are answered from the request memo or share
+    a call already in flight instead of hitting the API again.
+    """
+    session = connection._store.get('session')
+    if session is None or getattr(session, 'proxima_instrumented', False):
+        return connection
+
+    send = session.request
+
+    def timed_request(method, url, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = send(method, url, *args, **kwargs)
+        except Exception as e:
+            profiler.record_call(host_id, method, url, time.perf_counter() - started, 0, 'error', str(e))
+            raise
+        error = f"HTTP {response.status_code}" if response.status_code >= 400 else None
+        profiler.record_call(host_id, method, url, time.perf_counter() - started,
+                             len(response.content or b''), response.status_code, error)
+        return response
+
+    def coalesced_request(method, url, *args, **kwargs):
+        if method != 'GET':
+            # A write may change anything read from the host, until it has completed
+            coalescer.invalidate(host_id)
+            try:
+                return timed_request(method, url, *args, **kwargs)
+            finally:
+                coalescer.invalidate(host_id)
+        return coalescer.fetch(host_id, url, kwargs.get('params'),
+                               lambda: timed_request(method, url, *args, **kwargs))
+
+    session.request = coalesced_request if coalescer is not None and UPSTREAM_COALESCE_GETS else timed_request
+    session.proxima_instrumented = True
+    return connection
+
+
+def start_capture(mode):
+    """Start a cProfile or pyinstrument profiler; returns (kind, profiler)"""
+    if mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+            return 'pyinstrument', profiler
+        except ImportError:
+            app_logger.warning("pyinstrument is not installed, falling back to cProfile")
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return 'cprofile', profiler
+
+
+def stop_capture(kind, profiler):
+    """Stop a profiler started by start_capture() and return its text report"""
+    if kind == 'pyinstrument':
+        profiler.stop()
+        return profiler.output_text(unicode=True, color=False)
+
+    profiler.disable()
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(60)
+    return output.getvalue()
+
+
+class RouteProfiler:
+    """Aggregates route timings and the upstream Proxmox calls each request triggers.
+
+    begin()/finish() bracket a request and bind a trace to current_trace, so calls
+    made through an instrumented connection (including those fanned out by
+    parallel_map) are attributed to the route. Per-route and per-upstream-path
+    totals feed the profiler page; latencies also go into the metrics registry.
+    """
+
+    def __init__(self, registry, slow_requests=PROFILER_SLOW_REQUESTS, calls_per_request=PROFILER_CALLS_PER_REQUEST):
+        self.registry = registry
+        self.slow_requests = slow_requests
+        self.calls_per_request = calls_per_request
+        self.lock = threading.Lock()
+        self.capture_lock = threading.Lock()
+        self.routes = {}
+        self.upstream = {}
+        self.slowest = []
+        self.profiles = deque(maxlen=PROFILER_KEPT_PROFILES)
+        self.since = time.time()
+        self.sequence = 0
+
+        registry.counter('proxima_upstream_requests_total', 'HTTP requests made to Proxmox hosts')
+        registry.histogram('proxima_upstream_request_duration_seconds', 'Latency of Proxmox API calls, by path template')
+        registry.counter('proxima_upstream_response_bytes_total', 'Response bytes received from Proxmox hosts')
+        registry.counter('proxima_upstream_errors_total', 'Failed Proxmox API calls')
+
+    def begin(self, endpoint, method, path, capture=None):
+        """Start tracing a request; capture names a profiler to run for it"""
+        trace = {
+            'id': uuid.uuid4().hex,
+            'endpoint': endpoint or 'unknown',
+            'method': method,
+            'path': path,
+            'started': time.time(),
+            'perf_started': time.perf_counter(),
+            'duration': None,
+            'status': None,
+            'calls': [],
+            'call_count': 0,
+            'upstream_time': 0.0,
+            'saved_calls': 0,
+            'memo': {},
+            'capture': None
+        }
+
+        if capture and PROFILER_ALLOW_CAPTURE:
+            # One capture at a time keeps profiling overhead off concurrent requests
+            if self.capture_lock.acquire(blocking=False):
+                try:
+                    trace['capture'] = start_capture(capture)
+                except Exception as e:
+                    self.capture_lock.release()
+                    app_logger.warning(f"Could not start profiler: {str(e)}")
+
+        current_trace.set(trace)
+        return trace
+
+    def record_call(self, host_id, method, url, duration, size, status, error=None):
+        path = normalize_path(url)
+        self.registry.inc('proxima_upstream_requests_total', host=host_id, method=method, status=status)
+        self.registry.observe('proxima_upstream_request_duration_seconds', duration, host=host_id, method=method, path=path)
+        self.registry.inc('proxima_upstream_response_bytes_total', size, host=host_id)
+        if error:
+            self.registry.inc('proxima_upstream_errors_total', host=host_id, method=method, path=path)
+
+        trace = current_trace.get()
+        with self.lock:
+            stats = self.upstream.setdefault((host_id, method, path), {
+                'host_id': host_id, 'method': method, 'path': path,
+                'count': 0, 'total': 0.0, 'max': 0.0, 'bytes': 0, 'errors': 0, 'routes': set()
+            })
+            stats['count'] += 1
+            stats['total'] += duration
+            stats['max'] = max(stats['max'], duration)
+            stats['bytes'] += size
+            stats['errors'] += 1 if error else 0
+
+            if trace is not None:
+                stats['routes'].add(trace['endpoint'])
+                trace['call_count'] += 1
+                trace['upstream_time'] += duration
+                if len(trace['calls']) < self.calls_per_request:
+                    trace['calls'].append({
+                        'host_id': host_id, 'method': method, 'url': urlsplit(url).path,
+                        'duration': duration, 'bytes': size, 'status': status, 'error': error,
+                        'offset': time.perf_counter() - duration - trace['perf_started']
+                    })
+
+    def finish(self, trace, status):
+        """Close a request trace and fold it into the aggregates; returns the profile id if one was captured"""
+        current_trace.set(None)
+        trace['duration'] = time.perf_counter() - trace['perf_started']
+        trace['status'] = status
+        trace['memo'] = {}
+
+        profile_id = None
+        if trace['capture']:
+            try:
+                trace['profile'] = stop_capture(*trace['capture'])
+                trace['profile_kind'] = trace['capture'][0]
+                profile_id = trace['id']
+            except Exception as e:
+                app_logger.warning(f"Could not collect profile: {str(e)}")
+            finally:
+                trace['capture'] = None
+                self.capture_lock.release()
+
+        with self.lock:
+            stats = self.routes.setdefault(trace['endpoint'], {
+                'endpoint': trace['endpoint'], 'count': 0, 'total': 0.0, 'max': 0.0,
+                'errors': 0, 'upstream_calls': 0, 'upstream_time': 0.0, 'saved_calls': 0
+            })
+            stats['count'] += 1
+            stats['total'] += trace['duration']
+            stats['max'] = max(stats['max'], trace['duration'])
+            stats['errors'] += 1 if status >= 500 else 0
+            stats['upstream_calls'] += trace['call_count']
+            stats['upstream_time'] += trace['upstream_time']
+            stats['saved_calls'] += trace['saved_calls']
+
+            # Min-heap of the slowest requests seen so far
+            self.sequence += 1
+            entry = (trace['duration'], self.sequence, trace)
+            if len(self.slowest) < self.slow_requests:
+                heapq.heappush(self.slowest, entry)
+            elif trace['duration'] > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+            if profile_id:
+                self.profiles.appendleft(trace)
+
+        return profile_id
+
+    def get_profile(self, profile_id):
+        with self.lock:
+            for trace in self.profiles:
+                if trace['id'] == profile_id:
+                    return trace
+        return None
+
+    def report(self):
+        """Route and upstream aggregates, slowest first, for the profiler page"""
+        with self.lock:
+            routes = [
+                dict(stats, average=stats['total'] / stats['count'],
+                     calls_per_request=stats['upstream_calls'] / stats['count'])
+                for stats in self.routes.values()
+            ]
+            upstream = [
+                dict(stats, average=stats['total'] / stats['count'], routes=sorted(stats['routes']))
+                for stats in self.upstream.values()
+            ]
+            slowest = [dict(trace, calls=list(trace['calls'])) for _, _, trace in sorted(self.slowest, reverse=True)]
+            profiles = [
+                {key: trace[key] for key in ('id', 'endpoint', 'method', 'path', 'started', 'duration', 'profile_kind')}
+                for trace in self.profiles
+            ]
+
+        return {
+            'since': self.since,
+            'routes': sorted(routes, key=lambda stats: stats['total'], reverse=True),
+            'upstream': sorted(upstream, key=lambda stats: stats['total'], reverse=True),
+            'slowest': slowest,
+            'profiles': profiles
+        }
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+            self.upstream.clear()
+            self.slowest = []
+            self.since = time.time()
+
+
+class CallCoalescer:
+    """De-duplicates identical Proxmox GETs.
+
+    Within a request, responses are memoized on the request trace, so a route that
+    reads nodes.get() twice makes one call; any write to the host clears that
+    request's memo. Across threads, a GET identical to one already in flight waits
+    for it and shares its response instead of issuing a second call, unless a write
+    to the host started or finished since that call went out. Responses are never
+    kept beyond the request, so there is no staleness beyond that.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.writes = {}
+
+        registry.counter('proxima_upstream_coalesced_total', 'Proxmox GETs answered without a new API call, by scope')
+
+    def _saved(self, host_id, scope, trace):
+        self.registry.inc('proxima_upstream_coalesced_total', host=host_id, scope=scope)
+        if trace is not None:
+            with self.lock:
+                trace['saved_calls'] += 1
+
+    def fetch(self, host_id, url, params, send):
+        """Return the response of a GET, issuing send() only if no identical call can be reused"""
+        if any(excluded in url for excluded in COALESCE_EXCLUDED_PATHS):
+            return send()
+
+        key = (host_id, url, repr(sorted((params or {}).items())))
+        trace = current_trace.get()
+        memo = trace['memo'] if trace is not None else None
+
+        with self.lock:
+            memoized = memo.get(key) if memo is not None else None
+        if memoized is not None:
+            self._saved(host_id, 'request', trace)
+            return memoized
+
+        with self.lock:
+            # A flight that went out before the host's latest write may have missed it
+            flight_key = key + (self.writes.get(host_id, 0),)
+            flight = self.in_flight.get(flight_key)
+            leader = flight is None
+            if leader:
+                flight = self.in_flight[flight_key] = {'done': threading.Event(), 'response': None, 'error': None}
+
+        if leader:
+            try:
+                flight['response'] = send()
+            except Exception as e:
+                flight['error'] = e
+                raise
+            finally:
+                with self.lock:
+                    del self.in_flight[flight_key]
+                flight['done'].set()
+        else:
+            flight['done'].wait()
+            self._saved(host_id, 'in_flight', trace)
+            if flight['error'] is not None:
+                raise flight['error']
+
+        response = flight['response']
+        # Errors are not memoized so a retry within the request really retries
+        if memo is not None and response.status_code < 400:
+            with self.lock:
+                memo[key] = response
+        return response
+
+    def invalidate(self, host_id):
+        """Forget what the current request has read from a host and stop later GETs joining earlier ones"""
+        trace = current_trace.get()
+        with self.lock:
+            self.writes[host_id] = self.writes.get(host_id, 0) + 1
+            if trace is not None:
+                for key in [key for key in trace['memo'] if key[0] == host_id]:
+                    del trace['memo'][key]
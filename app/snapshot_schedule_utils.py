@@ -0,0 +1,360 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import calendar
+import datetime
+import threading
+import logging
+
+from task_utils import BulkJob, register_job, wait_for_task, task_succeeded
+from inventory_utils import select_guests
+from snapshot_utils import guest_api, valid_snapshot_name, resolve_snapshot_storages
+
+app_logger = logging.getLogger('proxima-ui')
+
+# Where snapshot policies are kept between restarts
+SNAPSHOT_SCHEDULE_FILE = os.getenv('SNAPSHOT_SCHEDULE_FILE', 'snapshot_schedules.json')
+
+# How often due policies are looked for (seconds)
+SNAPSHOT_SCHEDULE_CHECK_INTERVAL = int(os.getenv('SNAPSHOT_SCHEDULE_CHECK_INTERVAL', 30))
+
+# Snapshots due in the same check are spread evenly over this window (seconds),
+# so guests sharing a storage don't all snapshot at the same moment
+SNAPSHOT_SCHEDULE_JITTER = int(os.getenv('SNAPSHOT_SCHEDULE_JITTER', 300))
+
+# Scheduled snapshot operations running at once per host, per storage and per node
+SNAPSHOT_SCHEDULE_WORKERS = int(os.getenv('SNAPSHOT_SCHEDULE_WORKERS', 4))
+SNAPSHOT_SCHEDULE_MAX_PER_STORAGE = int(os.getenv('SNAPSHOT_SCHEDULE_MAX_PER_STORAGE', 1))
+SNAPSHOT_SCHEDULE_MAX_PER_NODE = int(os.getenv('SNAPSHOT_SCHEDULE_MAX_PER_NODE', 2))
+
+# Longest a single snapshot create or delete task may take (seconds)
+SNAPSHOT_SCHEDULE_TASK_TIMEOUT = int(os.getenv('SNAPSHOT_SCHEDULE_TASK_TIMEOUT', 3600))
+
+SCHEDULE_TYPES = ('hourly', 'daily', 'weekly', 'monthly')
+
+# Appended to a policy's name prefix; sorts by time and keeps names within Proxmox's 40 characters
+SNAPSHOT_STAMP_FORMAT = '%Y%m%d%H%M'
+SNAPSHOT_STAMP_PATTERN = re.compile(r'^\d{12}$')
+
+
+def add_interval(timestamp, schedule_type, schedule_value):
+    """The time schedule_value hours, days, weeks or months after timestamp"""
+    moment = datetime.datetime.fromtimestamp(timestamp)
+    if schedule_type == 'hourly':
+        moment += datetime.timedelta(hours=schedule_value)
+    elif schedule_type == 'daily':
+        moment += datetime.timedelta(days=schedule_value)
+    elif schedule_type == 'weekly':
+        moment += datetime.timedelta(weeks=schedule_value)
+    else:
+        # Months differ in length; the 31st becomes the last day of shorter months
+        month = moment.month - 1 + schedule_value
+        year = moment.year + month // 12
+        month = month % 12 + 1
+        moment = moment.replace(year=year, month=month, day=min(moment.day, calendar.monthrange(year, month)[1]))
+    return moment.timestamp()
+
+
+def next_run_after(policy, now):
+    """The first slot of a policy after now; slots missed while the app was down are skipped"""
+    next_run = policy['next_run']
+    while next_run <= now:
+        next_run = add_interval(next_run, policy['schedule_type'], policy['schedule_value'])
+    return next_run
+
+
+def policy_snapshot_name(policy, now):
+    return policy['name_prefix'] + datetime.datetime.fromtimestamp(now).strftime(SNAPSHOT_STAMP_FORMAT)
+
+
+def policy_owns(policy, name):
+    """Whether a snapshot was created by a policy (<prefix><timestamp>); manual snapshots never are"""
+    prefix = policy['name_prefix']
+    return name.startswith(prefix) and SNAPSHOT_STAMP_PATTERN.match(name[len(prefix):]) is not None
+
+
+def expired_snapshots(policy, snapshots, now):
+    """A policy's snapshots of one guest that fall outside its retention, oldest first.
+
+    Beyond the newest 'retention' snapshots and those older than 'max_age_days' are
+    expired; the newest snapshot is always kept.
+    """
+    owned = sorted((snapshot for snapshot in snapshots
+                    if snapshot.get('name') != 'current' and policy_owns(policy, snapshot.get('name', ''))),
+                   key=lambda snapshot: snapshot.get('snaptime') or 0, reverse=True)
+    retention = policy.get('retention')
+    max_age = policy['max_age_days'] * 86400 if policy.get('max_age_days') else None
+
+    expired = []
+    for position, snapshot in enumerate(owned[1:], start=1):
+        if (retention and position >= retention) or \
+                (max_age and snapshot.get('snaptime') and now - snapshot['snaptime'] > max_age):
+            expired.append(snapshot)
+    return list(reversed(expired))
+
+
+def spread_starts(items, start, window):
+    """Give items start times spread evenly over window, in a stable per-guest order"""
+    ordered = sorted(items, key=lambda item: hashlib.sha1(f"{item['policy_id']}:{item['vmid']}".encode()).hexdigest())
+    for position, item in enumerate(ordered):
+        item['not_before'] = start + window * position / len(ordered)
+    return sorted(ordered, key=lambda item: item['not_before'])
+
+
+class SnapshotScheduler:
+    """Runs snapshot policies and prunes their snapshots by retention.
+
+    A policy snapshots every guest its selector matches (explicit VMIDs and/or node,
+    type, tag and pool) every schedule_value hours/days/weeks/months and keeps the
+    newest 'retention' of its own snapshots and/or those younger than 'max_age_days'.
+    Policies are persisted to SNAPSHOT_SCHEDULE_FILE.
+
+    Each check gathers a host's due policies into one BulkJob: one item per guest,
+    started at offsets spread over SNAPSHOT_SCHEDULE_JITTER and limited per storage
+    and per node. An item prunes its guest right after the snapshot is taken, while
+    it still holds the guest's slot.
+    """
+
+    def __init__(self, connections, inventory, snapshot_inventory, schedules_file=SNAPSHOT_SCHEDULE_FILE,
+                 jitter=SNAPSHOT_SCHEDULE_JITTER, workers=SNAPSHOT_SCHEDULE_WORKERS):
+        self.connections = connections
+        self.inventory = inventory
+        self.snapshot_inventory = snapshot_inventory
+        self.schedules_file = schedules_file
+        self.jitter = jitter
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.policies = {}
+        self.running = {}
+        self._load()
+
+    def _load(self):
+        try:
+            if self.schedules_file and os.path.exists(self.schedules_file):
+                with open(self.schedules_file, 'r') as f:
+                    self.policies = {policy['id']: policy for policy in json.load(f)}
+        except Exception as e:
+            app_logger.error(f"Error loading snapshot schedules: {str(e)}")
+
+    def _save(self):
+        # Callers hold self.lock
+        if not self.schedules_file:
+            return
+        try:
+            with open(self.schedules_file, 'w') as f:
+                json.dump(list(self.policies.values()), f, indent=2)
+        except Exception as e:
+            app_logger.error(f"Error saving snapshot schedules: {str(e)}")
+
+    def _view(self, policy):
+        # Callers hold self.lock
+        return dict(policy, running_job=self.running.get(policy['id']))
+
+    def list(self, host_id=None, guest_type=None, vmid=None):
+        """Policies, optionally of one host and naming one guest explicitly, next run first"""
+        with self.lock:
+            policies = [
+                self._view(policy) for policy in self.policies.values()
+                if (host_id is None or policy['host_id'] == host_id)
+                and (guest_type is None or policy['selector'].get('guest_type') == guest_type)
+                and (vmid is None or int(vmid) in policy['selector'].get('vmids', []))
+            ]
+        return sorted(policies, key=lambda policy: policy['next_run'])
+
+    def get(self, policy_id):
+        with self.lock:
+            policy = self.policies.get(policy_id)
+            return self._view(policy) if policy else None
+
+    def create(self, host_id, name_prefix, schedule_type='daily', schedule_value=1, retention=None,
+               max_age_days=None, include_ram=False, description='', vmids=None, guest_type=None,
+               node=None, tag=None, pool=None):
+        """Validate and store a new policy; raises ValueError on bad input"""
+        if schedule_type not in SCHEDULE_TYPES:
+            raise ValueError(f"Frequency must be one of {', '.join(SCHEDULE_TYPES)}")
+        if int(schedule_value) < 1:
+            raise ValueError("Interval must be at least 1")
+        if not valid_snapshot_name(policy_snapshot_name({'name_prefix': name_prefix}, time.time())):
+            raise ValueError("Name prefixes must start with a letter, contain only letters, digits, - and _ "
+                             "and be at most 28 characters long")
+        if not retention and not max_age_days:
+            raise ValueError("Give a number of snapshots to keep and/or a maximum age")
+
+        now = time.time()
+        policy = {
+            'id': uuid.uuid4().hex,
+            'host_id': host_id,
+            'name_prefix': name_prefix,
+            'description': description,
+            'schedule_type': schedule_type,
+            'schedule_value': int(schedule_value),
+            'retention': int(retention) if retention else None,
+            'max_age_days': float(max_age_days) if max_age_days else None,
+            'include_ram': bool(include_ram),
+            'enabled': True,
+            'selector': {
+                'vmids': sorted(int(vmid) for vmid in vmids) if vmids else [],
+                'guest_type': guest_type,
+                'node': node,
+                'tag': tag,
+                'pool': pool
+            },
+            'created': now,
+            'next_run': add_interval(now, schedule_type, int(schedule_value)),
+            'last_run': None,
+            'last_result': None
+        }
+        with self.lock:
+            # Policies recognise their snapshots by prefix, so two sharing one would prune each other's
+            if any(other['host_id'] == host_id and other['name_prefix'] == name_prefix for other in self.policies.values()):
+                raise ValueError(f"Another policy on this host already uses the prefix '{name_prefix}'")
+            self.policies[policy['id']] = policy
+            self._save()
+            return self._view(policy)
+
+    def set_enabled(self, policy_id, enabled):
+        with self.lock:
+            policy = self.policies.get(policy_id)
+            if policy is None:
+                return None
+            policy['enabled'] = bool(enabled)
+            if enabled:
+                # A policy switched back on resumes with its next slot rather than catching up
+                policy['next_run'] = next_run_after(policy, time.time())
+            self._save()
+            return self._view(policy)
+
+    def delete(self, policy_id):
+        with self.lock:
+            policy = self.policies.pop(policy_id, None)
+            if policy is not None:
+                self._save()
+            return policy
+
+    def forget(self, host_id):
+        """Drop the policies of a removed host"""
+        with self.lock:
+            for policy_id in [policy_id for policy_id, policy in self.policies.items() if policy['host_id'] == host_id]:
+                del self.policies[policy_id]
+            self._save()
+
+    def run_once(self, now=None):
+        """Start a run for every host with due policies; a policy still running skips its slot"""
+        now = now or time.time()
+        due = {}
+        with self.lock:
+            for policy in self.policies.values():
+                if not policy['enabled'] or policy['next_run'] > now:
+                    continue
+                if policy['id'] in self.running:
+                    app_logger.warning(f"Snapshot policy {policy['name_prefix']} ({policy['id']}) is still running, skipping this slot")
+                else:
+                    due.setdefault(policy['host_id'], []).append(policy)
+                policy['next_run'] = next_run_after(policy, now)
+            if due:
+                self._save()
+
+        for host_id, policies in due.items():
+            try:
+                self._start_run(host_id, policies, now, self.jitter)
+            except Exception as e:
+                app_logger.error(f"Failed to start snapshot policies on {host_id}: {str(e)}")
+                self._record(policies, now, {'error': str(e)})
+
+    def run_now(self, policy_id):
+        """Run one policy immediately, outside its schedule; returns the job or None"""
+        with self.lock:
+            policy = self.policies.get(policy_id)
+            if policy is None or policy_id in self.running:
+                return None
+        return self._start_run(policy['host_id'], [policy], time.time(), 0)
+
+    def _record(self, policies, now, result):
+        with self.lock:
+            for policy in policies:
+                if policy['id'] in self.policies:
+                    policy['last_run'] = now
+                    policy['last_result'] = result
+                self.running.pop(policy['id'], None)
+            self._save()
+
+    def _start_run(self, host_id, policies, now, jitter):
+        connection = self.connections[host_id]['connection']
+        snapshot = self.inventory.get_snapshot(host_id)
+
+        items = []
+        for policy in policies:
+            selector = policy['selector']
+            guests = select_guests(snapshot, selector.get('vmids'), node=selector.get('node'),
+                                   guest_type=selector.get('guest_type'), tag=selector.get('tag'),
+                                   pool=selector.get('pool'))
+            snapname = policy_snapshot_name(policy, now)
+            items.extend({
+                'label': f"{snapname} of {guest.get('name') or guest['vmid']} ({guest['type']} {guest['vmid']})",
+                'policy_id': policy['id'],
+                'node': guest['node'],
+                'type': guest['type'],
+                'vmid': int(guest['vmid']),
+                'snapname': snapname,
+                'phase': 'waiting',
+                'pruned': [],
+                'keys': [('node', guest['node']), ('guest', int(guest['vmid']))]
+            } for guest in guests)
+
+        if not items:
+            self._record(policies, now, {'guests': 0, 'created': 0, 'pruned': 0, 'failed': 0})
+            return None
+
+        policies_by_id = {policy['id']: policy for policy in policies}
+
+        def run_policy(item):
+            policy = policies_by_id[item['policy_id']]
+            api = guest_api(connection, item['type'], item['node'], item['vmid'])
+            params = {'snapname': item['snapname'], 'description': policy['description']}
+            if policy['include_ram'] and item['type'] == 'qemu':
+                params['vmstate'] = 1
+            job.update_item(item, phase='snapshotting')
+            item['upid'] = api.snapshot.post(**params)
+            status = wait_for_task(connection, item['node'], item['upid'], timeout=SNAPSHOT_SCHEDULE_TASK_TIMEOUT)
+            if not task_succeeded(status):
+                raise Exception(f"Snapshot task failed: {status.get('exitstatus', 'unknown error')}")
+
+            # A failed snapshot leaves the old ones alone; pruning only follows a new one
+            expired = expired_snapshots(policy, api.snapshot.get(), time.time())
+            job.update_item(item, phase='pruning' if expired else 'created')
+            for snapshot in expired:
+                upid = api.snapshot(snapshot['name']).delete()
+                status = wait_for_task(connection, item['node'], upid, timeout=SNAPSHOT_SCHEDULE_TASK_TIMEOUT)
+                if not task_succeeded(status):
+                    raise Exception(f"Pruning {snapshot['name']} failed: {status.get('exitstatus', 'unknown error')}")
+                item['pruned'].append(snapshot['name'])
+            job.update_item(item, phase='done')
+
+        def finish(job):
+            for policy in policies:
+                policy_items = [item for item in job.items if item['policy_id'] == policy['id']]
+                self._record([policy], now, {
+                    'job_id': job.id,
+                    'guests': len(policy_items),
+                    'created': sum(1 for item in policy_items if item['phase'] in ('pruning', 'created', 'done')),
+                    'pruned': sum(len(item['pruned']) for item in policy_items),
+                    'failed': sum(1 for item in policy_items if item['status'] != 'success'),
+                    'errors': [f"{item['label']}: {item['error']}" for item in policy_items if item['error']][:10]
+                })
+            self.snapshot_inventory.invalidate(host_id)
+
+        job = BulkJob('snapshot_schedule', host_id, spread_starts(items, time.time(), jitter), run_policy,
+                      limits={'storage': SNAPSHOT_SCHEDULE_MAX_PER_STORAGE, 'node': SNAPSHOT_SCHEDULE_MAX_PER_NODE,
+                              'guest': 1},
+                      total_limit=self.workers)
+        with self.lock:
+            for policy in policies:
+                self.running[policy['id']] = job.id
+        register_job(job).start(prepare=resolve_snapshot_storages(connection), finish=finish)
+
+        app_logger.info(f"Started snapshot schedule job {job.id} for {len(policies)} policies and "
+                        f"{len(items)} guests on {host_id} over {jitter}s")
+        return job
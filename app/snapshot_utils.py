@@ -0,0 +1,223 @@
+import os
+import re
+import time
+import fnmatch
+import threading
+import logging
+
+from task_utils import parallel_map
+from inventory_utils import snapshot_guests
+from storage_utils import storage_shared, storage_limit_key
+
+app_logger = logging.getLogger('proxima-ui')
+
+# Concurrent snapshot.get() calls while crawling a host
+SNAPSHOT_CRAWL_WORKERS = int(os.getenv('SNAPSHOT_CRAWL_WORKERS', 16))
+
+# A crawled snapshot index older than this is refreshed when read (seconds)
+SNAPSHOT_INVENTORY_MAX_AGE = int(os.getenv('SNAPSHOT_INVENTORY_MAX_AGE', 300))
+
+# Proxmox snapshot names: a letter followed by letters, digits, '-' or '_'
+SNAPSHOT_NAME_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9_\-]{1,39}$')
+
+# Config keys holding guest disks
+QEMU_DISK_KEY = re.compile(r'^(ide|sata|scsi|virtio|efidisk|tpmstate)\d+$')
+LXC_DISK_KEY = re.compile(r'^(rootfs|mp\d+)$')
+
+
+def valid_snapshot_name(name):
+    return bool(name) and SNAPSHOT_NAME_PATTERN.match(name) is not None
+
+
+def guest_api(connection, guest_type, node, vmid):
+    """The qemu/<vmid> or lxc/<vmid> resource of a guest"""
+    if guest_type == 'qemu':
+        return connection.nodes(node).qemu(vmid)
+    return connection.nodes(node).lxc(vmid)
+
+
+def guest_disk_storages(config, guest_type):
+    """Storages holding a guest's disks, from its config (CD-ROMs and bind mounts excluded)"""
+    disk_key = QEMU_DISK_KEY if guest_type == 'qemu' else LXC_DISK_KEY
+    storages = []
+    for key, value in config.items():
+        if not disk_key.match(key) or not isinstance(value, str) or 'media=cdrom' in value:
+            continue
+        volume = value.split(',', 1)[0]
+        if ':' in volume:
+            storage = volume.split(':', 1)[0]
+            if storage != 'none' and storage not in storages:
+                storages.append(storage)
+    return storages
+
+
+def resolve_snapshot_storages(connection):
+    """BulkJob prepare hook: add the storages each guest's disks live on to its concurrency keys"""
+    def prepare(job):
+        try:
+            shared = {config['storage'] for config in connection.storage.get() if storage_shared(config)}
+        except Exception as e:
+            app_logger.warning(f"Could not read storage config of {job.host_id}: {str(e)}")
+            shared = set()
+
+        guests = list({(item['node'], item['type'], item['vmid']) for item in job.items})
+        storages = {}
+        for (node, guest_type, vmid), config, error in parallel_map(
+                lambda guest: guest_api(connection, guest[1], guest[0], guest[2]).config.get(), guests):
+            if error:
+                app_logger.warning(f"Could not read config of {guest_type} {vmid}: {str(error)}")
+                continue
+            storages[vmid] = guest_disk_storages(config, guest_type)
+
+        for item in job.items:
+            item['storages'] = storages.get(item['vmid'], [])
+            storage_keys = [storage_limit_key(item['node'], storage, shared) for storage in item['storages']]
+            item['keys'] = list(dict.fromkeys(item['keys'] + storage_keys))
+    return prepare
+
+
+def snapshot_entries(host_id, guest, snapshots, now):
+    """Flatten a guest's snapshot.get() listing into index entries"""
+    entries = []
+    for snapshot in snapshots:
+        # 'current' is the running state, not a snapshot
+        if snapshot.get('name') == 'current':
+            continue
+        snaptime = int(snapshot['snaptime']) if snapshot.get('snaptime') else None
+        entries.append({
+            'host_id': host_id,
+            'node': guest.get('node'),
+            'type': guest.get('type'),
+            'vmid': int(guest['vmid']),
+            'guest_name': guest.get('name') or f"{guest.get('type')}-{guest['vmid']}",
+            'name': snapshot.get('name'),
+            'description': (snapshot.get('description') or '').strip(),
+            'parent': snapshot.get('parent'),
+            'vmstate': bool(snapshot.get('vmstate')),
+            'snaptime': snaptime,
+            'age': now - snaptime if snaptime else None
+        })
+    return entries
+
+
+def snapshot_index(entries):
+    """Group snapshot entries by name and by guest with counts and age ranges"""
+    by_name = {}
+    by_guest = {}
+    for entry in entries:
+        name_stats = by_name.setdefault(entry['name'], {'name': entry['name'], 'count': 0, 'oldest': None, 'newest': None})
+        name_stats['count'] += 1
+        if entry['snaptime']:
+            name_stats['oldest'] = min(name_stats['oldest'] or entry['snaptime'], entry['snaptime'])
+            name_stats['newest'] = max(name_stats['newest'] or 0, entry['snaptime'])
+
+        guest_stats = by_guest.setdefault(entry['vmid'], {
+            'vmid': entry['vmid'], 'node': entry['node'], 'type': entry['type'],
+            'guest_name': entry['guest_name'], 'count': 0, 'oldest': None
+        })
+        guest_stats['count'] += 1
+        if entry['snaptime']:
+            guest_stats['oldest'] = min(guest_stats['oldest'] or entry['snaptime'], entry['snaptime'])
+
+    return {
+        'by_name': sorted(by_name.values(), key=lambda stats: stats['count'], reverse=True),
+        'by_guest': sorted(by_guest.values(), key=lambda stats: stats['count'], reverse=True)
+    }
+
+
+class SnapshotInventory:
+    """Fleet-wide index of guest snapshots.
+
+    The guest list comes from the inventory snapshot; each guest's snapshot.get()
+    is then crawled concurrently (SNAPSHOT_CRAWL_WORKERS at a time). The result is
+    kept per host until it is older than SNAPSHOT_INVENTORY_MAX_AGE or invalidated
+    by a snapshot operation.
+    """
+
+    def __init__(self, connections, inventory, max_age=SNAPSHOT_INVENTORY_MAX_AGE, workers=SNAPSHOT_CRAWL_WORKERS):
+        self.connections = connections
+        self.inventory = inventory
+        self.max_age = max_age
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.refresh_locks = {}
+        self.hosts = {}
+
+    def refresh_host(self, host_id):
+        """Crawl the snapshots of every guest on a host; concurrent callers share one crawl"""
+        with self.lock:
+            refresh_lock = self.refresh_locks.setdefault(host_id, threading.Lock())
+            before = self.hosts.get(host_id)
+
+        with refresh_lock:
+            with self.lock:
+                current = self.hosts.get(host_id)
+            if current is not None and current is not before:
+                return current
+
+            connection = self.connections[host_id]['connection']
+            guests = snapshot_guests(self.inventory.get_snapshot(host_id))
+            started = time.time()
+
+            def crawl(guest):
+                return guest_api(connection, guest['type'], guest['node'], guest['vmid']).snapshot.get()
+
+            entries = []
+            errors = {}
+            for guest, snapshots, error in parallel_map(crawl, guests, max_workers=self.workers):
+                if error:
+                    errors[int(guest['vmid'])] = str(error)
+                else:
+                    entries.extend(snapshot_entries(host_id, guest, snapshots, started))
+
+            data = {
+                'host_id': host_id,
+                'fetched': time.time(),
+                'duration': round(time.time() - started, 2),
+                'guests': len(guests),
+                'snapshots': entries,
+                'errors': errors
+            }
+            app_logger.info(f"Crawled {len(entries)} snapshots of {len(guests)} guests on {host_id} in {data['duration']}s")
+
+            with self.lock:
+                self.hosts[host_id] = data
+            return data
+
+    def get(self, host_id, max_age=None):
+        with self.lock:
+            data = self.hosts.get(host_id)
+        max_age = self.max_age if max_age is None else max_age
+        if data is None or time.time() - data['fetched'] > max_age:
+            data = self.refresh_host(host_id)
+        return data
+
+    def query(self, host_id, name=None, older_than=None, guest_type=None, node=None, vmids=None):
+        """Snapshots matching the filters, oldest first.
+
+        name is a glob pattern (e.g. 'pre-upgrade*'); older_than is an age in seconds.
+        """
+        data = self.get(host_id)
+        now = time.time()
+        vmids = {int(vmid) for vmid in vmids} if vmids else None
+        matches = [
+            dict(entry, age=now - entry['snaptime'] if entry['snaptime'] else None)
+            for entry in data['snapshots']
+            if (not name or fnmatch.fnmatchcase(entry['name'], name))
+            and (older_than is None or (entry['snaptime'] and now - entry['snaptime'] >= older_than))
+            and (guest_type is None or entry['type'] == guest_type)
+            and (node is None or entry['node'] == node)
+            and (vmids is None or entry['vmid'] in vmids)
+        ]
+        return sorted(matches, key=lambda entry: (entry['snaptime'] or 0, entry['vmid'], entry['name']))
+
+    def invalidate(self, host_id):
+        """Mark a host's snapshot index stale so the next reader crawls again"""
+        with self.lock:
+            data = self.hosts.get(host_id)
+            if data is not None:
+                self.hosts[host_id] = dict(data, fetched=0)
+
+    def forget(self, host_id):
+        with self.lock:
+            self.hosts.pop(host_id, None)
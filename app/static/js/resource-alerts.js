@@ -1,6 +1,6 @@
 /**
  * Resource Alerts Module
- * Handles monitoring of resource usage and displaying alerts when thresholds are exceeded
+ * Displays resource alerts evaluated by the server and manages threshold settings
  */
 const ResourceAlerts = (function() {
     // Default thresholds (will be overridden by user settings)
@@ -192,108 +192,26 @@ const ResourceAlerts = (function() {
         }
     }
     
-    // Check node resources against thresholds
-    function checkNodeResources(nodeData) {
-        const containerId = 'node-resource-alerts-container';
-        
-        // Check CPU
-        if (thresholds.cpu.enabled) {
-            if (nodeData.cpu >= thresholds.cpu.critical) {
-                showAlert('critical', 'cpu', nodeData.cpu, thresholds.cpu.critical, `Node ${nodeData.name}`, null, containerId);
-            } else if (nodeData.cpu >= thresholds.cpu.warning) {
-                showAlert('warning', 'cpu', nodeData.cpu, thresholds.cpu.warning, `Node ${nodeData.name}`, null, containerId);
-            }
-        }
-        
-        // Check Memory
-        if (thresholds.memory.enabled) {
-            if (nodeData.memory_percent >= thresholds.memory.critical) {
-                showAlert('critical', 'memory', nodeData.memory_percent, thresholds.memory.critical, `Node ${nodeData.name}`, null, containerId);
-            } else if (nodeData.memory_percent >= thresholds.memory.warning) {
-                showAlert('warning', 'memory', nodeData.memory_percent, thresholds.memory.warning, `Node ${nodeData.name}`, null, containerId);
-            }
-        }
-        
-        // Check Storage
-        if (thresholds.storage.enabled) {
-            if (nodeData.storage_percent >= thresholds.storage.critical) {
-                showAlert('critical', 'storage', nodeData.storage_percent, thresholds.storage.critical, `Node ${nodeData.name}`, null, containerId);
-            } else if (nodeData.storage_percent >= thresholds.storage.warning) {
-                showAlert('warning', 'storage', nodeData.storage_percent, thresholds.storage.warning, `Node ${nodeData.name}`, null, containerId);
-            }
-        }
-    }
+    // Alerts already shown, so reconnects and repeated pushes don't pop them up again
+    const shownAlerts = new Set();
     
-    // Check VM resources against thresholds
-    function checkVmResources(vmData) {
-        const memoryPercent = (vmData.mem / vmData.maxmem) * 100;
-        const containerId = 'node-resource-alerts-container';
-        
-        // Check CPU
-        if (thresholds.cpu.enabled && vmData.cpu) {
-            const cpuPercent = vmData.cpu * 100;
-            if (cpuPercent >= thresholds.cpu.critical) {
-                showAlert('critical', 'cpu', cpuPercent, thresholds.cpu.critical, `VM ${vmData.name}`, vmData.vmid, containerId);
-            } else if (cpuPercent >= thresholds.cpu.warning) {
-                showAlert('warning', 'cpu', cpuPercent, thresholds.cpu.warning, `VM ${vmData.name}`, vmData.vmid, containerId);
-            }
-        }
+    // Show alerts evaluated by the server and pushed over the live channel
+    function showServerAlerts(update) {
+        const alerts = update.fired.concat(update.active || []);
         
-        // Check Memory
-        if (thresholds.memory.enabled) {
-            if (memoryPercent >= thresholds.memory.critical) {
-                showAlert('critical', 'memory', memoryPercent, thresholds.memory.critical, `VM ${vmData.name}`, vmData.vmid, containerId);
-            } else if (memoryPercent >= thresholds.memory.warning) {
-                showAlert('warning', 'memory', memoryPercent, thresholds.memory.warning, `VM ${vmData.name}`, vmData.vmid, containerId);
+        alerts.forEach(alert => {
+            if (shownAlerts.has(alert.id)) {
+                return;
             }
-        }
-        
-        // Check Disks
-        if (thresholds.storage.enabled && vmData.disks) {
-            for (const [diskId, disk] of Object.entries(vmData.disks)) {
-                const diskPercent = (disk.usage / disk.total) * 100;
-                if (diskPercent >= thresholds.storage.critical) {
-                    showAlert('critical', 'storage', diskPercent, thresholds.storage.critical, `VM ${vmData.name} Disk ${diskId}`, vmData.vmid, containerId);
-                } else if (diskPercent >= thresholds.storage.warning) {
-                    showAlert('warning', 'storage', diskPercent, thresholds.storage.warning, `VM ${vmData.name} Disk ${diskId}`, vmData.vmid, containerId);
-                }
-            }
-        }
-    }
-    
-    // Check Container resources against thresholds
-    function checkContainerResources(containerData) {
-        const memoryPercent = (containerData.mem / containerData.maxmem) * 100;
-        const containerId = 'node-resource-alerts-container';
-        
-        // Check CPU
-        if (thresholds.cpu.enabled && containerData.cpu) {
-            const cpuPercent = containerData.cpu * 100;
-            if (cpuPercent >= thresholds.cpu.critical) {
-                showAlert('critical', 'cpu', cpuPercent, thresholds.cpu.critical, `Container ${containerData.name}`, containerData.vmid, containerId);
-            } else if (cpuPercent >= thresholds.cpu.warning) {
-                showAlert('warning', 'cpu', cpuPercent, thresholds.cpu.warning, `Container ${containerData.name}`, containerData.vmid, containerId);
-            }
-        }
-        
-        // Check Memory
-        if (thresholds.memory.enabled) {
-            if (memoryPercent >= thresholds.memory.critical) {
-                showAlert('critical', 'memory', memoryPercent, thresholds.memory.critical, `Container ${containerData.name}`, containerData.vmid, containerId);
-            } else if (memoryPercent >= thresholds.memory.warning) {
-                showAlert('warning', 'memory', memoryPercent, thresholds.memory.warning, `Container ${containerData.name}`, containerData.vmid, containerId);
-            }
-        }
+            shownAlerts.add(alert.id);
+            
+            const type = alert.level === 'danger' ? 'critical' : 'warning';
+            const resourceId = alert.resource.startsWith('node/') || alert.resource.startsWith('storage/') ? null : alert.resource.split('/')[1];
+            showAlert(type, alert.metric, alert.value, alert.threshold, alert.name, resourceId);
+        });
         
-        // Check Root Filesystem
-        if (thresholds.storage.enabled && containerData.rootfs) {
-            const storagePercent = (containerData.rootfs.usage / containerData.rootfs.total) * 100;
-            if (storagePercent >= thresholds.storage.critical) {
-                showAlert('critical', 'storage', storagePercent, thresholds.storage.critical, `Container ${containerData.name} Root FS`, containerData.vmid, containerId);
-            } else if (storagePercent >= thresholds.storage.warning) {
-                showAlert('warning', 'storage', storagePercent, thresholds.storage.warning, `Container ${containerData.name} Root FS`, containerData.vmid, containerId);
-            }
-        }
+        // Resolved alerts may fire again later as new alerts with new ids
+        update.resolved.forEach(alert => shownAlerts.delete(alert.id));
     }
     
     // Initialize module
@@ -309,9 +227,7 @@ const ResourceAlerts = (function() {
             thresholds = {...thresholds, ...newThresholds};
             saveThresholds();
         },
-        checkNodeResources: checkNodeResources,
-        checkVmResources: checkVmResources,
-        checkContainerResources: checkContainerResources,
+        showServerAlerts: showServerAlerts,
         areAlertsEnabled: areAlertsEnabled,
         toggleAlerts: toggleAlerts
     };
@@ -328,4 +244,9 @@ document.addEventListener('DOMContentLoaded', function() {
         alertContainer.className = 'resource-alerts-container';
         document.body.appendChild(alertContainer);
     }
+    
+    // Thresholds are evaluated on the server; show whatever alerts it pushes
+    document.addEventListener('live:alerts', function(event) {
+        ResourceAlerts.showServerAlerts(event.detail);
+    });
 });
\ No newline at end of file
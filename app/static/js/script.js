@@ -19,8 +19,11 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize action confirmations
     initActionConfirmations();
     
-    // Set up auto-refresh for system status
-    initAutoRefresh();
+    // Follow live node and guest state pushed by the server
+    initLiveUpdates();
+    
+    // Re-render server fragments when the live state changes
+    initFragmentRefresh();
     
     // Initialize resource charts
     initResourceCharts();
@@ -28,6 +31,9 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize optional columns display based on user settings
     initOptionalColumns();
     
+    // Follow any running bulk job shown on the page
+    initBulkJobProgress();
+    
     // Auto-close alerts after 5 seconds
     setTimeout(function() {
         const alerts = document.querySelectorAll('.alert:not(.alert-permanent)');
@@ -245,75 +251,269 @@ function initActionConfirmations() {
 }
 
 /**
- * Initialize auto-refresh for system status pages
+ * Keep node and guest state on the page current from the server push channel.
+ * A page opts in with data-live-events="<url>"; elements declare what they show with
+ * data-live-resource="qemu/100" plus data-live-field (status, cpu, mem, disk) or
+ * data-live-bar (cpu, mem, disk) for progress bars. Updates are also dispatched as
+ * 'live:resource', 'live:diff' and 'live:alerts' events for other modules to react to.
  */
-function initAutoRefresh() {
-    const refreshableContent = document.querySelectorAll('[data-refresh]');
-    const refreshStatusElements = document.querySelectorAll('.refresh-status');
-    
-    refreshableContent.forEach((element, index) => {
-        const refreshInterval = parseInt(element.getAttribute('data-refresh')) || 30000; // Default 30s
-        const refreshUrl = element.getAttribute('data-refresh-url');
+let liveEventSource = null;
+
+function livePercent(resource, field) {
+    if (field === 'cpu') {
+        return (resource.cpu || 0) * 100;
+    }
+    const max = resource['max' + field];
+    return max ? (resource[field] || 0) / max * 100 : 0;
+}
+
+function renderLiveStatus(status) {
+    if (status === 'running') {
+        return '<span class="badge bg-success">Running</span>';
+    } else if (status === 'stopped') {
+        return '<span class="badge bg-danger">Stopped</span>';
+    }
+    const badge = document.createElement('span');
+    badge.className = 'badge bg-secondary';
+    badge.textContent = status || 'unknown';
+    return badge.outerHTML;
+}
+
+function applyLiveResource(hostId, key, resource) {
+    document.querySelectorAll(`[data-live-resource="${key}"]`).forEach(element => {
+        const field = element.dataset.liveField;
+        const bar = element.dataset.liveBar;
         
-        if (refreshUrl) {
-            let secondsLeft = refreshInterval / 1000;
-            const statusElement = refreshStatusElements[index] || document.createElement('div');
-            
-            // Update countdown every second
-            const countdownInterval = setInterval(() => {
-                secondsLeft--;
-                if (statusElement) {
-                    statusElement.textContent = `Refreshing in ${secondsLeft}s`;
-                }
-                
-                if (secondsLeft <= 0) {
-                    clearInterval(countdownInterval);
-                }
-            }, 1000);
-            
-            // Set refresh interval
-            setInterval(() => {
-                element.classList.add('loading');
-                
-                fetch(refreshUrl)
-                    .then(response => response.text())
-                    .then(html => {
-                        element.innerHTML = html;
-                        element.classList.remove('loading');
-                        secondsLeft = refreshInterval / 1000;
-                    })
-                    .catch(error => {
-                        console.error('Error refreshing content:', error);
-                        element.classList.remove('loading');
-                    });
-            }, refreshInterval);
+        if (field === 'status') {
+            element.innerHTML = renderLiveStatus(resource.status);
+            if (element.hasAttribute('data-value')) {
+                element.setAttribute('data-value', resource.status);
+            }
+        } else if (field) {
+            element.textContent = `${livePercent(resource, field).toFixed(1)}%`;
+        }
+        
+        if (bar) {
+            const percent = livePercent(resource, bar);
+            element.style.width = `${percent}%`;
+            element.setAttribute('aria-valuenow', percent);
+            element.classList.remove('bg-success', 'bg-warning', 'bg-danger');
+            element.classList.add(percent < 50 ? 'bg-success' : percent < 80 ? 'bg-warning' : 'bg-danger');
         }
     });
     
-    // Auto-refresh toggle
+    document.dispatchEvent(new CustomEvent('live:resource', {
+        detail: { hostId: hostId, key: key, resource: resource }
+    }));
+}
+
+function initLiveUpdates() {
+    const source = document.querySelector('[data-live-events]');
+    if (!source || !window.EventSource) {
+        return;
+    }
+    
+    function connect() {
+        if (liveEventSource) {
+            return;
+        }
+        
+        // The browser resends the last event id on reconnect, so missed diffs are replayed
+        liveEventSource = new EventSource(source.dataset.liveEvents);
+        
+        liveEventSource.addEventListener('snapshot', function(event) {
+            const states = JSON.parse(event.data);
+            Object.entries(states).forEach(([hostId, resources]) => {
+                Object.entries(resources).forEach(([key, resource]) => applyLiveResource(hostId, key, resource));
+            });
+        });
+        
+        liveEventSource.addEventListener('diff', function(event) {
+            const diff = JSON.parse(event.data);
+            Object.entries(diff.changed).forEach(([key, resource]) => applyLiveResource(diff.host_id, key, resource));
+            document.dispatchEvent(new CustomEvent('live:diff', { detail: diff }));
+        });
+        
+        liveEventSource.addEventListener('alerts', function(event) {
+            document.dispatchEvent(new CustomEvent('live:alerts', { detail: JSON.parse(event.data) }));
+        });
+    }
+    
+    function disconnect() {
+        if (liveEventSource) {
+            liveEventSource.close();
+            liveEventSource = null;
+        }
+    }
+    
+    // Live updates toggle
     const refreshToggle = document.getElementById('refresh-toggle');
     
     if (refreshToggle) {
         refreshToggle.addEventListener('change', function() {
-            const isEnabled = this.checked;
-            
-            if (isEnabled) {
-                initAutoRefresh(); // Restart auto-refresh
+            if (this.checked) {
+                connect();
             } else {
-                // Clear all auto-refresh intervals
-                for (let i = 1; i < 9999; i++) {
-                    window.clearInterval(i);
-                }
+                disconnect();
             }
             
             // Store preference
-            localStorage.setItem('autoRefreshEnabled', isEnabled);
+            localStorage.setItem('autoRefreshEnabled', this.checked);
         });
         
         // Initialize toggle state from stored preference
-        const autoRefreshEnabled = localStorage.getItem('autoRefreshEnabled') !== 'false';
-        refreshToggle.checked = autoRefreshEnabled;
+        refreshToggle.checked = localStorage.getItem('autoRefreshEnabled') !== 'false';
+        if (!refreshToggle.checked) {
+            return;
+        }
+    }
+    
+    connect();
+}
+
+/**
+ * Re-fetch server-rendered fragments when the live channel reports a change.
+ * Regions declare data-fragment-url (and data-fragment-host to only follow one host).
+ * The last ETag is sent back as If-None-Match, so unchanged regions cost a 304.
+ */
+function initFragmentRefresh() {
+    const regions = document.querySelectorAll('[data-fragment-url]');
+    if (!regions.length) {
+        return;
+    }
+    
+    function refresh(region) {
+        // Don't replace rows while the user is selecting some of them
+        if (region.querySelector('input[type="checkbox"]:checked')) {
+            return;
+        }
+        
+        const headers = {};
+        if (region.dataset.fragmentEtag) {
+            headers['If-None-Match'] = `"${region.dataset.fragmentEtag}"`;
+        }
+        
+        fetch(region.dataset.fragmentUrl, { headers: headers, cache: 'no-store' })
+            .then(response => {
+                if (response.status !== 200) {
+                    return;
+                }
+                region.dataset.fragmentEtag = (response.headers.get('ETag') || '').replace(/"/g, '');
+                return response.text().then(html => {
+                    region.innerHTML = html;
+                    region.dispatchEvent(new CustomEvent('fragment:updated', { bubbles: true }));
+                });
+            })
+            .catch(error => {
+                console.error('Error refreshing fragment:', error);
+            });
     }
+    
+    // Coalesce bursts of diffs into one request per region
+    const pending = new Set();
+    let timer = null;
+    
+    document.addEventListener('live:diff', function(event) {
+        regions.forEach(region => {
+            const host = region.dataset.fragmentHost;
+            if (!host || host === event.detail.host_id) {
+                pending.add(region);
+            }
+        });
+        
+        clearTimeout(timer);
+        timer = setTimeout(() => {
+            pending.forEach(refresh);
+            pending.clear();
+        }, 500);
+    });
+}
+
+/**
+ * Render live progress for bulk jobs from their server-sent event stream.
+ * Containers declare the stream with data-bulk-job-events="<url>".
+ */
+function initBulkJobProgress() {
+    const containers = document.querySelectorAll('[data-bulk-job-events]');
+    if (!containers.length || !window.EventSource) {
+        return;
+    }
+    
+    const statusClasses = {
+        pending: 'secondary', running: 'info', success: 'success', failed: 'danger', cancelled: 'warning'
+    };
+    
+    function describeChanges(changes) {
+        return Object.keys(changes).map(key => {
+            const change = changes[key];
+            return `${key}: ${change.old === null ? '(unset)' : change.old} → ${change.new}`;
+        }).join(', ');
+    }
+    
+    containers.forEach(container => {
+        container.innerHTML = `
+            <div class="card mb-4">
+                <div class="card-header d-flex justify-content-between align-items-center">
+                    <h5 class="mb-0">${container.dataset.title || 'Job Progress'}</h5>
+                    <span class="text-muted small bulk-job-summary">Waiting for updates...</span>
+                </div>
+                <div class="card-body">
+                    <div class="progress mb-3">
+                        <div class="progress-bar bg-success bulk-job-success" role="progressbar" style="width: 0%"></div>
+                        <div class="progress-bar bg-danger bulk-job-failed" role="progressbar" style="width: 0%"></div>
+                    </div>
+                    <div class="table-responsive">
+                        <table class="table table-sm table-striped mb-0">
+                            <thead>
+                                <tr><th>Resource</th><th>Phase</th><th>Status</th><th>Details</th></tr>
+                            </thead>
+                            <tbody class="bulk-job-items"></tbody>
+                        </table>
+                    </div>
+                </div>
+            </div>`;
+        
+        const summary = container.querySelector('.bulk-job-summary');
+        const tbody = container.querySelector('.bulk-job-items');
+        const source = new EventSource(container.dataset.bulkJobEvents);
+        
+        source.onmessage = function(event) {
+            const job = JSON.parse(event.data);
+            const counts = job.counts;
+            
+            container.querySelector('.bulk-job-success').style.width = (counts.success / job.total * 100) + '%';
+            container.querySelector('.bulk-job-failed').style.width = (counts.failed / job.total * 100) + '%';
+            summary.textContent = `${job.completed}/${job.total} done, ${counts.running} running, ${counts.failed} failed` +
+                (job.eta !== null ? `, about ${job.eta}s left` : '') +
+                (job.finished ? ` (finished in ${job.elapsed}s)` : '');
+            
+            tbody.innerHTML = '';
+            job.items.forEach(item => {
+                const row = document.createElement('tr');
+                const details = item.error || (item.changes ? describeChanges(item.changes) : '') || item.upid || '';
+                [item.label, item.phase || '', null, details].forEach((text, index) => {
+                    const cell = document.createElement('td');
+                    if (index === 2) {
+                        const badge = document.createElement('span');
+                        badge.className = 'badge bg-' + (statusClasses[item.status] || 'secondary');
+                        badge.textContent = item.status;
+                        cell.appendChild(badge);
+                    } else {
+                        cell.textContent = text;
+                        if (index === 3) {
+                            cell.className = 'small text-muted';
+                        }
+                    }
+                    row.appendChild(cell);
+                });
+                tbody.appendChild(row);
+            });
+        };
+        
+        source.addEventListener('done', function() {
+            source.close();
+        });
+    });
 }
 
 /**
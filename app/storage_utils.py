@@ -0,0 +1,398 @@
+import os
+import json
+import threading
+import time
+import logging
+from collections import deque
+
+app_logger = logging.getLogger('proxima-ui')
+
+# The storage configuration (storage.get()) rarely changes; it is refetched after this many seconds
+STORAGE_CONFIG_MAX_AGE = int(os.getenv('STORAGE_CONFIG_MAX_AGE', 300))
+
+# Storage types that are the same pool on every node even without 'shared' in their config
+SHARED_STORAGE_TYPES = ('nfs', 'cifs', 'glusterfs', 'cephfs', 'rbd', 'iscsi', 'iscsidirect', 'zfs', 'pbs')
+
+# Where storage usage samples are kept between restarts
+STORAGE_HISTORY_FILE = os.getenv('STORAGE_HISTORY_FILE', 'storage_history.jsonl')
+
+# At most one usage sample per storage is recorded per interval (seconds)
+STORAGE_SAMPLE_INTERVAL = int(os.getenv('STORAGE_SAMPLE_INTERVAL', 300))
+
+# Growth trends are fitted over this much history (days)
+STORAGE_FORECAST_WINDOW_DAYS = float(os.getenv('STORAGE_FORECAST_WINDOW_DAYS', 14))
+
+# A trend needs this many samples spanning at least this many hours before it is trusted
+STORAGE_FORECAST_MIN_SAMPLES = int(os.getenv('STORAGE_FORECAST_MIN_SAMPLES', 12))
+STORAGE_FORECAST_MIN_HOURS = float(os.getenv('STORAGE_FORECAST_MIN_HOURS', 6))
+
+# Storages expected to fill up within this many days are highlighted
+STORAGE_FORECAST_WARN_DAYS = float(os.getenv('STORAGE_FORECAST_WARN_DAYS', 30))
+
+
+def usage(total, used):
+    return {
+        'total': total,
+        'used': used,
+        'available': max(total - used, 0),
+        'percent_used': used / total * 100 if total > 0 else 0
+    }
+
+
+def storage_shared(config, resource=None):
+    """Whether a storage is one pool reachable from several nodes"""
+    if config and (config.get('shared') in (1, '1', True) or config.get('type') in SHARED_STORAGE_TYPES):
+        return True
+    return bool(resource and (resource.get('shared') in (1, '1', True)
+                              or resource.get('plugintype') in SHARED_STORAGE_TYPES))
+
+
+def storage_limit_key(node, storage, shared):
+    """BulkJob concurrency key of a storage; node-local storages of different nodes are separate pools"""
+    return ('storage', storage if storage in shared else f"{node}/{storage}")
+
+
+def summarize_storage(snapshot, config):
+    """Usage per storage pool, per node and cluster-wide from the inventory's storage resources.
+
+    Every (node, storage) pair comes from the same cluster/resources listing. A shared
+    storage reports the same capacity on each node and is counted once; a node-local
+    one is summed across the nodes it exists on.
+    """
+    pools = {}
+    for entry in config:
+        pools[entry['storage']] = dict(entry, shared=storage_shared(entry), nodes=[])
+
+    nodes = {}
+    for resource in sorted(snapshot['storage'], key=lambda resource: resource.get('node') or ''):
+        name = resource.get('storage')
+        pool = pools.get(name)
+        if pool is None:
+            # Known to the cluster but not (yet) in the cached config
+            pool = pools[name] = {'storage': name, 'type': resource.get('plugintype'),
+                                  'content': resource.get('content', ''), 'shared': storage_shared(None, resource),
+                                  'nodes': []}
+        pool['shared'] = pool['shared'] or storage_shared(None, resource)
+
+        available = resource.get('status') == 'available'
+        total = (resource.get('maxdisk') or 0) if available else 0
+        used = (resource.get('disk') or 0) if available else 0
+        pool['nodes'].append(dict(usage(total, used), node=resource.get('node'), status=resource.get('status')))
+
+        node = nodes.setdefault(resource.get('node'), {'node': resource.get('node'), 'local_total': 0,
+                                                       'local_used': 0, 'storages': 0, 'unavailable': 0})
+        node['storages'] += 1
+        if not available:
+            node['unavailable'] += 1
+        elif not pool['shared']:
+            node['local_total'] += total
+            node['local_used'] += used
+
+    for pool in pools.values():
+        reporting = [entry for entry in pool['nodes'] if entry['total'] > 0]
+        if pool['shared']:
+            total, used = (reporting[0]['total'], reporting[0]['used']) if reporting else (0, 0)
+        else:
+            total, used = sum(entry['total'] for entry in reporting), sum(entry['used'] for entry in reporting)
+        pool.update(usage(total, used))
+
+    cluster = usage(sum(pool['total'] for pool in pools.values()), sum(pool['used'] for pool in pools.values()))
+    cluster['shared'] = usage(sum(pool['total'] for pool in pools.values() if pool['shared']),
+                              sum(pool['used'] for pool in pools.values() if pool['shared']))
+
+    return {
+        'pools': sorted(pools.values(), key=lambda pool: pool['storage']),
+        'nodes': [dict(node, **usage(node['local_total'], node['local_used']))
+                  for _, node in sorted(nodes.items(), key=lambda item: item[0] or '')],
+        'cluster': cluster
+    }
+
+
+class StorageCollector:
+    """Storage status of every host, built from inventory snapshots.
+
+    The inventory's cluster/resources listing already carries disk usage for every
+    (node, storage) pair, so no per-storage status call is needed. The storage config
+    is cached for STORAGE_CONFIG_MAX_AGE and a host's summary is rebuilt only when a
+    new snapshot or config arrives.
+    """
+
+    def __init__(self, connections, inventory, config_max_age=STORAGE_CONFIG_MAX_AGE):
+        self.connections = connections
+        self.inventory = inventory
+        self.config_max_age = config_max_age
+        self.lock = threading.Lock()
+        self.configs = {}
+        self.summaries = {}
+
+    def _config(self, host_id):
+        with self.lock:
+            cached = self.configs.get(host_id)
+        if cached is not None and time.time() - cached['fetched'] <= self.config_max_age:
+            return cached
+
+        cached = {'fetched': time.time(), 'storage': self.connections[host_id]['connection'].storage.get()}
+        with self.lock:
+            self.configs[host_id] = cached
+        return cached
+
+    def shared_storages(self, host_id):
+        """Ids of a host's storages that are one pool across nodes, from the cached config"""
+        return {config['storage'] for config in self._config(host_id)['storage'] if storage_shared(config)}
+
+    def get(self, host_id, refresh=False):
+        """Summary of a host's storage; refresh refetches both the inventory and the config"""
+        if refresh:
+            self.invalidate(host_id)
+            snapshot = self.inventory.refresh_host(host_id)
+        else:
+            snapshot = self.inventory.get_snapshot(host_id)
+        config = self._config(host_id)
+
+        with self.lock:
+            summary = self.summaries.get(host_id)
+            if summary is not None and summary['snapshot'] is snapshot and summary['config'] is config:
+                return summary['data']
+
+        data = summarize_storage(snapshot, config['storage'])
+        data['fetched'] = snapshot['fetched']
+        with self.lock:
+            self.summaries[host_id] = {'snapshot': snapshot, 'config': config, 'data': data}
+        return data
+
+    def invalidate(self, host_id):
+        """Drop a host's cached config, e.g. after a storage was added or removed"""
+        with self.lock:
+            self.configs.pop(host_id, None)
+            self.summaries.pop(host_id, None)
+
+    def forget(self, host_id):
+        self.invalidate(host_id)
+
+
+class RollingTrend:
+    """Least-squares line through a sliding window of (time, value) samples.
+
+    Running sums make adding and expiring a sample O(1). Times are kept in days
+    and values in GiB relative to the series' first sample so the sums stay well
+    conditioned; they are recomputed from the samples once as many have expired
+    as are left, which bounds rounding drift.
+    """
+
+    def __init__(self, origin_time, origin_value):
+        self.origin_time = origin_time
+        self.origin_value = origin_value
+        self.samples = deque()
+        self.expired = 0
+        self._reset()
+
+    def _reset(self):
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.sxy = self.syy = 0.0
+
+    def _accumulate(self, x, y, sign):
+        self.n += sign
+        self.sx += sign * x
+        self.sy += sign * y
+        self.sxx += sign * x * x
+        self.sxy += sign * x * y
+        self.syy += sign * y * y
+
+    def add(self, timestamp, value):
+        x = (timestamp - self.origin_time) / 86400
+        y = (value - self.origin_value) / 1024 ** 3
+        self.samples.append((timestamp, x, y))
+        self._accumulate(x, y, 1)
+
+    def expire(self, before):
+        while self.samples and self.samples[0][0] < before:
+            _, x, y = self.samples.popleft()
+            self._accumulate(x, y, -1)
+            self.expired += 1
+        if self.expired and self.expired >= len(self.samples):
+            self._reset()
+            for _, x, y in self.samples:
+                self._accumulate(x, y, 1)
+            self.expired = 0
+
+    def fit(self):
+        """(slope in bytes per day, r²) of the window, or None with fewer than two distinct times"""
+        if self.n < 2:
+            return None
+        sxx = self.sxx - self.sx * self.sx / self.n
+        if sxx <= 1e-12:
+            return None
+        sxy = self.sxy - self.sx * self.sy / self.n
+        syy = self.syy - self.sy * self.sy / self.n
+        r2 = sxy * sxy / (sxx * syy) if syy > 1e-12 else 1.0
+        return sxy / sxx * 1024 ** 3, min(max(r2, 0.0), 1.0)
+
+
+def storage_series_key(resource):
+    """(storage, node) of a storage resource; shared storages are one series with no node"""
+    return resource.get('storage'), None if storage_shared(None, resource) else resource.get('node')
+
+
+class StorageHistory:
+    """Records storage usage over time and forecasts when each storage fills up.
+
+    Registered as an inventory listener, it keeps at most one sample per storage
+    every STORAGE_SAMPLE_INTERVAL (shared storages once, not once per node) for
+    STORAGE_FORECAST_WINDOW_DAYS and appends them to STORAGE_HISTORY_FILE. Each
+    series carries a RollingTrend, so a forecast is a constant-time fit rather
+    than a regression over the whole history. Series that are no longer sampled
+    expire with the window, and the file is rewritten from the kept samples once
+    it holds twice as many lines.
+    """
+
+    def __init__(self, history_file=STORAGE_HISTORY_FILE, window_days=STORAGE_FORECAST_WINDOW_DAYS,
+                 sample_interval=STORAGE_SAMPLE_INTERVAL):
+        self.history_file = history_file
+        self.window = window_days * 86400
+        self.sample_interval = sample_interval
+        self.lock = threading.Lock()
+        self.series = {}
+        self.history_lines = 0
+        self._load()
+
+    def _series(self, host_id, storage, node, timestamp, used):
+        # Callers hold self.lock
+        key = (host_id, storage, node)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = {'host_id': host_id, 'storage': storage, 'node': node, 'type': None,
+                                         'trend': RollingTrend(timestamp, used), 'samples': deque(), 'last': None}
+        return series
+
+    def _append(self, series, sample):
+        # Callers hold self.lock
+        cutoff = sample['t'] - self.window
+        series['trend'].add(sample['t'], sample['used'])
+        series['trend'].expire(cutoff)
+        series['samples'].append(sample)
+        while series['samples'][0]['t'] < cutoff:
+            series['samples'].popleft()
+        series['last'] = sample
+
+    def _expire(self, now):
+        # Callers hold self.lock; series not sampled within the window are dropped
+        cutoff = now - self.window
+        for key in [key for key, series in self.series.items() if series['last']['t'] < cutoff]:
+            del self.series[key]
+
+    def _compact(self):
+        # Callers hold self.lock
+        if not self.history_file:
+            return
+        samples = sorted((sample for series in self.series.values() for sample in series['samples']),
+                         key=lambda sample: sample['t'])
+        try:
+            with open(self.history_file, 'w') as f:
+                f.writelines(json.dumps(sample) + '\n' for sample in samples)
+            self.history_lines = len(samples)
+        except Exception as e:
+            app_logger.error(f"Error compacting storage history: {str(e)}")
+
+    def _load(self):
+        if not self.history_file or not os.path.exists(self.history_file):
+            return
+        cutoff = time.time() - self.window
+        kept = []
+        try:
+            with open(self.history_file, 'r') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    sample = json.loads(line)
+                    if sample['t'] >= cutoff:
+                        kept.append(sample)
+        except Exception as e:
+            app_logger.error(f"Error loading storage history: {str(e)}")
+            return
+
+        with self.lock:
+            for sample in sorted(kept, key=lambda sample: sample['t']):
+                series = self._series(sample['host_id'], sample['storage'], sample.get('node'), sample['t'], sample['used'])
+                series['type'] = sample.get('type')
+                self._append(series, sample)
+
+            # Samples that fell out of the window are dropped from the file as well
+            self._compact()
+
+    def record(self, host_id, snapshot):
+        """Inventory listener: sample the usage of every available storage of a host"""
+        now = snapshot['fetched']
+        recorded = []
+        with self.lock:
+            for resource in snapshot['storage']:
+                if resource.get('status') != 'available' or not resource.get('maxdisk'):
+                    continue
+                storage, node = storage_series_key(resource)
+                series = self._series(host_id, storage, node, now, resource.get('disk') or 0)
+                if series['last'] and now - series['last']['t'] < self.sample_interval:
+                    continue
+                sample = {'host_id': host_id, 'storage': storage, 'node': node, 'type': resource.get('plugintype'),
+                          't': now, 'used': resource.get('disk') or 0, 'total': resource['maxdisk']}
+                series['type'] = sample['type']
+                self._append(series, sample)
+                recorded.append(sample)
+            self._expire(now)
+
+            if not recorded or not self.history_file:
+                return
+            if self.history_lines + len(recorded) >= 2 * sum(len(series['samples']) for series in self.series.values()):
+                self._compact()
+                return
+            try:
+                with open(self.history_file, 'a') as f:
+                    f.writelines(json.dumps(sample) + '\n' for sample in recorded)
+                self.history_lines += len(recorded)
+            except Exception as e:
+                app_logger.error(f"Error writing storage history: {str(e)}")
+
+    def forecast(self, host_id=None, now=None):
+        """Growth and days until full of every storage series, soonest to fill first"""
+        now = now or time.time()
+        forecasts = []
+        cutoff = now - self.window
+        with self.lock:
+            for series in self.series.values():
+                if (host_id is not None and series['host_id'] != host_id) or series['last']['t'] < cutoff:
+                    continue
+                trend = series['trend']
+                last = series['last']
+                span_hours = (trend.samples[-1][0] - trend.samples[0][0]) / 3600 if trend.samples else 0
+                forecast = {
+                    'host_id': series['host_id'],
+                    'storage': series['storage'],
+                    'node': series['node'],
+                    'shared': series['node'] is None,
+                    'type': series['type'],
+                    'used': last['used'],
+                    'total': last['total'],
+                    'percent_used': last['used'] / last['total'] * 100 if last['total'] else 0,
+                    'samples': trend.n,
+                    'span_hours': round(span_hours, 1),
+                    'growth_per_day': None,
+                    'r2': None,
+                    'days_until_full': None,
+                    'full_at': None
+                }
+                fit = trend.fit()
+                if fit and trend.n >= STORAGE_FORECAST_MIN_SAMPLES and span_hours >= STORAGE_FORECAST_MIN_HOURS:
+                    slope, r2 = fit
+                    forecast['growth_per_day'] = round(slope)
+                    forecast['r2'] = round(r2, 3)
+                    if slope > 0:
+                        days = max(last['total'] - last['used'], 0) / slope
+                        forecast['days_until_full'] = round(days, 1)
+                        forecast['full_at'] = last['t'] + days * 86400
+                forecasts.append(forecast)
+        return sorted(forecasts, key=lambda forecast: (forecast['days_until_full'] is None,
+                                                       forecast['days_until_full'] or 0))
+
+    def forget(self, host_id):
+        with self.lock:
+            for key in [key for key in self.series if key[0] == host_id]:
+                del self.series[key]
+            self._compact()
@@ -0,0 +1,373 @@
+import os
+import threading
+import time
+import uuid
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+app_logger = logging.getLogger('proxima-ui')
+
+# Upper bound on threads used to fan out read-only API calls
+PARALLEL_FETCH_WORKERS = int(os.getenv('PARALLEL_FETCH_WORKERS', 8))
+
+def parallel_map(func, items, max_workers=None):
+    """Run func over items in a thread pool and return (item, result, error) tuples in input order"""
+    items = list(items)
+    if not items:
+        return []
+
+    def call(item):
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, e
+
+    workers = min(max_workers or PARALLEL_FETCH_WORKERS, len(items))
+    if workers <= 1:
+        return [call(item) for item in items]
+
+    # Each worker runs in a copy of the caller's context, so request-scoped state follows the call
+    contexts = [contextvars.copy_context() for _ in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda context, item: context.run(call, item), contexts, items))
+
+def fetch_calls(calls, max_workers=None):
+    """Run named zero-argument API calls concurrently and return (results, errors) dicts"""
+    results, errors = {}, {}
+    for name, result, error in parallel_map(lambda name: calls[name](), list(calls), max_workers=max_workers):
+        if error:
+            errors[name] = str(error)
+        else:
+            results[name] = result
+    return results, errors
+
+# Proxmox task helpers
+def task_node(upid):
+    """Extract the node name from a Proxmox UPID string"""
+    try:
+        return upid.split(':')[1]
+    except (AttributeError, IndexError):
+        return None
+
+def wait_for_task(connection, node, upid, timeout=3600, poll_interval=2, max_interval=10):
+    """Poll a Proxmox task until it stops and return its final status dict"""
+    node = task_node(upid) or node
+    deadline = time.time() + timeout
+    interval = poll_interval
+
+    while True:
+        status = connection.nodes(node).tasks(upid).status.get()
+        if status.get('status') == 'stopped':
+            return status
+
+        if time.time() >= deadline:
+            raise TimeoutError(f"Task {upid} did not finish within {timeout} seconds")
+
+        # Back off gradually so long-running tasks don't hammer the API
+        time.sleep(interval)
+        interval = min(interval * 1.5, max_interval)
+
+def task_succeeded(status):
+    """Check whether a stopped Proxmox task finished successfully"""
+    return status.get('exitstatus') == 'OK'
+
+
+class ConcurrencyLimiter:
+    """Track in-flight work per key (node, storage, ...) against configured limits.
+
+    Limits are given per dimension, e.g. {'node': 2, 'storage': 1}. Each work
+    item declares the keys it occupies as (dimension, value) pairs. The limiter
+    itself is not locked; callers hold their own condition around it. A limit of
+    0 or None means unlimited; negative limits raise ValueError, as nothing could
+    ever run under them.
+    """
+
+    def __init__(self, limits=None, total=None):
+        self.limits = {dim: int(limit) for dim, limit in (limits or {}).items() if limit}
+        self.total = int(total) if total else None
+        negative = [dim for dim, limit in self.limits.items() if limit < 0]
+        if self.total is not None and self.total < 0:
+            negative.append('total')
+        if negative:
+            raise ValueError(f"Concurrency limits must not be negative: {', '.join(negative)}")
+        self.active = {}
+        self.running = 0
+
+    def available(self, keys):
+        if self.total is not None and self.running >= self.total:
+            return False
+        for dim, value in keys:
+            limit = self.limits.get(dim)
+            if limit is not None and self.active.get((dim, value), 0) >= limit:
+                return False
+        return True
+
+    def acquire(self, keys):
+        self.running += 1
+        for key in keys:
+            self.active[key] = self.active.get(key, 0) + 1
+
+    def release(self, keys):
+        self.running -= 1
+        for key in keys:
+            self.active[key] -= 1
+            if self.active[key] <= 0:
+                del self.active[key]
+
+
+class RateLimiter:
+    """Space calls out to at most `rate` per second across all threads sharing the limiter."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_slot = 0
+
+    def wait(self):
+        """Block until the caller's slot comes up"""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class BulkJob:
+    """A batch of Proxmox operations executed in the background with per-key concurrency limits.
+
+    Each item is a dict with a 'label', optional 'keys' (list of (dimension, value)
+    pairs used for limiting), optional 'size' in bytes for throughput reporting,
+    an optional 'not_before' timestamp before which it is not dispatched and an
+    optional 'after' list of indexes of earlier items that must succeed first; it
+    is cancelled when one of them fails or is cancelled.
+    The worker callable receives the item and may store 'upid' or 'result' on it.
+    """
+
+    def __init__(self, kind, host_id, items, worker, limits=None, total_limit=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.host_id = host_id
+        self.worker = worker
+        self.limiter = ConcurrencyLimiter(limits, total_limit)
+        self.condition = threading.Condition()
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancelled = False
+        self.version = 0
+        self.items = []
+
+        for index, item in enumerate(items):
+            item.setdefault('label', f"item {index + 1}")
+            item['keys'] = list(dict.fromkeys(tuple(key) for key in item.get('keys', [])))
+            item.update({
+                'index': index,
+                'status': 'pending',
+                'upid': item.get('upid'),
+                'error': None,
+                'started': None,
+                'finished': None
+            })
+            self.items.append(item)
+
+    def start(self, prepare=None, finish=None):
+        """Run the job in a daemon thread; prepare(job) runs first and finish(job) last in that thread"""
+        thread = threading.Thread(target=self._run, args=(prepare, finish), daemon=True)
+        thread.start()
+        return self
+
+    def _changed(self):
+        # Callers hold self.condition
+        self.version += 1
+        self.condition.notify_all()
+
+    def update_item(self, item, **fields):
+        """Record progress on an item (e.g. its current phase) and wake up watchers"""
+        with self.condition:
+            item.update(fields)
+            self._changed()
+
+    def wait_for_change(self, version, timeout=15):
+        """Block until the job changes past version (or timeout) and return the current version"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version or self.finished is not None, timeout)
+            return self.version
+
+    def cancel(self):
+        """Stop dispatching pending items; running items are left to finish"""
+        with self.condition:
+            self.cancelled = True
+            for item in self.items:
+                if item['status'] == 'pending':
+                    item['status'] = 'cancelled'
+            self._changed()
+
+    def _dependencies(self, item):
+        # Callers hold self.condition; 'failed' as soon as an item it waits for did not succeed
+        for index in item.get('after', ()):
+            status = self.items[index]['status']
+            if status in ('failed', 'cancelled'):
+                return 'failed'
+            if status != 'success':
+                return 'pending'
+        return 'success'
+
+    def _cancel_orphans(self):
+        # Callers hold self.condition; items waiting for one that did not succeed will never run
+        for item in self.items:
+            if item['status'] == 'pending' and item.get('after') and self._dependencies(item) == 'failed':
+                item['status'] = 'cancelled'
+                item['error'] = 'An item it waits for did not succeed'
+                self._changed()
+
+    def _next_item(self, now):
+        for item in self.items:
+            if (item['status'] == 'pending' and item.get('not_before', 0) <= now
+                    and self._dependencies(item) == 'success' and self.limiter.available(item['keys'])):
+                return item
+        return None
+
+    def _next_start(self, now):
+        # Callers hold self.condition
+        starts = [item['not_before'] for item in self.items
+                  if item['status'] == 'pending' and item.get('not_before', 0) > now]
+        return min(starts) if starts else None
+
+    def _run(self, prepare, finish):
+        self.started = time.time()
+
+        if prepare:
+            try:
+                prepare(self)
+            except Exception as e:
+                app_logger.warning(f"Bulk {self.kind} job {self.id} preparation failed: {str(e)}")
+
+        with self.condition:
+            while True:
+                self._cancel_orphans()
+                if self.cancelled or not any(item['status'] == 'pending' for item in self.items):
+                    break
+
+                now = time.time()
+                item = self._next_item(now)
+                if item is None:
+                    # Every pending item is blocked by a limit or not due yet; wait for a slot or its start
+                    next_start = self._next_start(now)
+                    self.condition.wait(next_start - now if next_start else None)
+                    continue
+
+                self.limiter.acquire(item['keys'])
+                item['status'] = 'running'
+                item['started'] = time.time()
+                self._changed()
+                threading.Thread(target=self._run_item, args=(item,), daemon=True).start()
+
+            while any(item['status'] == 'running' for item in self.items):
+                self.condition.wait()
+
+        if finish:
+            try:
+                finish(self)
+            except Exception as e:
+                app_logger.warning(f"Bulk {self.kind} job {self.id} finish hook failed: {str(e)}")
+
+        with self.condition:
+            self.finished = time.time()
+            self._changed()
+        app_logger.info(f"Bulk {self.kind} job {self.id} finished: {self.summary()}")
+
+    def _run_item(self, item):
+        try:
+            self.worker(item)
+            status, error = 'success', None
+        except Exception as e:
+            status, error = 'failed', str(e)
+
+        with self.condition:
+            item['status'] = status
+            item['error'] = error
+            item['finished'] = time.time()
+            self.limiter.release(item['keys'])
+            self._changed()
+
+    def summary(self):
+        counts = {'pending': 0, 'running': 0, 'success': 0, 'failed': 0, 'cancelled': 0}
+        for item in self.items:
+            counts[item['status']] = counts.get(item['status'], 0) + 1
+        return counts
+
+    def progress(self):
+        """Aggregate progress and throughput figures for the whole job"""
+        with self.condition:
+            counts = self.summary()
+            total = len(self.items)
+            done = counts['success'] + counts['failed'] + counts['cancelled']
+            now = self.finished or time.time()
+            elapsed = now - self.started if self.started else 0
+
+            bytes_total = sum(item.get('size') or 0 for item in self.items)
+            bytes_done = sum(item.get('size') or 0 for item in self.items if item['status'] == 'success')
+
+            progress = {
+                'id': self.id,
+                'version': self.version,
+                'kind': self.kind,
+                'host_id': self.host_id,
+                'total': total,
+                'completed': done,
+                'percent': round(done / total * 100, 1) if total else 100.0,
+                'counts': counts,
+                'elapsed': round(elapsed, 1),
+                'finished': self.finished is not None,
+                'cancelled': self.cancelled,
+                'bytes_total': bytes_total,
+                'bytes_done': bytes_done,
+                'items_per_minute': round(done / elapsed * 60, 2) if elapsed > 0 else 0,
+                'bytes_per_second': round(bytes_done / elapsed) if elapsed > 0 else 0,
+                'eta': None
+            }
+
+            if done and self.finished is None and elapsed > 0:
+                progress['eta'] = round(elapsed / done * (total - done))
+
+            return progress
+
+    def to_dict(self):
+        data = self.progress()
+        with self.condition:
+            data['items'] = [
+                {key: value for key, value in item.items() if key not in ('keys', 'params', 'after')}
+                for item in self.items
+            ]
+        return data
+
+
+# Registry of bulk jobs so their progress can be polled via the API
+bulk_jobs = {}
+bulk_jobs_lock = threading.Lock()
+MAX_FINISHED_JOBS = 50
+
+def register_job(job):
+    """Store a bulk job and prune the oldest finished ones"""
+    with bulk_jobs_lock:
+        bulk_jobs[job.id] = job
+        finished = sorted((j for j in bulk_jobs.values() if j.finished), key=lambda j: j.finished)
+        for old in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del bulk_jobs[old.id]
+    return job
+
+def get_job(job_id):
+    with bulk_jobs_lock:
+        return bulk_jobs.get(job_id)
+
+def list_jobs(host_id=None, kind=None):
+    with bulk_jobs_lock:
+        jobs = list(bulk_jobs.values())
+    return [
+        job for job in sorted(jobs, key=lambda j: j.created, reverse=True)
+        if (host_id is None or job.host_id == host_id) and (kind is None or job.kind == kind)
+    ]
@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from firewall_utils import FirewallPolicy
+
+
+def firewall_data(cluster_rules, node_rules):
+    """A firewall snapshot of one node and one guest, with the cluster firewall on"""
+    return {
+        'cluster': {'options': {'enable': 1}, 'rules': cluster_rules, 'aliases': []},
+        'ipsets': {},
+        'groups': {},
+        'nodes': {'pve1': {'options': {}, 'rules': node_rules}},
+        'guests': {100: {'node': 'pve1', 'type': 'qemu', 'name': 'web', 'options': {'enable': 1},
+                         'rules': [], 'aliases': [], 'ipsets': {}}}
+    }
+
+
+def rule(pos, action, dport, proto='tcp'):
+    return {'pos': pos, 'type': 'in', 'action': action, 'proto': proto, 'dport': dport, 'enable': 1}
+
+
+class FirewallPolicyNodeChainTest(unittest.TestCase):
+
+    def test_node_rule_overrides_cluster_rule(self):
+        policy = FirewallPolicy(firewall_data([rule(0, 'DROP', '22')], [rule(0, 'ACCEPT', '22')]))
+        result = policy.check('node', 'pve1', port=22)
+
+        self.assertEqual(result['action'], 'ACCEPT')
+        self.assertEqual(result['rule']['scope'], 'node')
+
+    def test_cluster_rule_applies_when_node_has_none(self):
+        policy = FirewallPolicy(firewall_data([rule(0, 'DROP', '22'), rule(1, 'ACCEPT', '8006')],
+                                              [rule(0, 'ACCEPT', '443')]))
+
+        self.assertEqual(policy.check('node', 'pve1', port=22)['action'], 'DROP')
+        self.assertEqual(policy.check('node', 'pve1', port=8006)['rule']['scope'], 'cluster')
+        self.assertEqual(policy.check('node', 'pve1', port=443)['rule']['scope'], 'node')
+
+    def test_guest_chain_ignores_node_and_cluster_rules(self):
+        policy = FirewallPolicy(firewall_data([rule(0, 'ACCEPT', '22')], [rule(0, 'ACCEPT', '22')]))
+        result = policy.check('guest', 100, port=22)
+
+        self.assertTrue(result['policy'])
+        self.assertEqual(result['action'], 'DROP')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import threading
+import unittest
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notify_utils import AlertDispatcher, WebhookSink, SMTPSink
+
+
+class WebhookReceiver:
+    """Local stand-in for a webhook endpoint that records the JSON bodies it receives.
+
+    The first `failures` requests are answered with HTTP 500.
+    """
+
+    def __init__(self, failures=0):
+        self.received = []
+        self.failures = failures
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if receiver.failures > 0:
+                    receiver.failures -= 1
+                    self.send_response(500)
+                else:
+                    receiver.received.append(json.loads(body))
+                    self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SMTPReceiver:
+    """Local stand-in for an SMTP server that records message bodies, optionally slow to accept them"""
+
+    def __init__(self, delay=0):
+        self.messages = []
+        receiver = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                self.reply('220 localhost stand-in')
+                while True:
+                    line = self.rfile.readline().decode().strip()
+                    command = line.split(' ', 1)[0].upper()
+                    if not line or command == 'QUIT':
+                        self.reply('221 bye')
+                        return
+                    if command == 'DATA':
+                        self.reply('354 end with .')
+                        lines = []
+                        while True:
+                            data = self.rfile.readline().decode()
+                            if data in ('.\r\n', '.\n', ''):
+                                break
+                            lines.append(data)
+                        time.sleep(delay)
+                        receiver.messages.append(''.join(lines))
+                    self.reply('250 ok')
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_alert(alert_id, host_id='pve1', status='active'):
+    return {
+        'id': alert_id, 'host_id': host_id, 'resource': f"node/{alert_id}", 'name': f"Node {alert_id}",
+        'metric': 'cpu', 'level': 'warning', 'threshold': 80.0, 'value': 93.5, 'peak': 97.0,
+        'status': status, 'started': time.time(), 'last_seen': time.time(),
+        'resolved': time.time() if status == 'resolved' else None
+    }
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class AlertDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.webhook = WebhookReceiver()
+        self.smtp = SMTPReceiver()
+        self.dispatcher = None
+
+    def tearDown(self):
+        if self.dispatcher:
+            self.dispatcher.stop()
+        self.webhook.close()
+        self.smtp.close()
+
+    def start(self, sinks, **kwargs):
+        kwargs.setdefault('batch_window', 0.3)
+        kwargs.setdefault('min_interval', 0)
+        self.dispatcher = AlertDispatcher(sinks, **kwargs).start()
+        return self.dispatcher
+
+    def test_alerts_within_the_window_become_one_digest_per_sink(self):
+        dispatcher = self.start([WebhookSink(self.webhook.url),
+                                 SMTPSink('127.0.0.1', self.smtp.port, 'ui@localhost', ['ops@localhost'])])
+        dispatcher.enqueue('pve1', [make_alert('a'), make_alert('b')], [], [])
+        dispatcher.enqueue('pve2', [make_alert('c', host_id='pve2')], [], [])
+
+        self.assertTrue(wait_until(lambda: self.webhook.received and self.smtp.messages))
+        time.sleep(0.5)
+        self.assertEqual(len(self.webhook.received), 1)
+        self.assertEqual(len(self.smtp.messages), 1)
+        digest = self.webhook.received[0]
+        self.assertEqual(sorted(alert['id'] for alert in digest['fired']), ['a', 'b', 'c'])
+        self.assertEqual(digest['hosts'], ['pve1', 'pve2'])
+        self.assertIn('3 alert(s) fired', self.smtp.messages[0])
+
+    def test_alert_fired_and_resolved_in_one_batch_is_reported_once(self):
+        dispatcher = self.start([WebhookSink(self.webhook.url)])
+        dispatcher.enqueue('pve1', [make_alert('a')], [], [])
+        dispatcher.enqueue('pve1', [], [make_alert('a', status='resolved')], [])
+
+        self.assertTrue(wait_until(lambda: self.webhook.received))
+        digest = self.webhook.received[0]
+        self.assertEqual(digest['fired'], [])
+        self.assertEqual([alert['id'] for alert in digest['resolved']], ['a'])
+
+    def test_failed_delivery_is_retried(self):
+        self.webhook.failures = 2
+        dispatcher = self.start([WebhookSink(self.webhook.url)], retry_delay=0.1, max_attempts=5)
+        dispatcher.enqueue('pve1', [make_alert('a')], [], [])
+
+        self.assertTrue(wait_until(lambda: dispatcher.status()['stats']['webhook']['sent'] == 1))
+        stats = dispatcher.status()['stats']['webhook']
+        self.assertEqual(stats['failed'], 2)
+        self.assertEqual(stats['sent'], 1)
+        self.assertEqual(len(self.webhook.received), 1)
+
+    def test_digest_is_dropped_after_max_attempts(self):
+        self.webhook.failures = 10
+        dispatcher = self.start([WebhookSink(self.webhook.url)], retry_delay=0.05, max_attempts=2)
+        dispatcher.enqueue('pve1', [make_alert('a')], [], [])
+
+        self.assertTrue(wait_until(lambda: dispatcher.status()['stats']['webhook']['dropped'] == 1))
+        self.assertEqual(dispatcher.status()['queued']['webhook'], 0)
+        self.assertEqual(self.webhook.received, [])
+
+    def test_slow_sink_does_not_delay_the_others(self):
+        self.smtp.close()
+        self.smtp = SMTPReceiver(delay=3)
+        dispatcher = self.start([SMTPSink('127.0.0.1', self.smtp.port, 'ui@localhost', ['ops@localhost']),
+                                 WebhookSink(self.webhook.url)])
+        dispatcher.enqueue('pve1', [make_alert('a')], [], [])
+
+        started = time.time()
+        self.assertTrue(wait_until(lambda: self.webhook.received))
+        self.assertLess(time.time() - started, 2)
+        self.assertEqual(self.smtp.messages, [])
+        self.assertTrue(wait_until(lambda: self.smtp.messages))
+
+    def test_full_queue_keeps_the_digest_being_sent(self):
+        self.smtp.close()
+        self.smtp = SMTPReceiver(delay=1.5)
+        dispatcher = self.start([SMTPSink('127.0.0.1', self.smtp.port, 'ui@localhost', ['ops@localhost'])],
+                                batch_window=0.1, queue_size=1)
+        dispatcher.enqueue('pve1', [make_alert('a')], [], [])
+        self.assertTrue(wait_until(lambda: dispatcher.sending['smtp'] is not None))
+
+        # Two more digests arrive while the first is still being sent; the older of them is dropped
+        for alert_id in ('b', 'c'):
+            dispatcher.enqueue('pve1', [make_alert(alert_id)], [], [])
+            dispatcher.flush(time.time() + 1)
+        self.assertIsNotNone(dispatcher.sending['smtp'])
+        self.assertEqual(dispatcher.status()['queued']['smtp'], 2)
+        self.assertEqual(dispatcher.status()['stats']['smtp']['dropped'], 1)
+
+        self.assertTrue(wait_until(lambda: dispatcher.status()['stats']['smtp']['sent'] == 2))
+        self.assertEqual(len(self.smtp.messages), 2)
+        self.assertIn('Node a', self.smtp.messages[0])
+        self.assertIn('Node c', self.smtp.messages[1])
+        self.assertEqual(dispatcher.status()['queued']['smtp'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics_utils import MetricsRegistry
+from profile_utils import CallCoalescer
+
+
+class Response:
+    def __init__(self, body):
+        self.body = body
+        self.status_code = 200
+
+
+class CallCoalescerTest(unittest.TestCase):
+    """Cross-thread GET sharing against a send() that is held open until released"""
+
+    def setUp(self):
+        self.coalescer = CallCoalescer(MetricsRegistry())
+        self.release = threading.Event()
+        self.calls = []
+
+    def send(self, body):
+        def send():
+            self.calls.append(body)
+            self.release.wait(5)
+            return Response(body)
+        return send
+
+    def fetch_in_thread(self, body, results):
+        thread = threading.Thread(
+            target=lambda: results.append(self.coalescer.fetch('h1', '/nodes', None, self.send(body)).body))
+        thread.start()
+        return thread
+
+    def wait_for_calls(self, count):
+        for _ in range(500):
+            if len(self.calls) >= count:
+                return
+            threading.Event().wait(0.01)
+        self.fail(f"expected {count} upstream calls, saw {self.calls}")
+
+    def test_identical_gets_share_one_call(self):
+        results = []
+        first = self.fetch_in_thread('before', results)
+        self.wait_for_calls(1)
+        second = self.fetch_in_thread('unused', results)
+        threading.Event().wait(0.1)
+        self.release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(self.calls, ['before'])
+        self.assertEqual(results, ['before', 'before'])
+
+    def test_get_after_write_does_not_join_earlier_flight(self):
+        results = []
+        first = self.fetch_in_thread('before', results)
+        self.wait_for_calls(1)
+
+        # A write to the host completes while the first GET is still in flight
+        self.coalescer.invalidate('h1')
+
+        second = self.fetch_in_thread('after', results)
+        self.wait_for_calls(2)
+        self.release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(self.calls, ['before', 'after'])
+        self.assertEqual(sorted(results), ['after', 'before'])
+
+    def test_write_to_other_host_keeps_sharing(self):
+        results = []
+        first = self.fetch_in_thread('before', results)
+        self.wait_for_calls(1)
+        self.coalescer.invalidate('h2')
+        second = self.fetch_in_thread('unused', results)
+        threading.Event().wait(0.1)
+        self.release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(self.calls, ['before'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,312 @@
+import os
+import time
+import uuid
+import hashlib
+import tempfile
+import threading
+import logging
+import requests
+
+app_logger = logging.getLogger('proxima-ui')
+
+# Size of the pieces read from the source and handed to the socket
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+
+# Where resumable uploads are spooled while the browser sends them
+UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR', tempfile.gettempdir())
+
+# Idle resumable sessions are discarded after this many seconds
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 3600))
+
+UPLOAD_CONTENT_TYPES = ('iso', 'vztmpl')
+
+
+class UploadProgress:
+    """Byte counters for one upload, readable from other threads"""
+
+    def __init__(self, filename, total):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.total = total
+        self.received = 0
+        self.sent = 0
+        self.attempts = 0
+        self.status = 'pending'
+        self.error = None
+        self.upid = None
+        self.checksum = None
+        self.created = time.time()
+        self.updated = self.created
+        self.attempt_started = None
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def start_attempt(self):
+        with self.lock:
+            self.attempts += 1
+            self.sent = 0
+            self.status = 'uploading'
+            self.error = None
+            self.attempt_started = time.time()
+            self.updated = self.attempt_started
+
+    def add_sent(self, count):
+        with self.lock:
+            self.sent += count
+            self.updated = time.time()
+
+    def add_received(self, count):
+        with self.lock:
+            self.received += count
+            self.updated = time.time()
+
+    def finish(self, status, error=None, upid=None):
+        with self.lock:
+            self.status = status
+            self.error = error
+            self.upid = upid or self.upid
+            self.finished = time.time()
+            self.updated = self.finished
+
+    def to_dict(self):
+        with self.lock:
+            elapsed = (self.finished or time.time()) - self.attempt_started if self.attempt_started else 0
+            return {
+                'id': self.id,
+                'filename': self.filename,
+                'total': self.total,
+                'received': self.received,
+                'sent': self.sent,
+                'percent': round(self.sent / self.total * 100, 1) if self.total else 0,
+                'status': self.status,
+                'attempts': self.attempts,
+                'error': self.error,
+                'upid': self.upid,
+                'checksum': self.checksum,
+                'bytes_per_second': round(self.sent / elapsed) if elapsed > 0 else 0
+            }
+
+
+class MultipartUploadStream:
+    """Iterable multipart/form-data body that streams a file object in fixed-size chunks.
+
+    The total length is known up front, so requests sends a Content-Length header
+    instead of chunked transfer encoding, and only one chunk is held in memory.
+    """
+
+    def __init__(self, fileobj, filename, size, fields=None, field_name='filename',
+                 chunk_size=UPLOAD_CHUNK_SIZE, progress=None):
+        self.fileobj = fileobj
+        self.size = size
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.boundary = uuid.uuid4().hex
+
+        safe_name = os.path.basename(filename).replace('"', '')
+        parts = []
+        for name, value in (fields or {}).items():
+            parts.append(
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f'{value}\r\n'
+            )
+        parts.append(
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{safe_name}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        )
+        self.preamble = ''.join(parts).encode('utf-8')
+        self.epilogue = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return len(self.preamble) + self.size + len(self.epilogue)
+
+    def __iter__(self):
+        yield self.preamble
+
+        remaining = self.size
+        while remaining > 0:
+            chunk = self.fileobj.read(min(self.chunk_size, remaining))
+            if not chunk:
+                raise IOError(f"Upload source ended with {remaining} bytes still expected")
+            remaining -= len(chunk)
+            if self.progress:
+                self.progress.add_sent(len(chunk))
+            yield chunk
+
+        yield self.epilogue
+
+
+def stream_to_proxmox(connection, node, storage, content_type, fileobj, filename, size,
+                      progress=None, retries=3, checksum=None, timeout=(10, 600)):
+    """Stream a file into a Proxmox storage upload endpoint and return the task UPID.
+
+    Seekable sources are retried from their starting offset on network errors
+    and 5xx responses; non-seekable sources (a live request body) get one attempt.
+    """
+    resource = connection.nodes(node).storage(storage).upload
+    url = resource._store['base_url']
+    session = resource._store['session']
+
+    progress = progress or UploadProgress(filename, size)
+    seekable = hasattr(fileobj, 'seekable') and fileobj.seekable()
+    start = fileobj.tell() if seekable else 0
+
+    fields = {'content': content_type}
+    if checksum:
+        fields['checksum-algorithm'] = 'sha256'
+        fields['checksum'] = checksum
+
+    auth = session.auth
+    error = None
+    for attempt in range(1, retries + 1):
+        if seekable:
+            fileobj.seek(start)
+
+        progress.start_attempt()
+        body = MultipartUploadStream(fileobj, filename, size, fields=fields, progress=progress)
+
+        try:
+            # Bypass ProxmoxHttpSession.request, which only accepts dict payloads
+            response = requests.Session.request(
+                session, 'POST', url,
+                data=body,
+                headers={'Content-Type': body.content_type},
+                cookies=auth.get_cookies() if hasattr(auth, 'get_cookies') else None,
+                timeout=timeout
+            )
+            if response.status_code == 200:
+                upid = response.json().get('data')
+                progress.finish('done', upid=upid)
+                return upid
+
+            error = f"HTTP {response.status_code}: {response.reason} {response.text[:200]}"
+            if response.status_code < 500:
+                # Client errors (bad storage, no permission, ...) will not succeed on retry
+                break
+        except (requests.RequestException, IOError) as e:
+            error = str(e)
+
+        app_logger.warning(f"Upload of {filename} to {node}/{storage} failed (attempt {attempt}): {error}")
+        if not seekable:
+            break
+        time.sleep(min(2 ** attempt, 30))
+
+    progress.finish('failed', error=error)
+    raise Exception(f"Upload failed after {progress.attempts} attempt(s): {error}")
+
+
+class UploadSession(UploadProgress):
+    """A resumable upload spooled to disk chunk by chunk before being streamed to Proxmox"""
+
+    def __init__(self, host_id, node, storage, content_type, filename, size, verify_checksum=False):
+        super().__init__(os.path.basename(filename), size)
+        self.host_id = host_id
+        self.node = node
+        self.storage = storage
+        self.content_type = content_type
+        self.verify_checksum = verify_checksum
+        self.path = os.path.join(UPLOAD_SPOOL_DIR, f"proxima-upload-{self.id}.part")
+        self.hasher = hashlib.sha256()
+        self.write_lock = threading.Lock()
+        self.status = 'receiving'
+
+        open(self.path, 'wb').close()
+
+    def write_chunk(self, stream, offset, length):
+        """Append a chunk read from stream; offset must match the bytes received so far"""
+        with self.write_lock:
+            if offset != self.received:
+                raise ValueError(f"Expected offset {self.received}, got {offset}")
+            if self.received + length > self.total:
+                raise ValueError("Chunk extends past the declared file size")
+
+            written = 0
+            with open(self.path, 'r+b') as f:
+                f.seek(offset)
+                while written < length:
+                    data = stream.read(min(UPLOAD_CHUNK_SIZE, length - written))
+                    if not data:
+                        break
+                    f.write(data)
+                    self.hasher.update(data)
+                    written += len(data)
+
+            # A short chunk is kept; the client resumes from the reported offset
+            self.add_received(written)
+            if self.received == self.total:
+                self.checksum = self.hasher.hexdigest()
+            return self.received
+
+    @property
+    def complete(self):
+        return self.received == self.total
+
+    def claim(self, from_status):
+        """Atomically move a complete session from from_status to 'pending'"""
+        with self.lock:
+            if self.received != self.total or self.status != from_status:
+                return False
+            self.status = 'pending'
+            return True
+
+    def upload(self, connection, retries=3):
+        """Stream the spooled file to Proxmox, removing it once it has been accepted"""
+        with open(self.path, 'rb') as f:
+            upid = stream_to_proxmox(
+                connection, self.node, self.storage, self.content_type, f, self.filename, self.total,
+                progress=self, retries=retries, checksum=self.checksum if self.verify_checksum else None
+            )
+        self.discard()
+        return upid
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# Registry of uploads so the browser can poll progress and resume
+upload_sessions = {}
+upload_sessions_lock = threading.Lock()
+
+def register_upload(upload):
+    """Store an upload and drop idle sessions (and their spool files) past the TTL"""
+    now = time.time()
+    with upload_sessions_lock:
+        for upload_id, existing in list(upload_sessions.items()):
+            if now - existing.updated > UPLOAD_SESSION_TTL:
+                if isinstance(existing, UploadSession):
+                    existing.discard()
+                del upload_sessions[upload_id]
+        upload_sessions[upload.id] = upload
+    return upload
+
+def get_upload(upload_id):
+    with upload_sessions_lock:
+        return upload_sessions.get(upload_id)
+
+def remove_upload(upload_id):
+    with upload_sessions_lock:
+        upload = upload_sessions.pop(upload_id, None)
+    if isinstance(upload, UploadSession):
+        upload.discard()
+    return upload
+
+def start_background_upload(session, connection, retries=3, on_success=None):
+    """Push a completed resumable session to Proxmox in a daemon thread; on_success gets the import task's UPID"""
+    def run():
+        try:
+            upid = session.upload(connection, retries=retries)
+            app_logger.info(f"Uploaded {session.filename} to {session.node}/{session.storage}")
+            if on_success:
+                on_success(upid)
+        except Exception as e:
+            app_logger.error(f"Upload of {session.filename} failed: {str(e)}")
+
+    threading.Thread(target=run, daemon=True).start()
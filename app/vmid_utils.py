@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Proxmox accepts guest IDs in this range
+MIN_VMID = 100
+MAX_VMID = 999999999
+
+# How long a reserved VMID stays blocked if it never shows up in the inventory (seconds)
+VMID_RESERVATION_TTL = int(os.getenv('VMID_RESERVATION_TTL', 900))
+
+
+class VMIDAllocator:
+    """Hands out VMIDs that are free cluster-wide and not held by another in-flight creation.
+
+    Used IDs come from the inventory snapshot (one cluster/resources call), so picking
+    an ID costs no extra API round-trip. Reserved IDs stay blocked until they appear
+    in a later snapshot, are released, or their reservation expires.
+    """
+
+    def __init__(self, inventory, ttl=VMID_RESERVATION_TTL):
+        self.inventory = inventory
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.used = {}
+        self.synced = {}
+        self.reserved = {}
+
+    def sync(self, host_id, snapshot):
+        """Rebuild the used-ID set of a host from an inventory snapshot"""
+        used = {int(guest['vmid']) for guest in snapshot['guests'] if guest.get('vmid') is not None}
+        with self.lock:
+            self.used[host_id] = used
+            self.synced[host_id] = snapshot
+
+            # Reservations that now exist in the cluster are tracked as used IDs instead
+            reserved = self.reserved.get(host_id, {})
+            for vmid in used & reserved.keys():
+                del reserved[vmid]
+
+    def _refresh(self, host_id):
+        snapshot = self.inventory.get_snapshot(host_id)
+        with self.lock:
+            current = self.synced.get(host_id)
+        if current is not snapshot:
+            self.sync(host_id, snapshot)
+
+    def _taken(self, host_id):
+        # Callers hold self.lock
+        now = time.time()
+        reserved = self.reserved.setdefault(host_id, {})
+        for vmid in [vmid for vmid, expires in reserved.items() if expires < now]:
+            del reserved[vmid]
+        return self.used.get(host_id, set()) | reserved.keys()
+
+    def _free_ids(self, taken, count, start):
+        vmids = []
+        vmid = max(int(start or MIN_VMID), MIN_VMID)
+        while len(vmids) < count:
+            if vmid > MAX_VMID:
+                raise ValueError("No free VMIDs left in the allowed range")
+            if vmid not in taken:
+                vmids.append(vmid)
+            vmid += 1
+        return vmids
+
+    def next_free(self, host_id, start=None):
+        """Lowest free VMID at or after start, without reserving it (for form defaults)"""
+        self._refresh(host_id)
+        with self.lock:
+            return self._free_ids(self._taken(host_id), 1, start)[0]
+
+    def reserve(self, host_id, count=1, start=None):
+        """Atomically reserve count free VMIDs at or after start and return them in order"""
+        self._refresh(host_id)
+        with self.lock:
+            vmids = self._free_ids(self._taken(host_id), count, start)
+            expires = time.time() + self.ttl
+            self.reserved[host_id].update({vmid: expires for vmid in vmids})
+        return vmids
+
+    def reserve_id(self, host_id, vmid):
+        """Reserve one specific VMID, failing if it is used or already reserved"""
+        vmid = int(vmid)
+        if not MIN_VMID <= vmid <= MAX_VMID:
+            raise ValueError(f"VMID must be between {MIN_VMID} and {MAX_VMID}")
+
+        self._refresh(host_id)
+        with self.lock:
+            if vmid in self._taken(host_id):
+                raise ValueError(f"VMID {vmid} is already in use")
+            self.reserved[host_id][vmid] = time.time() + self.ttl
+        return vmid
+
+    def release(self, host_id, vmids):
+        """Give reserved VMIDs back, e.g. after a failed creation"""
+        with self.lock:
+            reserved = self.reserved.get(host_id, {})
+            for vmid in vmids:
+                reserved.pop(int(vmid), None)
+
+    @contextmanager
+    def hold(self, host_id, vmid):
+        """Reserve a specific VMID for a creation call and release it if the call fails"""
+        vmid = self.reserve_id(host_id, vmid)
+        try:
+            yield vmid
+        except Exception:
+            self.release(host_id, [vmid])
+            raise
+
+    def forget(self, host_id):
+        with self.lock:
+            self.used.pop(host_id, None)
+            self.synced.pop(host_id, None)
+            self.reserved.pop(host_id, None)
+